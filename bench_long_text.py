@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single-stream vs outline-then-parallel-sections long-form generation.
+
+Runs generate_long_text against the local stand-in server (stub_llm_server.py) with a fixed
+per-token latency, so the numbers reflect the generation strategy rather than network noise.
+Reports wall-clock time and output size for each mode, plus the outline round-trip.
+
+Usage:
+    python bench_long_text.py
+    python bench_long_text.py --token-delay-ms 8 --words 800 --sections 5 --runs 3
+    python bench_long_text.py --base-url https://api.groq.com   # real API (needs GROQ_API_KEY)
+"""
+
+import argparse
+import os
+import time
+
+import op
+from groq import Groq
+from stub_llm_server import StubLLMServer
+
+PROMPT = ("Write a detailed, well-structured essay (about 400-800 words) on 'the history of computing'. "
+          "Use clear sections, examples, and a concise introduction and conclusion.")
+
+
+def make_responder(words, sections):
+    """Scripted replies: an outline, per-section text, or the whole essay in one piece."""
+    headings = ['Introduction'] + [f'Part {i}' for i in range(1, sections - 1)] + ['Conclusion']
+
+    def body(n):
+        return ' '.join(['lorem'] * n)
+
+    def respond(messages):
+        user = messages[-1].get('content', '') if messages else ''
+        if user.startswith('Plan the structure'):
+            return "\n".join(headings)
+        if user.startswith('You are writing one section'):
+            return body(max(1, words // sections))
+        return body(words)
+
+    return respond
+
+
+def run_mode(client, mode, runs):
+    walls = []
+    text = ''
+    for _ in range(runs):
+        started = time.perf_counter()
+        text = op.generate_long_text(client, PROMPT, progress=False, call_site=f'bench_{mode}', mode=mode)
+        walls.append((time.perf_counter() - started) * 1000.0)
+    outline = [r['duration_ms'] for r in op.LLM_CALLS.get(f'bench_{mode}_outline', [])]
+    return {
+        'wall_ms': sum(walls) / len(walls),
+        'outline_ms': (sum(outline) / len(outline)) if outline else None,
+        'chars': len(text),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-stream and sectioned long-form generation")
+    parser.add_argument('--base-url', default=None, help="real/remote endpoint instead of the local stand-in")
+    parser.add_argument('--token-delay-ms', type=float, default=5.0, help="stand-in delay between streamed tokens")
+    parser.add_argument('--first-token-ms', type=float, default=150.0, help="stand-in delay before the first token")
+    parser.add_argument('--words', type=int, default=800, help="stand-in essay length in words")
+    parser.add_argument('--sections', type=int, default=5, help="stand-in outline size")
+    parser.add_argument('--runs', type=int, default=1)
+    args = parser.parse_args()
+
+    op.LLM_TRACE_FILE = ''
+    op.LLM_CACHE_ENABLED = False
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = StubLLMServer(('127.0.0.1', 0), first_token_delay=args.first_token_ms / 1000.0,
+                               token_delay=args.token_delay_ms / 1000.0,
+                               responder=make_responder(args.words, args.sections))
+        server.start()
+        base_url = server.base_url
+    client = Groq(api_key=os.getenv('GROQ_API_KEY') or 'offline', base_url=base_url)
+    try:
+        results = {mode: run_mode(client, mode, args.runs) for mode in ['stream', 'sections']}
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    print(f"{'mode':<10}{'wall ms':>10}{'outline ms':>12}{'chars':>8}")
+    for mode, row in results.items():
+        outline = f"{row['outline_ms']:>12.0f}" if row['outline_ms'] is not None else f"{'-':>12}"
+        print(f"{mode:<10}{row['wall_ms']:>10.0f}{outline}{row['chars']:>8}")
+    if results['sections']['wall_ms']:
+        print(f"\nSpeed-up: {results['stream']['wall_ms'] / results['sections']['wall_ms']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
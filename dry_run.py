@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Dry-run Nova plans on a virtual clock: no desktop side effects, no real sleeps.
+
+Each plan runs through execute_via_ai_plan with recording backends (launcher, keyboard, mouse,
+clipboard) and a simulated clock, so a whole corpus replays in milliseconds. Prints how long
+each plan would take in real time and, with --timeline, what would happen when. Use --json to
+save a baseline and diff it after changing the executor or plan rewriting.
+
+Usage:
+    python dry_run.py                                   # every recorded plan in action_log.jsonl
+    python dry_run.py --plan "ACTION: OPEN notepad\\nACTION: SLEEP 1\\nACTION: TYPE hello" --timeline
+    python dry_run.py --log action_log.jsonl --json > baseline.json
+    python dry_run.py --ready-after-ms 400             # apps/pages ready 400 ms after OPEN (readiness waits)
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+import op
+
+
+def load_plans(log_path, limit=None):
+    """(user_command, plan) pairs recorded in an action log."""
+    plans = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('plan'):
+                plans.append((entry.get('user_command') or '', entry['plan']))
+    return plans[:limit] if limit else plans
+
+
+def print_timeline(timeline):
+    for event in timeline:
+        args = ', '.join(str(a) for a in event['args'])
+        print(f"  {event['t_ms']:>9.1f} ms  {event['kind']:<9} {event['call']}({args})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Nova plans on a virtual clock with recording backends")
+    parser.add_argument('--log', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'action_log.jsonl'),
+                        help="action log to take recorded plans from")
+    parser.add_argument('--plan', default=None, help="a single plan to run ('\\n' separates lines)")
+    parser.add_argument('--limit', type=int, default=None, help="only run the first N plans")
+    parser.add_argument('--timeline', action='store_true', help="print every simulated event")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--ready-after-ms', type=float, default=None,
+                        help="simulate opened apps/pages becoming ready after this long (default: waits run in full)")
+    parser.add_argument('--verbose', action='store_true', help="show the executor's own output")
+    args = parser.parse_args()
+
+    if args.plan:
+        plans = [('', args.plan.replace('\\n', '\n'))]
+    else:
+        plans = load_plans(args.log, args.limit)
+
+    started = time.perf_counter()
+    results = []
+    for command, plan in plans:
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+            ready_after = args.ready_after_ms / 1000.0 if args.ready_after_ms is not None else None
+            result = op.dry_run_plan(plan, command, ready_after=ready_after)
+        result['user_command'] = command
+        results.append(result)
+    wall_ms = (time.perf_counter() - started) * 1000.0
+
+    if args.json:
+        print(json.dumps([{k: r[k] for k in ('user_command', 'ok', 'virtual_ms', 'timeline')} for r in results],
+                         indent=2, ensure_ascii=False))
+        return
+    for r in results:
+        print(f"{'ok ' if r['ok'] else 'FAIL'} {r['virtual_ms']:>9.1f} ms simulated  {r['user_command'] or '(plan)'}")
+        if args.timeline:
+            print_timeline(r['timeline'])
+    simulated = sum(r['virtual_ms'] for r in results)
+    print(f"\n{len(results)} plan(s): {simulated / 1000.0:.1f}s simulated in {wall_ms:.0f} ms wall clock, "
+          f"{sum(1 for r in results if not r['ok'])} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Save logged turns as named macros and replay them with no LLM calls.
+
+A macro keeps each turn's plan and the targets its OPEN steps resolved to (from action_log.jsonl),
+so replaying it skips planning and target normalization entirely. Replays report their latency
+next to the original LLM-planned runs. Macros can also be run by voice or from the floating
+window ("run macro <name>", "save the last 2 commands as macro <name>").
+
+Usage:
+    python macro.py save morning --last 3            # the last 3 replayable turns
+    python macro.py save standup --turns -5,-4,-1    # specific log entries (negative: from the end)
+    python macro.py list
+    python macro.py show morning
+    python macro.py run morning                      # really runs it (needs ENABLE_SYSTEM_CONTROL)
+    python macro.py run morning --dry-run --json     # recording backends, virtual clock
+    python macro.py delete morning
+"""
+
+import argparse
+import contextlib
+import io
+import json
+
+import op
+
+
+def print_report(report):
+    def fmt(v):
+        return f"{v:9.0f}" if v is not None else "        -"
+
+    print(f"{'step':<40}{'replay ms':>10}{'orig ms':>10}")
+    for step in report['steps']:
+        print(f"{step['command'][:39]:<40}{fmt(step['replay_ms'])} {fmt(step['original_ms'])}"
+              f"{'' if step['ok'] else '  FAILED'}")
+    print(f"{'total':<40}{fmt(report['replay_ms'])} {fmt(report['original_ms'])}")
+    if report['original_ms']:
+        print(f"\nReplay took {report['replay_ms'] / report['original_ms'] * 100:.0f}% of the original run, "
+              f"{report['llm_calls']} LLM call(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay Nova macros from the action log")
+    parser.add_argument('--file', default=op.MACROS_FILE, help="macro file (macros.json)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    save = sub.add_parser('save', help="save logged turns as a macro")
+    save.add_argument('name')
+    save.add_argument('--last', type=int, default=1, help="the last N replayable turns (default 1)")
+    save.add_argument('--turns', default=None,
+                      help="comma-separated log entry indices (0-based, negative from the end)")
+    save.add_argument('--log', default=op.ACTION_LOG_FILE, help="action log to take the turns from")
+    sub.add_parser('list', help="list saved macros")
+    show = sub.add_parser('show', help="print a macro's steps")
+    show.add_argument('name')
+    run = sub.add_parser('run', help="replay a macro")
+    run.add_argument('name')
+    run.add_argument('--dry-run', action='store_true', help="use recording backends and a virtual clock")
+    run.add_argument('--json', action='store_true', help="print the report as JSON")
+    run.add_argument('--verbose', action='store_true', help="show the executor's own output")
+    delete = sub.add_parser('delete', help="delete a macro")
+    delete.add_argument('name')
+    args = parser.parse_args()
+
+    op.MACROS = op.MacroStore(args.file)
+    if args.command == 'save':
+        indices = [int(i) for i in args.turns.split(',')] if args.turns else None
+        if op.save_macro_from_log(args.name, last=args.last, indices=indices, log_path=args.log) is None:
+            raise SystemExit("No replayable turns found in the action log")
+    elif args.command == 'list':
+        for name in op.MACROS.names():
+            steps = op.MACROS.get(name)['steps']
+            print(f"{name:<24}{len(steps):>3} step(s)  " + ' -> '.join(s['command'] for s in steps))
+    elif args.command == 'show':
+        macro = op.MACROS.get(args.name)
+        if macro is None:
+            raise SystemExit(f"No macro named '{args.name}'")
+        print(json.dumps(macro, indent=2, ensure_ascii=False))
+    elif args.command == 'run':
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+            if args.dry_run:
+                with op.DryRun():
+                    report = op.run_macro(args.name)
+            else:
+                report = op.run_macro(args.name)
+        if report is None:
+            raise SystemExit(f"No macro named '{args.name}'")
+        if args.json:
+            print(json.dumps(report, indent=2, ensure_ascii=False))
+        else:
+            print_report(report)
+    elif args.command == 'delete':
+        if not op.MACROS.delete(args.name):
+            raise SystemExit(f"No macro named '{args.name}'")
+
+
+if __name__ == '__main__':
+    main()
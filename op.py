@@ -15,15 +15,24 @@ import os
 import time
 import logging
 import threading
+import asyncio
+import contextvars
+import queue
 import numpy as np
 import requests
 import urllib.parse
 import json
 import subprocess
+import hashlib
+import random
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, deque
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, AsyncGroq, RateLimitError, InternalServerError, APIConnectionError
 import webbrowser
 import re
+from typing import Tuple
 
 
 def safe_search(pattern, string, flags=0):
@@ -68,6 +77,8 @@ FLOATING_THREAD = None
 FLOATING_STATUS_LABEL = None
 FLOATING_ENTRY = None
 FLOATING_SEND_BUTTON = None
+# Set by the floating window thread once its widgets and bindings exist
+FLOATING_READY = threading.Event()
 # Whether UI listening is enabled (toggled via right-click menu)
 UI_LISTENING_ENABLED = True
 
@@ -157,9 +168,21 @@ WAKE_WORD = os.getenv('WAKE_WORD', 'nova').lower().strip()
 MEMORY_SIZE = int(os.getenv('MEMORY_SIZE', '10'))
 SAVE_MEMORY = os.getenv('SAVE_MEMORY', 'false').lower() in ['1', 'true', 'yes']
 MEMORY_FILE = os.path.join(os.path.dirname(__file__), 'nova_memory.json')
+# Token budget for the history sent with each conversational turn (rolling summary + recent turns)
+MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '600'))
+MEMORY_SUMMARY_TOKENS = int(os.getenv('MEMORY_SUMMARY_TOKENS', '150'))
 
 # Action log for audit trail
 ACTION_LOG_FILE = os.path.join(os.path.dirname(__file__), 'action_log.jsonl')
+APP_MAPPINGS_FILE = os.path.join(os.path.dirname(__file__), 'app_mappings.json')
+
+# Plan cache: reuse ACTION plans for repeated commands instead of asking the LLM again
+PLAN_CACHE_ENABLED = os.getenv('PLAN_CACHE_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+PLAN_CACHE_FILE = os.getenv('PLAN_CACHE_FILE', os.path.join(os.path.dirname(__file__), 'plan_cache.json'))
+PLAN_CACHE_SIZE = int(os.getenv('PLAN_CACHE_SIZE', '200'))
+PLAN_CACHE_TTL = float(os.getenv('PLAN_CACHE_TTL', str(7 * 24 * 3600)))
+# Macros: named sequences of logged turns, replayed without the LLM (see macro.py)
+MACROS_FILE = os.getenv('MACROS_FILE', os.path.join(os.path.dirname(__file__), 'macros.json'))
 
 # Global flags
 stop_speaking = False
@@ -171,6 +194,22 @@ LISTEN_SUSPEND_UNTIL = 0.0
 SPOTIFY_STARTUP_SLEEP = float(os.getenv('SPOTIFY_STARTUP_SLEEP', '1.2'))
 POST_SPACE_DELAY = float(os.getenv('POST_SPACE_DELAY', '0.6'))
 DEFAULT_OPEN_SLEEP = float(os.getenv('DEFAULT_OPEN_SLEEP', '1.0'))
+# Readiness waits: after OPEN/SWITCH, a following SLEEP / WAIT_FOR_PAGE / startup delay is an upper
+# bound; the executor polls for the target window (or DOM readyState) and continues once it is ready.
+READY_WAITS = os.getenv('READY_WAITS', 'true').lower() in ['1', 'true', 'yes']
+READY_POLL_INTERVAL = float(os.getenv('READY_POLL_INTERVAL', '0.05'))
+# Grace period after the window appears, so the app accepts input
+READY_SETTLE_SECONDS = float(os.getenv('READY_SETTLE_SECONDS', '0.15'))
+WAIT_FOR_PAGE_SECONDS = float(os.getenv('WAIT_FOR_PAGE_SECONDS', '3'))
+# Learned startup latency: launch-to-ready times per app, persisted; once an app has enough samples,
+# waits after opening it use this percentile (times the margin) instead of the planned/constant delay
+STARTUP_LATENCY_ENABLED = os.getenv('STARTUP_LATENCY_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+STARTUP_LATENCY_FILE = os.getenv('STARTUP_LATENCY_FILE',
+                                 os.path.join(os.path.dirname(__file__), 'startup_latency.json'))
+STARTUP_WAIT_PERCENTILE = float(os.getenv('STARTUP_WAIT_PERCENTILE', '90'))
+STARTUP_WAIT_MARGIN = float(os.getenv('STARTUP_WAIT_MARGIN', '1.25'))
+STARTUP_MIN_SAMPLES = int(os.getenv('STARTUP_MIN_SAMPLES', '3'))
+STARTUP_MAX_SAMPLES = int(os.getenv('STARTUP_MAX_SAMPLES', '50'))
 # Whether to automatically press Alt+Tab after an OPEN completes (useful to background the opened app)
 # Default: false (do NOT Alt+Tab away automatically unless explicitly enabled)
 AUTO_ALT_TAB_AFTER_OPEN = os.getenv('AUTO_ALT_TAB_AFTER_OPEN', 'false').lower() in ['1', 'true', 'yes']
@@ -275,8 +314,11 @@ def _floating_loop(title='NOVA', width=420, height=120):
         entry = tk.Entry(root, width=48)
         entry.pack(side='left', fill='x', expand=True, padx=6, pady=6)
         # Allow pressing Enter to send the prompt
+        # Shift+Enter runs the prompt next, Ctrl+Enter replaces whatever is queued or running
         try:
             entry.bind('<Return>', lambda event: send_prompt_from_ui(entry.get()))
+            entry.bind('<Shift-Return>', lambda event: send_prompt_from_ui(entry.get(), priority=PRIORITY_HIGH))
+            entry.bind('<Control-Return>', lambda event: send_prompt_from_ui(entry.get(), supersede=True))
         except Exception:
             pass
         send_btn = tk.Button(root, text='Send', width=8, command=lambda: send_prompt_from_ui(entry.get()))
@@ -294,6 +336,8 @@ def _floating_loop(title='NOVA', width=420, height=120):
         try:
             menu = tk.Menu(root, tearoff=0)
             menu.add_command(label='Toggle Listening', command=toggle_listening)
+            menu.add_command(label='Stop', command=stop_from_ui)
+            menu.add_command(label='Clear Queue', command=lambda: COMMAND_QUEUE.clear())
             menu.add_command(label='Quit', command=lambda: stop_floating_window())
             def on_right_click(event):
                 try:
@@ -304,9 +348,12 @@ def _floating_loop(title='NOVA', width=420, height=120):
         except Exception:
             pass
 
+        FLOATING_READY.set()
         root.mainloop()
     except Exception as e:
         print(f"[FLOAT WINDOW ERROR] {e}")
+    finally:
+        FLOATING_READY.set()
 
 
 def start_floating_window(title='NOVA', width=420, height=120):
@@ -317,15 +364,14 @@ def start_floating_window(title='NOVA', width=420, height=120):
         return False
     if FLOATING_THREAD and FLOATING_THREAD.is_alive():
         return True
+    # Any root left over from a previous (finished) window thread is stale
+    FLOATING_ROOT = None
+    FLOATING_READY.clear()
     t = threading.Thread(target=_floating_loop, args=(title, width, height), daemon=True)
     FLOATING_THREAD = t
     t.start()
-    # Wait briefly for root to be created
-    timeout = 0.5
-    waited = 0.0
-    while waited < timeout and FLOATING_ROOT is None:
-        time.sleep(0.05)
-        waited += 0.05
+    # Wait briefly for the window and its bindings to be created
+    FLOATING_READY.wait(timeout=0.5)
     return FLOATING_ROOT is not None
 
 
@@ -443,77 +489,292 @@ def toggle_listening():
     return UI_LISTENING_ENABLED
 
 
-def send_prompt_from_ui(prompt: str, client=None, run_in_thread=True):
-    """Send a prompt typed in the floating window to the executor.
-    If run_in_thread=False, execute synchronously (useful for tests).
+def stop_from_ui():
+    """Stop speech, the running plan and any in-flight LLM request (floating window 'stop')."""
+    global stop_speaking
+    stop_speaking = True
+    COMMAND_QUEUE.clear('stopped')
+    cancel_running_plans('stopped')
+    cancel_llm_requests()
+    try:
+        set_floating_status('Stopped')
+    except Exception:
+        pass
+    return True
+
+
+# Typed prompts never run concurrently (mutual exclusion only: arrival order is not guaranteed)
+_UI_PROMPT_LOCK = threading.Lock()
+# Floating-window commands: one executor worker, bounded queue, duplicates coalesced
+COMMAND_QUEUE_SIZE = int(os.getenv('COMMAND_QUEUE_SIZE', '8'))
+COMMAND_COALESCE_SECONDS = float(os.getenv('COMMAND_COALESCE_SECONDS', '2'))
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+
+class QueuedCommand:
+    """One submitted prompt. `state`: queued, running, done, superseded or stopped."""
+    __slots__ = ('prompt', 'key', 'client', 'priority', 'seq', 'submitted_at', 'started_at', 'state', 'result',
+                 'coalesced', 'finished', 'run')
+
+    def __init__(self, prompt, key, client, priority, seq, run=None):
+        self.prompt = prompt
+        self.key = key
+        self.client = client
+        self.priority = priority
+        self.seq = seq
+        self.run = run
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.state = 'queued'
+        self.result = None
+        self.coalesced = 0
+        self.finished = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the command has run (or was dropped); returns its result."""
+        self.finished.wait(timeout)
+        return self.result
+
+
+class CommandQueue:
+    """Bounded queue of typed commands, executed one at a time by a single worker thread, so
+    commands never race on the app context, the clipboard or the keyboard.
+    - the same command (normalized text) submitted again within `coalesce_window` seconds of a queued
+      or running copy is merged into it
+    - PRIORITY_HIGH commands run before PRIORITY_NORMAL ones (in arrival order within a priority)
+    - `supersede` drops everything queued and cancels the running plan before queueing the command
+    `runner(command)` executes one command (unless it was submitted with its own `run`);
+    `on_change(text)` receives the status line.
     """
-    if not prompt or not prompt.strip():
-        return False
 
-    def work():
-        try:
-            # Indicate typing in the chat area and disable input while executing
+    def __init__(self, runner, maxsize=8, coalesce_window=2.0, on_change=None):
+        self.runner = runner
+        self.maxsize = maxsize
+        self.coalesce_window = coalesce_window
+        self.on_change = on_change
+        self.current = None
+        self.stats = {'submitted': 0, 'coalesced': 0, 'rejected': 0, 'dropped': 0, 'executed': 0}
+        self._queued = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._worker = None
+        self._durations = deque(maxlen=20)
+
+    def _find(self, key, now):
+        for cmd in ([self.current] if self.current else []) + self._queued:
+            if cmd.key == key and now - cmd.submitted_at <= self.coalesce_window:
+                return cmd
+        return None
+
+    def _drop_queued(self, state):
+        dropped, self._queued = self._queued, []
+        for cmd in dropped:
+            cmd.state = state
+            cmd.finished.set()
+        self.stats['dropped'] += len(dropped)
+        return dropped
+
+    def submit(self, prompt, client=None, priority=PRIORITY_NORMAL, supersede=False, run=None):
+        """Queue `prompt`. Returns its QueuedCommand (an existing one if coalesced), or None when full.
+        `run(command)`, if given, executes it instead of the queue's runner (e.g. voice commands).
+        """
+        key = normalize_command(prompt)
+        now = time.time()
+        with self._cond:
+            self.stats['submitted'] += 1
+            same = None if supersede else self._find(key, now)
+            if same is not None:
+                same.coalesced += 1
+                same.priority = min(same.priority, priority)
+                self.stats['coalesced'] += 1
+                print(f"[QUEUE] Coalesced '{prompt}' into the {same.state} copy")
+                return same
+            if supersede:
+                dropped = self._drop_queued('superseded')
+                running = cancel_running_plans('superseded')
+                if dropped or running:
+                    print(f"[QUEUE] '{prompt}' superseded {len(dropped)} queued and {running} running command(s)")
+            if len(self._queued) >= self.maxsize:
+                self.stats['rejected'] += 1
+                print(f"[QUEUE] Full ({self.maxsize}); dropped '{prompt}'")
+                return None
+            self._seq += 1
+            cmd = QueuedCommand(prompt, key, client, priority, self._seq, run)
+            self._queued.append(cmd)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True, name='nova-commands')
+                self._worker.start()
+            self._cond.notify()
+        self._changed()
+        return cmd
+
+    def clear(self, state='stopped'):
+        """Drop every queued command (the running one is left to the caller). Returns how many."""
+        with self._cond:
+            dropped = self._drop_queued(state)
+        self._changed()
+        return len(dropped)
+
+    def depth(self):
+        with self._cond:
+            return len(self._queued)
+
+    def estimated_wait(self):
+        """Seconds until the last queued command starts, from recent command durations."""
+        with self._cond:
+            if not self._durations:
+                return None
+            average = sum(self._durations) / len(self._durations)
+            wait = average * len(self._queued)
+            if self.current is not None and self.current.started_at:
+                wait += max(0.0, average - (time.time() - self.current.started_at))
+            return wait
+
+    def status_text(self):
+        depth = self.depth()
+        if self.current is None and not depth:
+            return 'Idle'
+        text = 'Running...' if self.current is not None else 'Starting...'
+        if depth:
+            wait = self.estimated_wait()
+            text += f" | {depth} queued" + (f", ~{wait:.0f}s wait" if wait is not None else '')
+        return text
+
+    def _changed(self):
+        if self.on_change:
             try:
-                set_floating_status('Typing...')
+                self.on_change(self.status_text())
             except Exception:
                 pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queued:
+                    self._cond.wait()
+                cmd = min(self._queued, key=lambda c: (c.priority, c.seq))
+                self._queued.remove(cmd)
+                cmd.state = 'running'
+                cmd.started_at = time.time()
+                self.current = cmd
+            self._changed()
             try:
-                if FLOATING_ROOT and FLOATING_ENTRY:
-                    def _ui_show_typing():
-                        try:
-                            FLOATING_ENTRY.delete(0, tk.END)
-                            FLOATING_ENTRY.insert(0, 'Typing...')
-                            FLOATING_ENTRY.config(state='disabled')
-                        except Exception:
-                            pass
+                cmd.result = (cmd.run or self.runner)(cmd)
+            except Exception as e:
+                print(f"[QUEUE ERROR] {e}")
+            with self._cond:
+                self._durations.append(time.time() - cmd.started_at)
+                self.stats['executed'] += 1
+                self.current = None
+                cmd.state = 'done'
+                cmd.finished.set()
+                idle = not self._queued
+            # The finished command's own status (e.g. '2/3 done') stays up while the queue is idle
+            if not idle:
+                self._changed()
+
+
+def _run_ui_prompt(prompt, client=None, show_typing=True):
+    """Execute one typed prompt through execute_batch and update the floating window.
+    `show_typing` disables the entry while running (the queue keeps it open for further prompts).
+    """
+    try:
+        # Indicate typing in the chat area and disable input while executing
+        try:
+            if show_typing:
+                set_floating_status('Typing...')
+        except Exception:
+            pass
+        try:
+            if show_typing and FLOATING_ROOT and FLOATING_ENTRY:
+                def _ui_show_typing():
                     try:
-                        FLOATING_ROOT.after(0, _ui_show_typing)
+                        FLOATING_ENTRY.delete(0, tk.END)
+                        FLOATING_ENTRY.insert(0, 'Typing...')
+                        FLOATING_ENTRY.config(state='disabled')
                     except Exception:
-                        _ui_show_typing()
-            except Exception:
-                pass
-            c = client
-            if not c:
+                        pass
                 try:
-                    c = create_nova()
+                    FLOATING_ROOT.after(0, _ui_show_typing)
                 except Exception:
-                    c = None
-            # Use execute_via_ai_plan to run system actions if possible
-            res = execute_via_ai_plan(c, prompt)
+                    _ui_show_typing()
+        except Exception:
+            pass
+        c = client
+        if not c:
             try:
-                set_floating_status('Idle')
+                # Shared, pre-warmed client: no new TLS handshake per typed prompt
+                c = create_nova()
             except Exception:
-                pass
-            # Restore entry to focus and clear typing indicator
-            try:
-                if FLOATING_ROOT and FLOATING_ENTRY:
-                    def _ui_clear_and_focus():
-                        try:
-                            FLOATING_ENTRY.config(state='normal')
-                            FLOATING_ENTRY.delete(0, tk.END)
-                            FLOATING_ENTRY.focus_set()
-                        except Exception:
-                            pass
+                c = None
+        # Run system actions via the batch executor (one planning call for compound prompts)
+        with _UI_PROMPT_LOCK:
+            results = execute_batch(c, prompt)
+        res = bool(results) and all(r['ok'] for r in results)
+        try:
+            done = sum(1 for r in results if r['ok'])
+            set_floating_status('Idle' if res or len(results) == 1 else f'{done}/{len(results)} done')
+        except Exception:
+            pass
+        # Restore entry to focus and clear typing indicator
+        try:
+            if show_typing and FLOATING_ROOT and FLOATING_ENTRY:
+                def _ui_clear_and_focus():
                     try:
-                        FLOATING_ROOT.after(0, _ui_clear_and_focus)
+                        FLOATING_ENTRY.config(state='normal')
+                        FLOATING_ENTRY.delete(0, tk.END)
+                        FLOATING_ENTRY.focus_set()
                     except Exception:
-                        _ui_clear_and_focus()
-            except Exception:
-                pass
-            return res
-        except Exception as e:
-            print(f"[FLOAT SEND ERROR] {e}")
-            try:
-                set_floating_status('Idle')
-            except Exception:
-                pass
-            return False
+                        pass
+                try:
+                    FLOATING_ROOT.after(0, _ui_clear_and_focus)
+                except Exception:
+                    _ui_clear_and_focus()
+        except Exception:
+            pass
+        return res
+    except Exception as e:
+        print(f"[FLOAT SEND ERROR] {e}")
+        try:
+            set_floating_status('Idle')
+        except Exception:
+            pass
+        return False
+
+
+COMMAND_QUEUE = CommandQueue(lambda cmd: _run_ui_prompt(cmd.prompt, cmd.client, show_typing=False),
+                             COMMAND_QUEUE_SIZE, COMMAND_COALESCE_SECONDS, on_change=set_floating_status)
 
-    if run_in_thread:
-        threading.Thread(target=work, daemon=True).start()
-        return True
-    else:
-        return work()
+
+def _clear_floating_entry():
+    try:
+        if FLOATING_ROOT and FLOATING_ENTRY:
+            FLOATING_ROOT.after(0, lambda: FLOATING_ENTRY.delete(0, tk.END))
+    except Exception:
+        pass
+
+
+def send_prompt_from_ui(prompt: str, client=None, run_in_thread=True, priority=PRIORITY_NORMAL, supersede=None):
+    """Send a prompt typed in the floating window to the executor.
+    If run_in_thread=False, execute synchronously (useful for tests).
+    Typing 'stop' aborts the running request instead of starting a new one.
+    Otherwise the prompt joins COMMAND_QUEUE (run one at a time by its worker): `priority`
+    PRIORITY_HIGH runs it next, `supersede` (default PLAN_SUPERSEDE) replaces everything queued or running.
+    Compound prompts run through execute_batch.
+    """
+    if not prompt or not prompt.strip():
+        return False
+    if prompt.strip().lower() == 'stop':
+        return stop_from_ui()
+    if not run_in_thread:
+        return _run_ui_prompt(prompt, client)
+    cmd = COMMAND_QUEUE.submit(prompt, client, priority, PLAN_SUPERSEDE if supersede is None else supersede)
+    if cmd is None:
+        set_floating_status(f'Queue full ({COMMAND_QUEUE.maxsize})')
+        return False
+    _clear_floating_entry()
+    return True
 
 def search_duckduckgo(query):
     """
@@ -699,781 +960,3202 @@ def get_voice_input(language='en', duration=10):
         print(f"[ERROR] {e}", flush=True)
         return None
 
-def create_nova():
-    """Initialize Groq client"""
+
+# Shared LLM client: one pooled HTTP connection reused by every call site
+LLM_KEEPALIVE_INTERVAL = float(os.getenv('LLM_KEEPALIVE_INTERVAL', '45'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '120'))
+_SHARED_CLIENT = None
+_SHARED_CLIENT_LOCK = threading.Lock()
+_LLM_WARMUP_THREAD = None
+# Async layer: streams run on one background event loop so "stop" can abort them mid-flight
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+# Per-call-site deadlines overriding LLM_TIMEOUT, e.g. "planner=10,resolve_target=6"
+LLM_DEADLINES = {
+    site.strip(): float(secs)
+    for site, _, secs in (item.partition('=')
+                          for item in os.getenv('LLM_DEADLINES', 'planner=15,resolve_target=8').split(','))
+    if site.strip() and secs.strip()
+}
+# Request policy: hedge to a secondary model when the first token is late; back off on 429/5xx
+LLM_FALLBACK_MODEL = os.getenv('LLM_FALLBACK_MODEL', 'llama-3.3-70b-versatile').strip()
+LLM_HEDGE_AFTER_MS = float(os.getenv('LLM_HEDGE_AFTER_MS', '1200'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '8'))
+_LLM_LOOP = None
+_LLM_LOOP_LOCK = threading.Lock()
+_ASYNC_CLIENTS = {}
+_INFLIGHT_LLM = set()
+_LLM_CANCEL_EPOCH = 0
+# Per-call-site instrumentation: every LLM call is appended to LLM_TRACE_FILE ('' disables the trace)
+LLM_TRACE_FILE = os.getenv('LLM_TRACE_FILE', os.path.join(os.path.dirname(__file__), 'llm_trace.jsonl'))
+LLM_CALL_HISTORY = int(os.getenv('LLM_CALL_HISTORY', '200'))
+LLM_CALLS = {}
+# LLM calls started in this process (every call site), e.g. to check that a macro replay made none
+LLM_CALLS_STARTED = 0
+# The call currently being made in this thread/task; the httpx hooks count its HTTP attempts (retries)
+_LLM_CALL = contextvars.ContextVar('nova_llm_call', default=None)
+# Content-addressed response cache under stream_chat (memory LRU + on-disk tier)
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'llm_cache'))
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '256'))
+LLM_CACHE_DISK_MB = float(os.getenv('LLM_CACHE_DISK_MB', '20'))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+# Call sites that are never cached: conversation and creative writing (essays, stories, code) must vary,
+# plans depend on the app context (the planner has its own PlanCache). A site's outline/section calls
+# ('essay_section') follow the site.
+LLM_CACHE_SKIP_SITES = {s.strip() for s in os.getenv(
+    'LLM_CACHE_SKIP_SITES',
+    'planner,batch_planner,conversation,hey,memory_summary,long_text,essay,write,code,topic_code'
+).split(',') if s.strip()}
+_LAST_LLM_ACTIVITY = 0.0
+# Counters for connection reuse and time-to-first-token (see get_llm_stats)
+_LLM_STATS_LOCK = threading.Lock()
+LLM_STATS = {
+    'requests': 0,
+    'connections_opened': 0,
+    'connections_reused': 0,
+    'keepalive_pings': 0,
+    'ttft_ms': deque(maxlen=200),
+}
+
+
+def _trace_llm_request(request, is_async=False):
+    """httpx request hook: note whether the pooled connection had to be (re)opened."""
+    state = {'new_connection': False}
+
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            state['new_connection'] = True
+
+    async def atrace(event_name, info):
+        trace(event_name, info)
+
+    # httpcore requires a coroutine trace callback on async transports
+    request.extensions['trace'] = atrace if is_async else trace
+    request.extensions['nova_conn'] = state
+    call = _LLM_CALL.get()
+    if call is not None:
+        call['http_requests'] += 1
+
+
+def _trace_llm_response(response):
+    """httpx response hook: count opened vs reused connections."""
+    global _LAST_LLM_ACTIVITY
+    state = response.request.extensions.get('nova_conn')
+    if state is None:
+        return
+    _LAST_LLM_ACTIVITY = time.time()
+    with _LLM_STATS_LOCK:
+        if state['new_connection']:
+            LLM_STATS['connections_opened'] += 1
+        else:
+            LLM_STATS['connections_reused'] += 1
+
+
+def _record_ttft(started_at, call=None):
+    """Record time-to-first-token for a request started at `started_at` (time.time())."""
+    if call is not None:
+        call['first_token_at'] = time.time()
+    with _LLM_STATS_LOCK:
+        LLM_STATS['requests'] += 1
+        LLM_STATS['ttft_ms'].append((time.time() - started_at) * 1000.0)
+
+
+def get_llm_stats():
+    """Return a snapshot of the shared client's counters (connection reuse, TTFT)."""
+    with _LLM_STATS_LOCK:
+        ttft = list(LLM_STATS['ttft_ms'])
+        stats = {k: v for k, v in LLM_STATS.items() if k != 'ttft_ms'}
+    total = stats['connections_opened'] + stats['connections_reused']
+    stats['reuse_ratio'] = (stats['connections_reused'] / total) if total else 0.0
+    stats['ttft_last_ms'] = ttft[-1] if ttft else None
+    stats['ttft_avg_ms'] = (sum(ttft) / len(ttft)) if ttft else None
+    stats['response_cache'] = RESPONSE_CACHE.stats()
+    return stats
+
+
+def _build_groq_client():
     api_key = os.getenv('GROQ_API_KEY')
     if not api_key:
         raise ValueError("GROQ_API_KEY not found in .env")
-    return Groq(api_key=api_key)
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        event_hooks={'request': [_trace_llm_request], 'response': [_trace_llm_response]},
+    )
+    return Groq(api_key=api_key, http_client=http_client)
 
-def get_ai_response(client, messages, language='en', preprompt=None):
-    """
-    Get response from Groq AI
-    Automatically responds in the same language as input
-    """
-    model = os.getenv('GROQ_MODEL', 'llama-3.1-8b-instant')
-    temperature = float(os.getenv('TEMPERATURE', '0.7'))
-    max_tokens = int(os.getenv('MAX_TOKENS', '200'))
-    top_p = float(os.getenv('TOP_P', '1'))
-    
-    # Build dynamic system prompt based on environment settings
-    friendly = os.getenv('VOICE_FRIENDLY_TONE', 'true').lower() in ['1', 'true', 'yes']
-    enable_reasoning = os.getenv('ENABLE_REASONING', 'false').lower() in ['1', 'true', 'yes']
-    tone_instr = "Be casual, friendly, and talk like a helpful friend." if friendly else "Be professional and concise."
-    # If reasoning is enabled, allow a single short 'Reason:' sentence. Otherwise explicitly forbid any chain-of-thought.
-    if enable_reasoning:
-        reasoning_instr = " After your short answer, include one brief sentence labeled 'Reason:' explaining your reasoning in one line. Do NOT reveal internal chain-of-thought beyond this." 
-    else:
-        reasoning_instr = " Do NOT provide chain-of-thought, internal reasoning, or 'Reason:' lines. Only provide the short final answer."
 
-    system_content = (
-        f"You are Nova, a helpful AI assistant. Keep responses SHORT (1-2 sentences). {tone_instr}{reasoning_instr} "
-        f"Respond in {'Hindi' if language == 'hi' else 'English'}."
-    )
-    # If a preprompt is provided, include it before the system content to guide the model
-    if preprompt:
-        system_content = preprompt + "\n" + system_content
+async def _atrace_llm_request(request):
+    _trace_llm_request(request, is_async=True)
 
-    system_prompt = {"role": "system", "content": system_content}
 
-    # Build message list
-    msg_list = [system_prompt]
-    msg_list.extend(messages)
-    
-    completion = client.chat.completions.create(
-        model=model,
-        messages=msg_list,
-        temperature=temperature,
-        max_completion_tokens=max_tokens,
-        top_p=top_p,
-        stream=True,
-        stop=None
+async def _atrace_llm_response(response):
+    _trace_llm_response(response)
+
+
+def _build_async_groq_client(api_key, base_url=None):
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        event_hooks={'request': [_atrace_llm_request], 'response': [_atrace_llm_response]},
     )
-    
-    # Stream response
-    full_response = ""
-    print("[NOVA] ", end="", flush=True)
-    
-    for chunk in completion:
-        if chunk.choices[0].delta.content:
-            content = chunk.choices[0].delta.content
-            print(content, end="", flush=True)
-            full_response += content
-    
-    print()
-    return full_response
+    # Retries are done by the request policy in _apump_chat (backoff, Retry-After, hedging)
+    return AsyncGroq(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
 
 
-def generate_long_text(client, prompt_text, language='en', progress=True, progress_step_chars=200):
-    """Generate longer-form content (stories, novels, essays) using the AI model.
-    Streams the response and prints periodic progress updates when `progress=True`.
-    Respects environment variable LONG_MAX_TOKENS for size (default 800).
+def create_nova():
+    """Return the process-wide Groq client, creating it on first use.
+    Every call site shares this client so requests reuse one pooled, already-warm connection.
     """
-    model = os.getenv('GROQ_MODEL', 'llama-3.1-8b-instant')
-    temperature = float(os.getenv('TEMPERATURE', '0.7'))
-    long_max = int(os.getenv('LONG_MAX_TOKENS', '800'))
+    global _SHARED_CLIENT
+    with _SHARED_CLIENT_LOCK:
+        if _SHARED_CLIENT is None:
+            _SHARED_CLIENT = _build_groq_client()
+        return _SHARED_CLIENT
 
-    system_content = (
-        f"You are Nova, a creative writing assistant. Produce a polished, multi-paragraph piece based on the user's request. "
-        f"Keep content coherent and in the user's language ({'Hindi' if language=='hi' else 'English'}). Do NOT include meta commentary or 'Reason:' lines."
-    )
-    messages = [
-        {"role": "system", "content": system_content},
-        {"role": "user", "content": prompt_text}
-    ]
 
-    # Try streaming response for progress
+def _llm_warmup_loop():
+    """Create the shared client, open its connection, then keep it warm while idle."""
+    global _LAST_LLM_ACTIVITY
     try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_completion_tokens=long_max,
-            stream=True
-        )
+        client = create_nova()
+    except Exception as e:
+        print(f"[LLM WARMUP ERROR] {e}")
+        return
+    while True:
+        if time.time() - _LAST_LLM_ACTIVITY >= LLM_KEEPALIVE_INTERVAL:
+            try:
+                # Cheap authenticated GET; keeps the TLS connection the streams use alive
+                run_llm_coroutine(get_async_client(client).models.list(), timeout=LLM_TIMEOUT)
+                with _LLM_STATS_LOCK:
+                    LLM_STATS['keepalive_pings'] += 1
+            except Exception as e:
+                logger.debug(f"LLM keep-alive ping failed: {e}")
+                _LAST_LLM_ACTIVITY = time.time()
+        if LLM_KEEPALIVE_INTERVAL <= 0:
+            return
+        time.sleep(max(1.0, LLM_KEEPALIVE_INTERVAL / 3))
 
-        text = ''
-        next_progress = progress_step_chars
-        for chunk in completion:
+
+def start_llm_warmup():
+    """Pre-warm the shared LLM client in a background thread (idempotent)."""
+    global _LLM_WARMUP_THREAD
+    if _LLM_WARMUP_THREAD and _LLM_WARMUP_THREAD.is_alive():
+        return True
+    if not os.getenv('GROQ_API_KEY'):
+        return False
+    t = threading.Thread(target=_llm_warmup_loop, daemon=True)
+    _LLM_WARMUP_THREAD = t
+    t.start()
+    return True
+
+
+class LLMCancelled(Exception):
+    """Raised when an in-flight LLM request is aborted by cancel_llm_requests()."""
+
+
+class LLMTimeout(Exception):
+    """Raised when an LLM request does not finish within LLM_TIMEOUT seconds."""
+
+
+class TextSinkError(Exception):
+    """Raised when the `on_text` consumer of a streamed generation fails; the stream is aborted."""
+
+
+def _get_llm_loop():
+    """Return the background asyncio loop that runs all async LLM requests."""
+    global _LLM_LOOP
+    with _LLM_LOOP_LOCK:
+        if _LLM_LOOP is None or _LLM_LOOP.is_closed():
+            loop = asyncio.new_event_loop()
+            t = threading.Thread(target=loop.run_forever, name='nova-llm-loop', daemon=True)
+            t.start()
+            _LLM_LOOP = loop
+        return _LLM_LOOP
+
+
+def run_llm_coroutine(coro, timeout=None):
+    """Run `coro` on the LLM loop from synchronous code and return its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, _get_llm_loop())
+    return future.result(timeout)
+
+
+def get_async_client(client=None):
+    """Return the shared AsyncGroq client matching `client`'s key/base URL (default: create_nova())."""
+    if client is None:
+        client = create_nova()
+    key = (client.api_key, str(client.base_url))
+    with _SHARED_CLIENT_LOCK:
+        if key not in _ASYNC_CLIENTS:
+            _ASYNC_CLIENTS[key] = _build_async_groq_client(client.api_key, client.base_url)
+        return _ASYNC_CLIENTS[key]
+
+
+def cancel_llm_requests():
+    """Abort every in-flight LLM stream (async and sync). Returns the number of async requests cancelled."""
+    global _LLM_CANCEL_EPOCH
+    _LLM_CANCEL_EPOCH += 1
+    with _LLM_STATS_LOCK:
+        pending = list(_INFLIGHT_LLM)
+    cancelled = 0
+    for future in pending:
+        if future.cancel():
+            cancelled += 1
+    if cancelled:
+        print(f"[LLM] Cancelled {cancelled} in-flight request(s)")
+    return cancelled
+
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before retry `attempt` (0-based): the server's Retry-After, else exponential backoff."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    retry_after = headers.get('retry-after')
+    if retry_after is not None:
+        try:
+            return min(max(0.0, float(retry_after)), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(LLM_BACKOFF_BASE * (2 ** attempt), LLM_BACKOFF_MAX) * random.uniform(1.0, 1.25)
+
+
+def _has_content(chunk):
+    try:
+        return bool(chunk.choices and chunk.choices[0].delta.content)
+    except (AttributeError, IndexError):
+        return False
+
+
+async def _hedged_stream(async_client, out, kwargs, call=None):
+    """Run the request policy for one streamed call and forward the winning attempt's chunks to `out`.
+    The primary model starts first; if no token has arrived after LLM_HEDGE_AFTER_MS (or it is
+    rate limited / failing) the same request goes to LLM_FALLBACK_MODEL, and whichever attempt
+    produces the first token wins while the other is cancelled. 429, 5xx and connection errors
+    are retried with exponential backoff, honouring Retry-After, until an attempt has won. Any
+    other error (bad request, auth) fails the call at once, without starting the fallback.
+    """
+    primary = kwargs.get('model')
+    fallback = LLM_FALLBACK_MODEL if LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != primary else None
+    state = {'winner': None, 'fatal': False}
+    wake = asyncio.Event()
+
+    async def attempt(model):
+        retries = 0
+        while True:
             try:
-                if chunk.choices[0].delta.content:
-                    text += chunk.choices[0].delta.content
-                    if progress and len(text) >= next_progress:
-                        print(f"[PROGRESS] Generated {len(text)} chars...", flush=True)
-                        next_progress += progress_step_chars
+                stream = await async_client.chat.completions.create(stream=True, **dict(kwargs, model=model))
+                try:
+                    async for chunk in stream:
+                        if state['winner'] is None:
+                            if not _has_content(chunk):
+                                continue
+                            state['winner'] = model
+                            wake.set()
+                            # Stop the losing attempt right away (frees its connection and quota)
+                            for other in tasks:
+                                if other is not asyncio.current_task():
+                                    other.cancel()
+                        elif state['winner'] != model:
+                            return None
+                        out.put(('chunk', chunk))
+                finally:
+                    # Closing the stream releases (or aborts) the HTTP response immediately
+                    await stream.close()
+                if state['winner'] is None:
+                    # Empty completion: still a (trivial) answer
+                    state['winner'] = model
+                    wake.set()
+                return model
+            except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                if state['winner'] is not None or retries >= LLM_MAX_RETRIES:
+                    wake.set()
+                    raise
+                delay = _retry_delay(e, retries)
+                retries += 1
+                print(f"[LLM] {model}: {type(e).__name__}, retrying in {delay:.1f}s")
+                # A throttled primary should not hold up the hedge
+                wake.set()
+                await asyncio.sleep(delay)
             except Exception:
-                # non-streamed or unexpected format; ignore and continue
+                # Not worth a hedge: the fallback would get the same answer
+                state['fatal'] = True
+                wake.set()
+                raise
+
+    tasks = [asyncio.create_task(attempt(primary))]
+    try:
+        if fallback:
+            try:
+                await asyncio.wait_for(wake.wait(), LLM_HEDGE_AFTER_MS / 1000.0)
+            except asyncio.TimeoutError:
                 pass
+            if state['winner'] is None and not state['fatal']:
+                if call is not None:
+                    call['hedged'] = True
+                tasks.append(asyncio.create_task(attempt(fallback)))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    if state['winner'] is not None and task is tasks[0 if state['winner'] == primary else -1]:
+                        raise task.exception()
+                elif task.result() is not None and task.result() == state['winner']:
+                    if call is not None:
+                        call['model'] = state['winner']
+                        if state['winner'] != primary:
+                            print(f"[LLM] {call.get('call_site')}: fallback model {state['winner']} answered first")
+                    return
+        raise error or RuntimeError("LLM request produced no answer")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
-        return text.strip()
-    except Exception:
-        # Fallback to non-streamed behavior
-        try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_completion_tokens=long_max,
-                stream=False
-            )
+
+async def _apump_chat(async_client, out, timeout, kwargs, call=None):
+    """Stream a chat completion on the LLM loop, pushing chunks into the thread-safe queue `out`."""
+    _LLM_CALL.set(call)
+
+    try:
+        await asyncio.wait_for(_hedged_stream(async_client, out, kwargs, call), timeout)
+    except asyncio.TimeoutError:
+        out.put(('error', LLMTimeout(f"LLM request timed out after {timeout:.0f}s")))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        out.put(('error', e))
+
+
+def _stream_chat_async(client, timeout, kwargs):
+    out = queue.Queue()
+    pump = _apump_chat(get_async_client(client), out, timeout, kwargs, _LLM_CALL.get())
+    future = asyncio.run_coroutine_threadsafe(pump, _get_llm_loop())
+    with _LLM_STATS_LOCK:
+        _INFLIGHT_LLM.add(future)
+    future.add_done_callback(lambda f: out.put(('end', None)))
+    try:
+        while True:
+            kind, payload = out.get()
+            if kind == 'chunk':
+                yield payload
+            elif kind == 'error':
+                raise payload
+            else:
+                if future.cancelled():
+                    raise LLMCancelled("LLM request cancelled")
+                return
+    finally:
+        with _LLM_STATS_LOCK:
+            _INFLIGHT_LLM.discard(future)
+        # Consumer stopped early (exception or generator closed): abort the request too
+        if not future.done():
+            future.cancel()
+
+
+def _stream_chat_sync(client, timeout, kwargs):
+    epoch = _LLM_CANCEL_EPOCH
+    deadline = time.time() + timeout
+    completion = client.chat.completions.create(stream=True, **kwargs)
+    try:
+        for chunk in completion:
+            if _LLM_CANCEL_EPOCH != epoch:
+                raise LLMCancelled("LLM request cancelled")
+            if time.time() > deadline:
+                raise LLMTimeout(f"LLM request timed out after {timeout:.0f}s")
+            yield chunk
+    finally:
+        close = getattr(completion, 'close', None)
+        if callable(close):
             try:
-                return completion.choices[0].message.content.strip()
+                close()
             except Exception:
-                text = ''
-                for chunk in completion:
-                    if chunk.choices[0].delta.content:
-                        text += chunk.choices[0].delta.content
-                return text.strip()
-        except Exception as e:
-            print(f"[GENERATE ERROR] {e}")
-            return ''
+                pass
 
 
-def execute_via_ai_plan(client, user_command, language='en'):
-    """
-    Universal executor: Ask AI to plan and output executable actions for any user command.
-    The AI will produce a structured plan that Nova then executes.
-    Returns True if execution succeeded or was attempted.
+class ResponseCache:
+    """Content-addressed cache of completed LLM responses: an in-memory LRU over an on-disk tier.
+    Keys hash the endpoint, model, messages, temperature and token limits. Disk entries are one
+    JSON file per key under `directory`, evicted oldest-first above `max_disk_bytes`; both tiers
+    honour `ttl`. Hit/miss counts are kept overall and per call site.
     """
-    global CURRENT_APP_CONTEXT, LAST_OPENED_TARGET
-
-    if not system_control_enabled():
-        return False
 
-    try:
-        print(f"[DEBUG EXECUTE] user_command='{user_command}'")
-        # Read configurable delays from environment at runtime so tests can override them
-        startup_sleep = float(os.getenv('SPOTIFY_STARTUP_SLEEP', str(SPOTIFY_STARTUP_SLEEP)))
-        post_space_delay = float(os.getenv('POST_SPACE_DELAY', str(POST_SPACE_DELAY)))
-        default_open_sleep = float(os.getenv('DEFAULT_OPEN_SLEEP', str(DEFAULT_OPEN_SLEEP)))
-        # ------ Special-case: direct essay/document generation commands ------
-        # Support variants: 'write essay on X' -> open notepad and write
-        #                 'type essay on X'  -> type into current focus
-        m = re.match(r"^\s*(write|type)\s+(esaay|essay|article|document)\s+on\s+(.+)$", user_command, flags=re.IGNORECASE)
-        if m:
-            verb = m.group(1).lower()
-            topic = m.group(3).strip()
-            # Need an AI client to generate long content
-            if not client:
-                print("[ESSAY ERROR] AI client required to generate long content.")
-                speak("I need the AI client configured to write long content. Please set GROQ_API_KEY.", language)
-                return False
+    def __init__(self, directory, max_entries=256, max_disk_bytes=20 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.by_site = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint, request):
+        raw = json.dumps({
+            'endpoint': endpoint,
+            'model': request.get('model'),
+            'messages': request.get('messages'),
+            'temperature': request.get('temperature'),
+            'max_completion_tokens': request.get('max_completion_tokens'),
+            'top_p': request.get('top_p'),
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _count(self, call_site, hit):
+        site = self.by_site.setdefault(call_site or 'unknown', {'hits': 0, 'misses': 0})
+        site['hits' if hit else 'misses'] += 1
+
+    def get(self, key, call_site=None):
+        """Return the cached response text for `key`, or None (counts a hit or a miss)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry['created'] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                self._count(call_site, True)
+                return entry['text']
+            if entry:
+                del self._entries[key]
+        entry = None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            if entry and now - entry.get('created', 0) <= self.ttl:
+                self._remember(key, entry)
+                self.disk_hits += 1
+                self._count(call_site, True)
+                return entry['text']
+            self.misses += 1
+            self._count(call_site, False)
+        if entry:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+        return None
 
-            # Build a rich prompt for long-form content, allow code if mentioned
-            prompt = (
-                f"Write a detailed, well-structured essay (about 400-800 words) on '{topic}'. "
-                "Use clear sections, examples, and a concise introduction and conclusion. "
-                "If the topic requests code or examples, include appropriate code blocks. "
-                f"Respond in {'Hindi' if language == 'hi' else 'English'}."
-            )
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, text, call_site=None):
+        entry = {'text': text, 'call_site': call_site, 'created': time.time()}
+        with self._lock:
+            self._remember(key, entry)
+            self.stores += 1
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self._path(key) + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+            self._enforce_disk_cap()
+        except Exception as e:
+            logger.debug(f"Response cache write failed: {e}")
 
+    def _enforce_disk_cap(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
             try:
-                content = generate_long_text(client, prompt, language=language)
-                if not content:
-                    print("[ESSAY ERROR] AI returned empty content")
-                    return False
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
 
-                # If user asked to 'write', open notepad first and then paste
-                if verb == 'write':
-                    open_path('notepad')
-                    time.sleep(1.2)
-                    set_clipboard_and_paste(content)
-                    print(f"[EXECUTED] WROTE essay on '{topic}' to Notepad")
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
                     try:
-                        set_floating_focus()
-                    except Exception:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
                         pass
-                    return True
 
-                # If user asked to 'type', paste into current focus
-                set_clipboard_and_paste(content)
-                print(f"[EXECUTED] TYPED essay on '{topic}' into current focus")
-                try:
-                    set_floating_focus()
-                except Exception:
-                    pass
-                return True
-            except Exception as e:
-                print(f"[ESSAY ERROR] {e}")
-                return False
-        # Special-case: 'type code' -> generate code snippet and type into current focus
-        # Specific: 'type a <topic> code' or 'type <topic> code' -> pure code only (no comments/explanations)
-        m_topic_code = re.match(r"^\s*type\s+(?:a\s+)?(.+?)\s+code\s*$", user_command, flags=re.IGNORECASE)
-        if m_topic_code:
-            topic = m_topic_code.group(1).strip()
-            if not client:
-                print("[TYPE CODE ERROR] AI client required to generate code.")
-                speak("I need the AI client configured to generate code. Please set GROQ_API_KEY.", language)
-                return False
-            # Ask AI for pure code only
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        with self._lock:
+            by_site = {}
+            for site, v in self.by_site.items():
+                seen = v['hits'] + v['misses']
+                by_site[site] = dict(v, hit_ratio=v['hits'] / seen if seen else 0.0)
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'hit_ratio': (hits / total) if total else 0.0,
+            'by_site': by_site,
+        }
+
+
+RESPONSE_CACHE = ResponseCache(LLM_CACHE_DIR, max_entries=LLM_CACHE_SIZE,
+                               max_disk_bytes=int(LLM_CACHE_DISK_MB * 1024 * 1024), ttl=LLM_CACHE_TTL)
+
+
+class _CachedDelta:
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        self.content = content
+
+
+class _CachedChoice:
+    __slots__ = ('delta',)
+
+    def __init__(self, content):
+        self.delta = _CachedDelta(content)
+
+
+class _CachedChunk:
+    """Minimal stand-in for a streamed ChatCompletionChunk, used to replay cached responses."""
+    __slots__ = ('choices', 'usage', 'x_groq')
+
+    def __init__(self, content):
+        self.choices = [_CachedChoice(content)]
+        self.usage = None
+        self.x_groq = None
+
+
+def _replay_cached(text):
+    """Yield a cached response as word-sized chunks so the normal print/progress path handles it."""
+    for piece in re.findall(r"\S+\s*|\s+", text):
+        yield _CachedChunk(piece)
+
+
+def _caching_stream(stream, key, call_site):
+    """Pass chunks through and store the full text once the stream completes normally."""
+    parts = []
+    try:
+        for chunk in stream:
+            try:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+            except (AttributeError, IndexError):
+                pass
+            yield chunk
+    finally:
+        # Closing early (error, cancel) must also close/abort the underlying request
+        close = getattr(stream, 'close', None)
+        if callable(close):
+            close()
+    if parts:
+        RESPONSE_CACHE.put(key, ''.join(parts), call_site)
+
+
+def _response_cache_key(client, call, kwargs):
+    """Cache key for this request, or None when it must not be cached."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    call_site = call.get('call_site') if call else None
+    if call_site in LLM_CACHE_SKIP_SITES:
+        return None
+    if call_site and call_site.rsplit('_', 1)[-1] in ('outline', 'section') \
+            and call_site.rsplit('_', 1)[0] in LLM_CACHE_SKIP_SITES:
+        return None
+    # The endpoint is part of the address; clients without one (test doubles) are never cached
+    endpoint = getattr(client, 'base_url', None)
+    if endpoint is None:
+        return None
+    return ResponseCache.make_key(str(endpoint), kwargs)
+
+
+def stream_chat(client, timeout=None, **kwargs):
+    """Stream chat-completion chunks for `client` with a per-call timeout and "stop" cancellation.
+    Groq clients are driven through the shared AsyncGroq client on the LLM loop; any other
+    client object (e.g. a test double) is iterated synchronously with the same checks.
+    Byte-identical requests are answered from RESPONSE_CACHE, replayed as ordinary chunks.
+    """
+    call = _LLM_CALL.get()
+    call_site = call.get('call_site') if call else None
+    if timeout is None:
+        timeout = LLM_DEADLINES.get(call_site, LLM_TIMEOUT)
+    key = _response_cache_key(client, call, kwargs)
+    if key is not None:
+        text = RESPONSE_CACHE.get(key, call_site)
+        if text is not None:
+            if call is not None:
+                call['cached'] = True
+            return _replay_cached(text)
+    if isinstance(client, Groq):
+        stream = _stream_chat_async(client, timeout, kwargs)
+    else:
+        stream = _stream_chat_sync(client, timeout, kwargs)
+    if key is not None:
+        return _caching_stream(stream, key, call_site)
+    return stream
+
+
+def estimate_tokens(text) -> int:
+    """Rough token count (~4 characters per token) used when the API reports no usage."""
+    if not text:
+        return 0
+    return max(1, (len(text) + 3) // 4)
+
+
+def _chunk_usage(chunk):
+    """Token usage attached to a streamed chunk (Groq sends it on the last chunk), or None."""
+    usage = getattr(chunk, 'usage', None)
+    if usage is None:
+        usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+    return usage
+
+
+def _usage_counts(reported, msg_list, response_text):
+    """(prompt_tokens, completion_tokens, estimated) from reported usage, estimating if missing."""
+    prompt_tokens = getattr(reported, 'prompt_tokens', None) if reported is not None else None
+    completion_tokens = getattr(reported, 'completion_tokens', None) if reported is not None else None
+    estimated = not isinstance(prompt_tokens, int) or not isinstance(completion_tokens, int)
+    if estimated:
+        prompt_tokens = sum(estimate_tokens(str(m.get('content', ''))) for m in msg_list)
+        completion_tokens = estimate_tokens(response_text)
+    return prompt_tokens, completion_tokens, estimated
+
+
+def _fill_usage(usage_out, reported, msg_list, response_text):
+    """Write prompt/completion token counts into `usage_out`, estimating them if not reported."""
+    if usage_out is None:
+        return
+    prompt_tokens, completion_tokens, estimated = _usage_counts(reported, msg_list, response_text)
+    usage_out.update({'prompt': prompt_tokens, 'completion': completion_tokens, 'estimated': estimated})
+
+
+def _begin_llm_call(call_site, model, msg_list):
+    """Start timing one LLM call; the returned record is finished by _finish_llm_call()."""
+    global LLM_CALLS_STARTED
+    with _LLM_STATS_LOCK:
+        LLM_CALLS_STARTED += 1
+    call = {
+        'call_site': call_site,
+        'model': model,
+        'requested_model': model,
+        'messages': msg_list,
+        'started_at': time.time(),
+        'first_token_at': None,
+        'http_requests': 0,
+        'error': None,
+    }
+    call['_token'] = _LLM_CALL.set(call)
+    return call
+
+
+def _finish_llm_call(call, response_text, reported=None, error=None):
+    """Close an LLM call record: add it to the rolling per-call-site stats and the JSONL trace."""
+    try:
+        _LLM_CALL.reset(call.pop('_token'))
+    except (KeyError, ValueError):
+        pass
+    done_at = time.time()
+    prompt_tokens, completion_tokens, estimated = _usage_counts(reported, call.pop('messages', []), response_text)
+    first_token_at = call['first_token_at']
+    stream_s = done_at - first_token_at if first_token_at else 0.0
+    record = {
+        'timestamp': call['started_at'],
+        'call_site': call['call_site'],
+        'model': call['model'],
+        'ttft_ms': round((first_token_at - call['started_at']) * 1000.0, 1) if first_token_at else None,
+        'duration_ms': round((done_at - call['started_at']) * 1000.0, 1),
+        'tokens_per_sec': round(completion_tokens / stream_s, 1) if stream_s > 0 and response_text else None,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens if response_text else 0,
+        'estimated': estimated,
+        'requested_model': call.get('requested_model', call['model']),
+        'hedged': call.get('hedged', False),
+        'retries': max(0, call['http_requests'] - (2 if call.get('hedged') else 1)),
+        'cached': call.get('cached', False),
+        'error': error if error is not None else call['error'],
+    }
+    if isinstance(record['error'], BaseException):
+        record['error'] = f"{type(record['error']).__name__}: {record['error']}"
+    with _LLM_STATS_LOCK:
+        LLM_CALLS.setdefault(record['call_site'], deque(maxlen=LLM_CALL_HISTORY)).append(record)
+    if LLM_TRACE_FILE:
+        try:
+            with open(LLM_TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.debug(f"LLM trace write failed: {e}")
+    return record
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of `values` (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize_llm_calls(records):
+    """Per-call-site summary (count, errors, retries, TTFT/duration percentiles, tokens/sec, tokens)."""
+    by_site = {}
+    for r in records:
+        by_site.setdefault(r.get('call_site') or 'unknown', []).append(r)
+    summary = {}
+    for site, rows in by_site.items():
+        ttft = [r['ttft_ms'] for r in rows if r.get('ttft_ms') is not None]
+        duration = [r['duration_ms'] for r in rows if r.get('duration_ms') is not None]
+        rates = [r['tokens_per_sec'] for r in rows if r.get('tokens_per_sec')]
+        summary[site] = {
+            'calls': len(rows),
+            'errors': sum(1 for r in rows if r.get('error')),
+            'cached': sum(1 for r in rows if r.get('cached')),
+            'retries': sum(r.get('retries') or 0 for r in rows),
+            'models': sorted({r.get('model') for r in rows if r.get('model')}),
+            'ttft_p50_ms': _percentile(ttft, 50),
+            'ttft_p95_ms': _percentile(ttft, 95),
+            'duration_p50_ms': _percentile(duration, 50),
+            'duration_p95_ms': _percentile(duration, 95),
+            'duration_total_ms': round(sum(duration), 1),
+            'tokens_per_sec_avg': round(sum(rates) / len(rates), 1) if rates else None,
+            'prompt_tokens': sum(r.get('prompt_tokens') or 0 for r in rows),
+            'completion_tokens': sum(r.get('completion_tokens') or 0 for r in rows),
+        }
+    return summary
+
+
+def get_llm_call_summary():
+    """Rolling per-call-site summary of the most recent LLM calls in this process."""
+    with _LLM_STATS_LOCK:
+        records = [r for rows in LLM_CALLS.values() for r in rows]
+    return summarize_llm_calls(records)
+
+
+def _persona_system_prompt(language='en'):
+    """Nova's conversational persona (short, friendly answers) for the given language."""
+    # Build dynamic system prompt based on environment settings
+    friendly = os.getenv('VOICE_FRIENDLY_TONE', 'true').lower() in ['1', 'true', 'yes']
+    enable_reasoning = os.getenv('ENABLE_REASONING', 'false').lower() in ['1', 'true', 'yes']
+    tone_instr = "Be casual, friendly, and talk like a helpful friend." if friendly else "Be professional and concise."
+    # If reasoning is enabled, allow a single short 'Reason:' sentence. Otherwise explicitly forbid any chain-of-thought.
+    if enable_reasoning:
+        reasoning_instr = " After your short answer, include one brief sentence labeled 'Reason:' explaining your reasoning in one line. Do NOT reveal internal chain-of-thought beyond this." 
+    else:
+        reasoning_instr = " Do NOT provide chain-of-thought, internal reasoning, or 'Reason:' lines. Only provide the short final answer."
+
+    return (
+        f"You are Nova, a helpful AI assistant. Keep responses SHORT (1-2 sentences). {tone_instr}{reasoning_instr} "
+        f"Respond in {'Hindi' if language == 'hi' else 'English'}."
+    )
+
+
+def get_ai_response(client, messages, language='en', preprompt=None, on_token=None, echo=True,
+                    persona=True, usage=None, call_site='conversation'):
+    """
+    Get response from Groq AI
+    Automatically responds in the same language as input
+    `on_token` (optional) is called with each streamed chunk as it arrives; `echo=False` skips printing it.
+    `persona=False` sends only `preprompt` as the system prompt (no conversational persona text).
+    If a dict is passed as `usage`, prompt/completion token counts are written into it.
+    The call is timed and traced under `call_site` (see get_llm_call_summary).
+    """
+    model = os.getenv('GROQ_MODEL', 'llama-3.1-8b-instant')
+    temperature = float(os.getenv('TEMPERATURE', '0.7'))
+    max_tokens = int(os.getenv('MAX_TOKENS', '200'))
+    top_p = float(os.getenv('TOP_P', '1'))
+    
+    system_content = _persona_system_prompt(language) if persona else ''
+    # If a preprompt is provided, include it before the system content to guide the model
+    if preprompt:
+        system_content = (preprompt + "\n" + system_content) if system_content else preprompt
+
+    system_prompt = {"role": "system", "content": system_content}
+
+    # Build message list
+    msg_list = [system_prompt]
+    msg_list.extend(messages)
+    
+    started_at = time.time()
+    call = _begin_llm_call(call_site, model, msg_list)
+    full_response = ""
+    reported_usage = None
+    try:
+        completion = stream_chat(
+            client,
+            model=model,
+            messages=msg_list,
+            temperature=temperature,
+            max_completion_tokens=max_tokens,
+            top_p=top_p,
+            stop=None
+        )
+
+        # Stream response
+        if echo:
+            print("[NOVA] ", end="", flush=True)
+
+        for chunk in completion:
+            reported_usage = _chunk_usage(chunk) or reported_usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                content = chunk.choices[0].delta.content
+                if not full_response:
+                    _record_ttft(started_at, call)
+                if echo:
+                    print(content, end="", flush=True)
+                full_response += content
+                if on_token:
+                    on_token(content)
+    except Exception as e:
+        _finish_llm_call(call, full_response, reported_usage, error=e)
+        raise
+
+    if echo:
+        print()
+    _finish_llm_call(call, full_response, reported_usage)
+    _fill_usage(usage, reported_usage, msg_list, full_response)
+    return full_response
+
+
+def _long_text_system_prompt(language='en'):
+    return (
+        f"You are Nova, a creative writing assistant. Produce a polished, multi-paragraph piece based on the user's request. "
+        f"Keep content coherent and in the user's language ({'Hindi' if language=='hi' else 'English'}). Do NOT include meta commentary or 'Reason:' lines."
+    )
+
+
+def generate_long_text(client, prompt_text, language='en', progress=True, progress_step_chars=200,
+                       call_site='long_text', mode=None, max_tokens=None, on_text=None):
+    """Generate longer-form content (stories, novels, essays) using the AI model.
+    Streams the response and prints periodic progress updates when `progress=True`.
+    Respects environment variable LONG_MAX_TOKENS for size (default 800).
+    `mode='sections'` asks for an outline first and writes the sections concurrently
+    (see generate_sectioned_text); the default single stream is `mode='stream'` (LONG_TEXT_MODE).
+    `on_text` (optional) receives the text as it is produced (e.g. ProgressivePaster.feed).
+    The call is timed and traced under `call_site` (see get_llm_call_summary).
+    """
+    if (mode or LONG_TEXT_MODE) == 'sections':
+        return generate_sectioned_text(client, prompt_text, language, progress=progress, call_site=call_site,
+                                       max_tokens=max_tokens, on_text=on_text)
+    model = os.getenv('GROQ_MODEL', 'llama-3.1-8b-instant')
+    messages = [
+        {"role": "system", "content": _long_text_system_prompt(language)},
+        {"role": "user", "content": prompt_text}
+    ]
+    call = _begin_llm_call(call_site, model, messages)
+    text = ''
+    try:
+        text = _stream_long_text(client, call, model, messages, progress, progress_step_chars, max_tokens, on_text)
+    finally:
+        _finish_llm_call(call, text, call.get('usage'))
+    return text
+
+
+def _stream_long_text(client, call, model, messages, progress=True, progress_step_chars=200, max_tokens=None,
+                      on_text=None):
+    temperature = float(os.getenv('TEMPERATURE', '0.7'))
+    long_max = max_tokens or int(os.getenv('LONG_MAX_TOKENS', '800'))
+
+    # Try streaming response for progress
+    try:
+        started_at = call['started_at']
+        completion = stream_chat(
+            client,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_completion_tokens=long_max,
+        )
+
+        text = ''
+        next_progress = progress_step_chars
+        for chunk in completion:
+            try:
+                call['usage'] = _chunk_usage(chunk) or call.get('usage')
+                delta = chunk.choices[0].delta.content
+            except Exception:
+                # non-streamed or unexpected format; ignore and continue
+                continue
+            if not delta:
+                continue
+            if not text:
+                _record_ttft(started_at, call)
+            text += delta
+            if on_text:
+                try:
+                    on_text(delta)
+                except Exception as e:
+                    # the consumer (e.g. the paster) failed: stop generating instead of writing into the void
+                    print(f"[GENERATE ERROR] Output handler failed after {len(text)} chars: {e}")
+                    close = getattr(completion, 'close', None)
+                    if close:
+                        close()
+                    raise TextSinkError(e) from e
+            if progress and len(text) >= next_progress:
+                print(f"[PROGRESS] Generated {len(text)} chars...", flush=True)
+                next_progress += progress_step_chars
+
+        return text.strip()
+    except TextSinkError as e:
+        call['error'] = e
+        raise
+    except LLMCancelled as e:
+        call['error'] = e
+        print("[GENERATE] Cancelled")
+        return ''
+    except LLMTimeout as e:
+        call['error'] = e
+        print(f"[GENERATE ERROR] {e}")
+        return ''
+    except Exception as e:
+        # Fallback to non-streamed behavior
+        call['error'] = e
+        try:
+            completion = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_completion_tokens=long_max,
+                stream=False
+            )
+            call['error'] = None
+            try:
+                return completion.choices[0].message.content.strip()
+            except Exception:
+                text = ''
+                for chunk in completion:
+                    if chunk.choices[0].delta.content:
+                        text += chunk.choices[0].delta.content
+                return text.strip()
+        except Exception as e:
+            call['error'] = e
+            print(f"[GENERATE ERROR] {e}")
+            return ''
+
+
+# Outline-then-sections generation for long pieces (generate_long_text(mode='sections'))
+LONG_TEXT_MODE = os.getenv('LONG_TEXT_MODE', 'stream').lower()
+ESSAY_GENERATION_MODE = os.getenv('ESSAY_GENERATION_MODE', 'sections').lower()
+LONG_SECTION_WORKERS = int(os.getenv('LONG_SECTION_WORKERS', '4'))
+LONG_MAX_SECTIONS = int(os.getenv('LONG_MAX_SECTIONS', '6'))
+LONG_OUTLINE_TOKENS = int(os.getenv('LONG_OUTLINE_TOKENS', '120'))
+_SECTION_POOL = None
+_SECTION_POOL_LOCK = threading.Lock()
+
+
+def _get_section_pool():
+    global _SECTION_POOL
+    with _SECTION_POOL_LOCK:
+        if _SECTION_POOL is None:
+            _SECTION_POOL = ThreadPoolExecutor(max_workers=max(1, LONG_SECTION_WORKERS),
+                                               thread_name_prefix='nova-section')
+        return _SECTION_POOL
+
+
+def parse_outline(text, max_sections=None):
+    """Section headings from an outline reply (bullets, numbering and markdown stripped)."""
+    max_sections = max_sections or LONG_MAX_SECTIONS
+    headings = []
+    for line in (text or '').splitlines():
+        heading = re.sub(r"^\s*(?:[-*•#]+|\d+[.)]|[ivxIVX]+[.)])\s*", '', line).strip().strip('*').strip()
+        if heading and not heading.endswith(':') and heading.lower() not in [h.lower() for h in headings]:
+            headings.append(heading)
+    return headings[:max_sections]
+
+
+def generate_sectioned_text(client, prompt_text, language='en', progress=True, call_site='long_text', max_tokens=None,
+                            on_text=None):
+    """Outline first, then write every section concurrently and stitch them in outline order.
+    The first section is usually ready long before a single stream of the whole piece would be;
+    `on_text` receives each section as soon as it and all earlier ones are done.
+    Falls back to one stream if the outline is unusable or every section comes back empty.
+    """
+    long_max = max_tokens or int(os.getenv('LONG_MAX_TOKENS', '800'))
+    cancel_epoch = _LLM_CANCEL_EPOCH
+    outline_prompt = (
+        f"Plan the structure for this request: {prompt_text}\n"
+        f"Reply with 3-{LONG_MAX_SECTIONS} section headings (introduction and conclusion included), "
+        "one per line, with no numbering, descriptions or other text."
+    )
+    outline = generate_long_text(client, outline_prompt, language, progress=False, call_site=f'{call_site}_outline',
+                                 mode='stream', max_tokens=LONG_OUTLINE_TOKENS)
+    headings = parse_outline(outline)
+    if _LLM_CANCEL_EPOCH != cancel_epoch:
+        return ''
+    if len(headings) < 2:
+        print("[GENERATE] Outline unusable; generating as a single stream")
+        return generate_long_text(client, prompt_text, language, progress=progress, call_site=call_site,
+                                  mode='stream', max_tokens=max_tokens, on_text=on_text)
+    if progress:
+        print(f"[PROGRESS] Outline: {len(headings)} sections", flush=True)
+
+    outline_text = "\n".join(f"- {h}" for h in headings)
+    section_max = max(120, long_max // len(headings))
+
+    def write_section(index, heading):
+        section_prompt = (
+            f"You are writing one section of a longer piece.\nFull request: {prompt_text}\n"
+            f"Outline:\n{outline_text}\n"
+            f"Write ONLY the section '{heading}' ({section_max * 3 // 4} words at most), starting with the heading "
+            "on its own line. Do not repeat material that belongs to the other sections."
+        )
+        text = generate_long_text(client, section_prompt, language, progress=False, call_site=f'{call_site}_section',
+                                  mode='stream', max_tokens=section_max)
+        if progress:
+            print(f"[PROGRESS] Section {index + 1}/{len(headings)} done ({len(text)} chars)", flush=True)
+        return text
+
+    pool = _get_section_pool()
+    futures = [pool.submit(write_section, i, h) for i, h in enumerate(headings)]
+    sections = []
+    for future in futures:
+        try:
+            sections.append(future.result())
+        except Exception as e:
+            print(f"[GENERATE ERROR] Section failed: {e}")
+            sections.append('')
+        if on_text and sections[-1] and sections[-1].strip():
+            on_text(sections[-1].strip() + "\n\n")
+    text = "\n\n".join(sec.strip() for sec in sections if sec and sec.strip())
+    if not text and _LLM_CANCEL_EPOCH == cancel_epoch:
+        return generate_long_text(client, prompt_text, language, progress=progress, call_site=call_site,
+                                  mode='stream', max_tokens=max_tokens, on_text=on_text)
+    return text
+
+
+class ConversationMemory:
+    """Bounded conversation history: recent turns verbatim plus a rolling summary of older ones.
+    messages() never exceeds the token budget, even before compaction has caught up; compact()
+    folds the turns that no longer fit into the summary and is meant to run off the hot path
+    (see compact_async), after the response has been spoken.
+    """
+
+    def __init__(self, client=None, path=None, max_messages=None, token_budget=None, summary_tokens=None):
+        self.client = client
+        self.path = path
+        self.max_messages = max_messages or MEMORY_SIZE
+        self.token_budget = token_budget or MEMORY_TOKEN_BUDGET
+        self.summary_tokens = summary_tokens or MEMORY_SUMMARY_TOKENS
+        self.summary = ''
+        self.compactions = 0
+        self._messages = []
+        self._lock = threading.Lock()
+        self._compact_thread = None
+
+    def load(self):
+        """Load history from `path`; accepts the old plain-list format of nova_memory.json."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            data = {'summary': '', 'messages': data}
+        with self._lock:
+            self.summary = data.get('summary') or ''
+            self._messages = [m for m in data.get('messages', []) if isinstance(m, dict) and m.get('content')]
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {'summary': self.summary, 'messages': list(self._messages)}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def add(self, role, content):
+        with self._lock:
+            self._messages.append({'role': role, 'content': content or ''})
+
+    def _summary_message(self):
+        return {'role': 'system', 'content': f"Summary of the earlier conversation: {self.summary}"}
+
+    def _split(self):
+        """(overflow, recent): the newest messages that fit the budget, and the older rest."""
+        # The summary's share is reserved up front, so compacting never pushes more turns out
+        budget = self.token_budget - self.summary_tokens
+        recent = []
+        used = 0
+        for m in reversed(self._messages):
+            cost = estimate_tokens(m['content'])
+            # The latest message is always sent, however long
+            if recent and (used + cost > budget or len(recent) >= self.max_messages):
+                break
+            recent.insert(0, m)
+            used += cost
+        return self._messages[:len(self._messages) - len(recent)], recent
+
+    def messages(self):
+        """History for the next request: the rolling summary (if any) plus the recent turns that fit."""
+        with self._lock:
+            _, recent = self._split()
+            return ([self._summary_message()] if self.summary else []) + recent
+
+    def needs_compaction(self):
+        with self._lock:
+            return bool(self._split()[0])
+
+    def _summarize(self, overflow):
+        turns = "\n".join(f"{m['role']}: {m['content']}" for m in overflow)
+        max_words = max(20, int(self.summary_tokens * 0.75))
+        if self.client is not None:
             prompt = (
-                f"Provide ONLY runnable code (no comments, no explanations, no markdown fences) that implements: {topic}. "
-                "Return only the code output, nothing else."
+                f"Update the running summary of a conversation between a user and the assistant Nova. "
+                f"Keep the facts, names, preferences and open requests; drop pleasantries and step lists. "
+                f"Reply with the summary only, at most {max_words} words.\n"
+                f"Current summary: {self.summary or '(none)'}\nNew turns:\n{turns}"
             )
             try:
-                raw = generate_long_text(client, prompt, language=language)
-                if not raw:
-                    print("[TYPE CODE ERROR] AI returned empty content")
-                    return False
+                text = get_ai_response(self.client, [{'role': 'user', 'content': prompt}], echo=False, persona=False,
+                                       call_site='memory_summary')
+                if text and text.strip():
+                    return text.strip()
+            except Exception as e:
+                print(f"[MEMORY ERROR] Summarization failed: {e}")
+        # Offline fallback: keep the first line of each older turn
+        lines = [self.summary] if self.summary else []
+        lines += [f"{m['role']}: {m['content'].strip().splitlines()[0][:120]}"
+                  for m in overflow if m['content'].strip()]
+        return " | ".join(lines)
+
+    def compact(self):
+        """Fold messages that no longer fit the budget into the rolling summary. Returns True if it compacted."""
+        with self._lock:
+            overflow, _ = self._split()
+            overflow = list(overflow)
+        if not overflow:
+            return False
+        summary = self._summarize(overflow)
+        # Bound the summary itself so the per-turn prompt stays flat
+        max_chars = self.summary_tokens * 4
+        if len(summary) > max_chars:
+            summary = summary[-max_chars:]
+        with self._lock:
+            # Only appends happen concurrently, so the folded messages are still the oldest ones
+            del self._messages[:len(overflow)]
+            self.summary = summary
+            self.compactions += 1
+        return True
 
-                # Strip markdown fences and common comment styles
-                def strip_code(text: str) -> str:
-                    # Remove triple backtick fences and leading language tags
-                    text = re.sub(r"^```[a-zA-Z0-9+-]*\n", "", text)
-                    text = re.sub(r"\n```$", "", text)
-                    # Remove any fenced blocks like ```python ... ``` anywhere
-                    text = re.sub(r"```[\s\S]*?```", lambda m: re.sub(r"^```[a-zA-Z0-9+-]*\n|\n```$", "", m.group(0)), text)
-                    # Remove common single-line comment prefixes
-                    out_lines = []
-                    in_block = False
-                    for line in text.splitlines():
-                        s = line.strip()
-                        if s.startswith('/*'):
-                            in_block = True
-                            continue
-                        if in_block:
-                            if '*/' in s:
-                                in_block = False
-                            continue
-                        if s.startswith('//') or s.startswith('#') or s.startswith('--'):
-                            continue
-                        out_lines.append(line)
-                    cleaned = '\n'.join(out_lines).strip()
-                    # Remove any leftover fence markers
-                    cleaned = cleaned.replace('```', '')
-                    # Also remove lines that are only backticks
-                    cleaned = '\n'.join([ln for ln in cleaned.splitlines() if ln.strip() != '```'])
-                    return cleaned.strip()
-
-                content = strip_code(raw)
-                if not content:
-                    print("[TYPE CODE ERROR] Content empty after stripping comments/fences")
-                    return False
-                set_clipboard_and_paste(content)
-                print(f"[EXECUTED] TYPED pure code for '{topic}' into current focus")
-                try:
-                    set_floating_focus()
-                except Exception:
-                    pass
-                return True
+    def compact_async(self):
+        """Compact and persist in a background thread (no-op if a compaction is already running)."""
+        if self._compact_thread and self._compact_thread.is_alive():
+            return self._compact_thread
+
+        def work():
+            try:
+                self.compact()
+                self.save()
             except Exception as e:
-                print(f"[TYPE CODE ERROR] {e}")
+                print(f"[MEMORY ERROR] {e}")
+
+        t = threading.Thread(target=work, daemon=True)
+        self._compact_thread = t
+        t.start()
+        return t
+
+
+def _file_fingerprint(path):
+    """Short content hash of a file ('' if missing); used to invalidate caches when it changes."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:16]
+    except Exception:
+        return ''
+
+
+def normalize_command(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so equivalent commands share a key."""
+    s = re.sub(r"\s+", " ", (text or '').lower()).strip()
+    return s.rstrip('.!?, ')
+
+
+class PlanCache:
+    """LRU + TTL cache of AI action plans, persisted to disk as JSON.
+    Entries are keyed on (normalized command, app context, language). The whole cache is
+    dropped when its fingerprint (meta-instruction + app_mappings.json) changes.
+    """
+
+    def __init__(self, path, max_entries=200, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._fingerprint = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(user_command, app_context, language):
+        raw = json.dumps([normalize_command(user_command), app_context or '', language or 'en'])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        self._loaded = True
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._fingerprint = data.get('fingerprint')
+                self._entries = OrderedDict(data.get('entries', {}))
+        except Exception as e:
+            print(f"[PLAN CACHE] Could not load {self.path}: {e}")
+            self._entries = OrderedDict()
+
+    def _save(self):
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'fingerprint': self._fingerprint, 'entries': self._entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[PLAN CACHE] Could not save {self.path}: {e}")
+
+    def _check_fingerprint(self, fingerprint):
+        if not self._loaded:
+            self._load()
+        if self._fingerprint != fingerprint:
+            # Planner prompt or app mappings changed: every stored plan is stale
+            self._entries.clear()
+            self._fingerprint = fingerprint
+
+    def get(self, key, fingerprint):
+        """Return the cached plan text for `key`, or None (counts a hit or a miss)."""
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            entry = self._entries.get(key)
+            if entry and time.time() - entry.get('created', 0) <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.get('plan')
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, fingerprint, plan_text, user_command=''):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._entries[key] = {'plan': plan_text, 'command': normalize_command(user_command), 'created': time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': (self.hits / total) if total else 0.0}
+
+
+PLAN_CACHE = PlanCache(PLAN_CACHE_FILE, max_entries=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL)
+
+
+# Local intent grammar: deterministic commands are matched here and never reach the LLM planner
+INTENTS_FILE = os.path.join(os.path.dirname(__file__), 'intents.json')
+_INTENT_GRAMMAR = None
+_INTENT_GRAMMAR_MTIME = None
+_INTENT_STATS_LOCK = threading.Lock()
+INTENT_STATS = {'lookups': 0, 'hits': {}}
+
+
+def strip_code_text(text: str) -> str:
+    """Strip markdown fences and comment-only lines from generated code."""
+    # Remove triple backtick fences and leading language tags
+    text = re.sub(r"^```[a-zA-Z0-9+-]*\n", "", text)
+    text = re.sub(r"\n```$", "", text)
+    # Remove any fenced blocks like ```python ... ``` anywhere
+    text = re.sub(r"```[\s\S]*?```", lambda m: re.sub(r"^```[a-zA-Z0-9+-]*\n|\n```$", "", m.group(0)), text)
+    # Remove common single-line comment prefixes
+    out_lines = []
+    in_block = False
+    for line in text.splitlines():
+        s = line.strip()
+        if s.startswith('/*'):
+            in_block = True
+            continue
+        if in_block:
+            if '*/' in s:
+                in_block = False
+            continue
+        if s.startswith('//') or s.startswith('#') or s.startswith('--'):
+            continue
+        out_lines.append(line)
+    cleaned = '\n'.join(out_lines).strip()
+    # Remove any leftover fence markers
+    cleaned = cleaned.replace('```', '')
+    # Also remove lines that are only backticks
+    cleaned = '\n'.join([ln for ln in cleaned.splitlines() if ln.strip() != '```'])
+    return cleaned.strip()
+
+
+# Progressive paste: complete paragraphs are pasted while later ones are still generating
+PROGRESSIVE_PASTE = os.getenv('PROGRESSIVE_PASTE', 'true').lower() in ['1', 'true', 'yes']
+# Seconds to wait for focus to return to the target window before giving up on the rest
+PASTE_FOCUS_WAIT = float(os.getenv('PASTE_FOCUS_WAIT', '5'))
+
+
+def _active_window_title():
+    """Title of the foreground window, or None when it cannot be determined."""
+    if not HAS_PYGETWINDOW:
+        return None
+    try:
+        w = gw.getActiveWindow()
+        return w.title if w else None
+    except Exception:
+        return None
+
+
+def _remaining_text(full_text, pasted):
+    """Part of `full_text` after the already pasted prefix (whitespace-insensitive), or None if they diverge."""
+    target = re.sub(r"\s+", '', pasted)
+    j = 0
+    for i, ch in enumerate(full_text):
+        if j == len(target):
+            return full_text[i:].lstrip()
+        if ch.isspace():
+            continue
+        if ch != target[j]:
+            return None
+        j += 1
+    return '' if j == len(target) else None
+
+
+class ProgressivePaster:
+    """Pastes streamed long-form text into the focused window one complete paragraph at a time.
+    feed() buffers text until a paragraph ends; a single worker pastes paragraphs in order once
+    start() has captured the target window. Pasting pauses while another window has focus and
+    gives up after PASTE_FOCUS_WAIT seconds; "stop" (cancel_llm_requests) or abort() end it cleanly.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.first_paste_at = None
+        self.pasted_chars = 0
+        self.paragraphs = 0
+        self.aborted = False
+        self.focus_lost = False
+        self._buffer = ''
+        self._queued = ''
+        self._focus_title = None
+        self._epoch = _LLM_CANCEL_EPOCH
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def feed(self, text):
+        """Add generated text; every complete paragraph is queued for pasting."""
+        if self.aborted or not text:
+            return
+        with self._lock:
+            self._buffer += text
+            if not self._queued:
+                self._buffer = self._buffer.lstrip()
+            idx = self._buffer.rfind('\n\n')
+            if idx <= 0 or not self._buffer[:idx].strip():
+                return
+            piece = self._buffer[:idx + 2]
+            self._buffer = self._buffer[idx + 2:]
+            self._queued += piece
+        self._queue.put(piece)
+
+    def start(self):
+        """Begin pasting into the window that currently has focus."""
+        self._focus_title = _active_window_title()
+        self._ready.set()
+
+    def abort(self):
+        self.aborted = True
+        self._ready.set()
+        self._queue.put(None)
+
+    def _cancelled(self):
+        if _LLM_CANCEL_EPOCH != self._epoch:
+            self.aborted = True
+        return self.aborted
+
+    def _wait_for_focus(self):
+        if self._focus_title is None:
+            return True
+        deadline = time.time() + PASTE_FOCUS_WAIT
+        warned = False
+        while True:
+            title = _active_window_title()
+            if title is None or title == self._focus_title:
+                return True
+            if not warned:
+                print(f"[PASTE] Focus moved to '{title}'; waiting for '{self._focus_title}'...")
+                warned = True
+            if time.time() > deadline or self._cancelled():
                 return False
+            time.sleep(0.1)
+
+    def _run(self):
+        self._ready.wait()
+        while True:
+            piece = self._queue.get()
+            if piece is None:
+                return
+            if self._cancelled():
+                continue
+            if not self._wait_for_focus():
+                self.focus_lost = True
+                self.aborted = True
+                print("[PASTE] Focus did not return; stopped pasting")
+                continue
+            set_clipboard_and_paste(piece)
+            if self.first_paste_at is None:
+                self.first_paste_at = time.time()
+            self.pasted_chars += len(piece)
+            self.paragraphs += 1
+
+    def finish(self, full_text):
+        """Paste whatever `full_text` has beyond the pasted paragraphs and wait until done.
+        Returns True if the whole text was pasted.
+        """
+        if not self._ready.is_set():
+            self.start()
+        with self._lock:
+            queued = self._queued
+        tail = full_text if not queued else _remaining_text(full_text, queued)
+        if tail is None:
+            print("[PASTE] Final text differs from the streamed paragraphs; remainder not pasted")
+        elif tail.strip() and not self.aborted:
+            self._queue.put(tail)
+        self._queue.put(None)
+        self._worker.join()
+        return tail is not None and not self.aborted
+
+    def summary(self):
+        return {
+            'paragraphs': self.paragraphs,
+            'chars': self.pasted_chars,
+            'first_paste_ms': round((self.first_paste_at - self.started_at) * 1000.0) if self.first_paste_at else None,
+            'aborted': self.aborted,
+            'focus_lost': self.focus_lost,
+        }
+
+
+def _generate_and_paste(client, prompt, language, call_site, mode=None, before_paste=None):
+    """Generate long text and paste it into the focused window, paragraph by paragraph while it streams.
+    `before_paste` (e.g. opening Notepad) runs while the text is already being generated.
+    Returns the generated text ('' if generation failed or was stopped).
+    """
+    if not PROGRESSIVE_PASTE:
+        content = generate_long_text(client, prompt, language=language, call_site=call_site, mode=mode)
+        if content:
+            if before_paste:
+                before_paste()
+            set_clipboard_and_paste(content)
+        return content
+
+    paster = ProgressivePaster()
+    result = {}
+
+    def produce():
+        try:
+            result['content'] = generate_long_text(client, prompt, language=language, call_site=call_site, mode=mode,
+                                                   on_text=paster.feed)
+        except Exception as e:
+            result['error'] = e
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    if before_paste:
+        before_paste()
+    paster.start()
+    producer.join()
+    if 'error' in result:
+        paster.abort()
+        raise result['error']
+    content = result.get('content') or ''
+    if not content:
+        paster.abort()
+        return ''
+    paster.finish(content)
+    stats = paster.summary()
+    print(f"[PASTE] {stats['paragraphs']} paste(s), first after {stats['first_paste_ms']} ms"
+          f"{' (aborted)' if stats['aborted'] else ''}")
+    return content
+
+
+def _open_notepad_for_writing(wait):
+    def before_paste():
+        open_path('notepad')
+        time.sleep(wait)
+    return before_paste
+
+
+def _run_essay_intent(client, match, user_command, language='en'):
+    """'write essay on X' -> open Notepad and write; 'type essay on X' -> type into current focus."""
+    verb = match.group(1).lower()
+    topic = match.group(3).strip()
+    # Need an AI client to generate long content
+    if not client:
+        print("[ESSAY ERROR] AI client required to generate long content.")
+        speak("I need the AI client configured to write long content. Please set GROQ_API_KEY.", language)
+        return False
+
+    # Build a rich prompt for long-form content, allow code if mentioned
+    prompt = (
+        f"Write a detailed, well-structured essay (about 400-800 words) on '{topic}'. "
+        "Use clear sections, examples, and a concise introduction and conclusion. "
+        "If the topic requests code or examples, include appropriate code blocks. "
+        f"Respond in {'Hindi' if language == 'hi' else 'English'}."
+    )
+
+    try:
+        # If user asked to 'write', open notepad first (while generating) and then paste;
+        # if user asked to 'type', paste into current focus
+        before_paste = _open_notepad_for_writing(1.2) if verb == 'write' else None
+        content = _generate_and_paste(client, prompt, language, 'essay', mode=ESSAY_GENERATION_MODE,
+                                      before_paste=before_paste)
+        if not content:
+            print("[ESSAY ERROR] AI returned empty content")
+            return False
+
+        if verb == 'write':
+            print(f"[EXECUTED] WROTE essay on '{topic}' to Notepad")
+            try:
+                set_floating_focus()
+            except Exception:
+                pass
+            return True
+
+        print(f"[EXECUTED] TYPED essay on '{topic}' into current focus")
+        try:
+            set_floating_focus()
+        except Exception:
+            pass
+        return True
+    except Exception as e:
+        print(f"[ESSAY ERROR] {e}")
+        return False
+
+
+def _run_topic_code_intent(client, match, user_command, language='en'):
+    """'type a <topic> code' or 'type <topic> code' -> pure code only (no comments/explanations)."""
+    topic = match.group(1).strip()
+    if not client:
+        print("[TYPE CODE ERROR] AI client required to generate code.")
+        speak("I need the AI client configured to generate code. Please set GROQ_API_KEY.", language)
+        return False
+    # Ask AI for pure code only
+    prompt = (
+        f"Provide ONLY runnable code (no comments, no explanations, no markdown fences) that implements: {topic}. "
+        "Return only the code output, nothing else."
+    )
+    try:
+        raw = generate_long_text(client, prompt, language=language, call_site='topic_code')
+        if not raw:
+            print("[TYPE CODE ERROR] AI returned empty content")
+            return False
+
+        content = strip_code_text(raw)
+        if not content:
+            print("[TYPE CODE ERROR] Content empty after stripping comments/fences")
+            return False
+        set_clipboard_and_paste(content)
+        print(f"[EXECUTED] TYPED pure code for '{topic}' into current focus")
+        try:
+            set_floating_focus()
+        except Exception:
+            pass
+        return True
+    except Exception as e:
+        print(f"[TYPE CODE ERROR] {e}")
+        return False
+
+
+def _run_code_intent(client, match, user_command, language='en'):
+    """'type code [to X]' -> generate a commented code snippet and type into current focus."""
+    topic = (match.group(1) or '').strip()
+    if not client:
+        print("[TYPE CODE ERROR] AI client required to generate code.")
+        speak("I need the AI client configured to generate code. Please set GROQ_API_KEY.", language)
+        return False
+    prompt = (
+        f"Write a clear, runnable code snippet{(' to ' + topic) if topic else ''}. "
+        "Include brief comments and only return the code and comments."
+    )
+    try:
+        content = _generate_and_paste(client, prompt, language, 'code')
+        if not content:
+            print("[TYPE CODE ERROR] AI returned empty content")
+            return False
+        print(f"[EXECUTED] TYPED code{(' for ' + topic) if topic else ''} into current focus")
+        try:
+            set_floating_focus()
+        except Exception:
+            pass
+        return True
+    except Exception as e:
+        print(f"[TYPE CODE ERROR] {e}")
+        return False
+
+
+def _run_write_intent(client, match, user_command, language='en'):
+    """Generic 'write <anything>' -> open Notepad and write the AI response."""
+    prompt_body = match.group(1).strip()
+    if not client:
+        print("[WRITE ERROR] AI client required to write content.")
+        speak("I need the AI client configured to write content. Please set GROQ_API_KEY.", language)
+        return False
+    try:
+        # Use a flexible prompt to generate a relevant piece of text
+        gen_prompt = f"Write a helpful and well-structured piece based on: {prompt_body}."
+        content = _generate_and_paste(client, gen_prompt, language, 'write',
+                                      before_paste=_open_notepad_for_writing(1.0))
+        if not content:
+            print("[WRITE ERROR] AI returned empty content")
+            return False
+        print(f"[EXECUTED] WROTE '{prompt_body}' to Notepad")
+        try:
+            set_floating_focus()
+        except Exception:
+            pass
+        return True
+    except Exception as e:
+        print(f"[WRITE ERROR] {e}")
+        return False
+
+
+def _run_macro_intent(client, match, user_command, language='en'):
+    """'run macro <name>' -> replay a saved macro (no LLM calls)."""
+    report = run_macro(match.group('name'), language, cancel=current_cancel_token())
+    if report is None:
+        speak(f"I don't have a macro called {match.group('name')}.", language)
+        return False
+    return report['ok']
+
+
+def _run_save_macro_intent(client, match, user_command, language='en'):
+    """'save that as macro <name>' / 'save the last 3 commands as macro <name>' -> record from the action log."""
+    name = match.group('name')
+    macro = save_macro_from_log(name, last=int(match.group('count') or 1))
+    if macro is None:
+        speak("There is nothing in the action log to save yet.", language)
+        return False
+    speak(f"Saved macro {name}.", language)
+    return True
+
+
+# Intents in intents.json either name one of these handlers or give ACTION templates
+LOCAL_INTENT_HANDLERS = {
+    'essay': _run_essay_intent,
+    'topic_code': _run_topic_code_intent,
+    'code': _run_code_intent,
+    'write': _run_write_intent,
+    'macro': _run_macro_intent,
+    'save_macro': _run_save_macro_intent,
+}
+
+
+def load_intent_grammar(path=None):
+    """Load and compile the local intent grammar (reloaded only when the file changes).
+    Returns a list of intent dicts with a compiled 'regex'; order in the file is match priority.
+    """
+    global _INTENT_GRAMMAR, _INTENT_GRAMMAR_MTIME
+    path = path or INTENTS_FILE
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    if _INTENT_GRAMMAR is not None and mtime == _INTENT_GRAMMAR_MTIME:
+        return _INTENT_GRAMMAR
+
+    grammar = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for intent in data.get('intents', []):
+            name = intent.get('name')
+            if intent.get('handler') and intent['handler'] not in LOCAL_INTENT_HANDLERS:
+                print(f"[INTENTS] Unknown handler '{intent['handler']}' for intent '{name}'")
+                continue
+            try:
+                regex = re.compile(intent['pattern'], flags=re.IGNORECASE)
+            except (KeyError, re.error) as e:
+                print(f"[INTENTS] Bad pattern for intent '{name}': {e}")
+                continue
+            grammar.append(dict(intent, regex=regex))
+    except Exception as e:
+        print(f"[INTENTS] Could not load {path}: {e}")
+    _INTENT_GRAMMAR = grammar
+    _INTENT_GRAMMAR_MTIME = mtime
+    return grammar
+
+
+def match_local_intent(user_command):
+    """Match `user_command` against the local grammar.
+    Returns (intent, match) for the first matching intent, or (None, None) to fall back to the LLM.
+    """
+    # Voice transcripts often end with a full stop ('Open notepad.')
+    text = (user_command or '').strip().rstrip('!?').strip()
+    if text.endswith('.') and not re.search(r"[ap]\.m\.$", text, flags=re.IGNORECASE):
+        text = text[:-1]
+    found = (None, None)
+    for intent in load_intent_grammar():
+        m = intent['regex'].match(text)
+        if m:
+            found = (intent, m)
+            break
+    with _INTENT_STATS_LOCK:
+        INTENT_STATS['lookups'] += 1
+        if found[0] is not None:
+            name = found[0]['name']
+            INTENT_STATS['hits'][name] = INTENT_STATS['hits'].get(name, 0) + 1
+    return found
+
+
+def render_intent_plan(intent, match):
+    """Render an intent's ACTION templates with the match's named groups into plan text."""
+    params = {k: (v or '').strip() for k, v in match.groupdict().items()}
+    return '\n'.join('ACTION: ' + tpl.format(**params) for tpl in intent.get('actions', []))
+
+
+def get_intent_stats():
+    """Per-intent hit counts and hit rates (hits / all commands looked up)."""
+    with _INTENT_STATS_LOCK:
+        lookups = INTENT_STATS['lookups']
+        hits = dict(INTENT_STATS['hits'])
+    matched = sum(hits.values())
+    return {
+        'lookups': lookups,
+        'llm_fallbacks': lookups - matched,
+        'intents': {name: {'hits': n, 'hit_rate': n / lookups} for name, n in sorted(hits.items())},
+    }
+
+
+# Planner system prompt: built once at import, versioned, and trimmed to a token budget.
+# Bump PLANNER_PROMPT_VERSION whenever the wording changes (it is logged with every turn
+# and invalidates the plan cache).
+PLANNER_PROMPT_VERSION = 'planner-v2'
+PLANNER_PROMPT_TOKEN_BUDGET = int(os.getenv('PLANNER_PROMPT_TOKEN_BUDGET', '600'))
+# (priority, text): sections are dropped from the highest priority number down until the prompt fits
+PLANNER_PROMPT_SECTIONS = [
+    (0, "You are Nova's action planner. Turn the user's command into executable actions. "
+        "Fix minor typos, normalize app names and prefer local apps when appropriate.\n"
+        "Output ONLY lines of the form 'ACTION: <TYPE> <params>', one per line. "
+        "No explanations, 'Reason:' lines, arrows or commentary.\n"
+        "Actions:\n"
+        "OPEN <app|path|url>\n"
+        "SEARCH <query> (in the browser)\n"
+        "TYPE <text> (into the focused window)\n"
+        "PRESS <keys> (space, enter, right, left, n, p, volumeup, volumedown, combos like ctrl+c, alt+tab)\n"
+        "CLICK <left|right|middle>\n"
+        "SWITCH <app>\n"
+        "NEXT_TAB | PREV_TAB | NEW_TAB | CLOSE_TAB\n"
+        "SET_ALARM <HH:MM>\n"
+        "YOUTUBE_PLAY <query> (searches YouTube and autoplays the first result)\n"
+        "SLEEP <seconds>\n"
+        "WAIT_FOR_PAGE (waits for a page to load)"),
+    (1, "Rules:\n"
+        "- After OPEN add SLEEP 1 for apps, SLEEP 1-2 or WAIT_FOR_PAGE for web URLs.\n"
+        "- Add SLEEP 0.5 between TYPE and PRESS enter.\n"
+        "- Music (play, pause, stop, skip): use spotify; for skip/pause assume the player is focused. "
+        "Skip = PRESS right; 'skip again' = repeat it. Pause/play = PRESS space.\n"
+        "- YouTube: use YOUTUBE_PLAY only; add no SLEEP/CLICK/PRESS after it.\n"
+        "- Only add PRESS alt+tab (or alt+f9) when the user says background or minimize.\n"
+        "- For chats, inbox or messages on web apps, OPEN the inbox URL "
+        "(e.g. https://www.instagram.com/direct/inbox/)."),
+    (2, "Examples:\n"
+        "'play music in background':\n"
+        "ACTION: OPEN spotify\nACTION: SLEEP 1\nACTION: PRESS space\nACTION: PRESS alt+tab\n"
+        "'open chatgpt and click':\n"
+        "ACTION: OPEN https://chatgpt.com\nACTION: WAIT_FOR_PAGE\nACTION: CLICK left"),
+]
+
+
+def build_planner_prompt(budget_tokens=None, sections=None):
+    """Join planner prompt sections, dropping the least important ones until it fits `budget_tokens`."""
+    sections = sorted(sections or PLANNER_PROMPT_SECTIONS, key=lambda sec: sec[0])
+    while True:
+        prompt = '\n'.join(text for _, text in sections)
+        if not budget_tokens or len(sections) <= 1 or estimate_tokens(prompt) <= budget_tokens:
+            return prompt
+        sections = sections[:-1]
+
+
+PLANNER_PROMPT = build_planner_prompt(PLANNER_PROMPT_TOKEN_BUDGET)
+
+
+class PlanLineStream:
+    """Incremental plan parser: turns a token stream into complete, non-empty plan lines.
+    A producer thread calls feed()/close(); the executor consumes with next() and peek(),
+    which block until the following line is complete or the stream has ended.
+    Each line is compiled into a PlanStep when it completes; next_step()/peek_step() return those.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._buffer = ''
+        self._lines = []
+        self._steps = []
+        self._pos = 0
+        self._fed = False
+        self._done = False
+        self._error = None
+        self._chunks = []
+        self._watchers = []
+        self.started_at = time.time()
+        self.first_line_at = None
+        self.done_at = None
+
+    @classmethod
+    def from_text(cls, text):
+        stream = cls()
+        stream.close(text)
+        return stream
+
+    def _push_lines(self, parts):
+        added = []
+        for part in parts:
+            part = part.strip()
+            if part:
+                if self.first_line_at is None:
+                    self.first_line_at = time.time()
+                self._lines.append(part)
+                self._steps.append(PlanStep.parse(part))
+                added.append(part)
+        return added
+
+    def _notify_watchers(self, lines):
+        for line in lines:
+            for callback in list(self._watchers):
+                try:
+                    callback(line)
+                except Exception as e:
+                    logger.debug(f"Plan line watcher failed: {e}")
+
+    def watch(self, callback):
+        """Call `callback(line)` for every line parsed so far and for each line parsed later."""
+        with self._cond:
+            self._watchers.append(callback)
+            existing = list(self._lines)
+        self._notify_watchers(existing)
+
+    def feed(self, chunk):
+        """Append streamed text; every completed line becomes available immediately."""
+        if not chunk:
+            return
+        added = []
+        with self._cond:
+            if self._done:
+                # Closed early (e.g. the command was cancelled): late output from the producer is dropped
+                return
+            self._fed = True
+            self._chunks.append(chunk)
+            self._buffer += chunk
+            if '\n' in self._buffer:
+                *complete, self._buffer = self._buffer.split('\n')
+                added = self._push_lines(complete)
+                self._cond.notify_all()
+        self._notify_watchers(added)
+
+    def close(self, final_text=None, error=None):
+        """Mark the stream finished. `final_text` is used when nothing was fed (non-streamed source).
+        Only the first close counts."""
+        with self._cond:
+            if self._done:
+                return
+            if not self._fed and final_text:
+                self._chunks.append(final_text)
+                self._buffer = final_text
+            added = self._push_lines(self._buffer.split('\n'))
+            self._buffer = ''
+            self._error = error
+            self._done = True
+            self.done_at = time.time()
+            self._cond.notify_all()
+        self._notify_watchers(added)
+
+    def _wait_for_line(self):
+        while self._pos >= len(self._lines) and not self._done:
+            self._cond.wait()
+        if self._pos < len(self._lines):
+            return True
+        if self._error is not None:
+            raise self._error
+        return False
+
+    def peek(self):
+        """Return the next line without consuming it, or None at the end of the plan."""
+        with self._cond:
+            return self._lines[self._pos] if self._wait_for_line() else None
+
+    def next(self):
+        """Consume and return the next line, or None at the end of the plan."""
+        with self._cond:
+            if not self._wait_for_line():
+                return None
+            line = self._lines[self._pos]
+            self._pos += 1
+            return line
+
+    def peek_step(self):
+        """Compiled form of peek()."""
+        with self._cond:
+            return self._steps[self._pos] if self._wait_for_line() else None
+
+    def peek_step_nowait(self):
+        """Next compiled step if it is already parsed, else None (never waits for the producer)."""
+        with self._cond:
+            return self._steps[self._pos] if self._pos < len(self._steps) else None
+
+    def next_step(self):
+        """Compiled form of next()."""
+        with self._cond:
+            if not self._wait_for_line():
+                return None
+            step = self._steps[self._pos]
+            self._pos += 1
+            return step
+
+    def text(self):
+        """Full plan text (complete once next() has returned None)."""
+        with self._cond:
+            return ''.join(self._chunks)
+
+
+# Thread pool used to resolve OPEN/SWITCH targets ahead of execution
+RESOLVE_WORKERS = int(os.getenv('RESOLVE_WORKERS', '4'))
+_RESOLVE_POOL = None
+_RESOLVE_POOL_LOCK = threading.Lock()
+
+
+def _get_resolve_pool():
+    global _RESOLVE_POOL
+    with _RESOLVE_POOL_LOCK:
+        if _RESOLVE_POOL is None:
+            _RESOLVE_POOL = ThreadPoolExecutor(max_workers=max(1, RESOLVE_WORKERS), thread_name_prefix='nova-resolve')
+        return _RESOLVE_POOL
+
+
+class TargetPrefetcher:
+    """Resolves every OPEN/SWITCH target of a plan concurrently, as soon as its line is parsed.
+    Results are kept for the rest of the plan, so a mapping miss (LLM normalization) runs
+    while earlier steps execute instead of between two UI actions.
+    """
+
+    def __init__(self, client, user_command='', language='en'):
+        self.client = client
+        self.user_command = user_command
+        self.language = language
+        self.wait_ms = 0.0
+        self.resolve_ms = 0.0
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse(line):
+        """Return (action, target) for an OPEN/SWITCH plan line, else None."""
+        if not line.lower().startswith('action:'):
+            return None
+        parts = line[7:].strip().split(None, 1)
+        if len(parts) < 2 or parts[0].upper() not in ('OPEN', 'SWITCH'):
+            return None
+        return parts[0].upper(), parts[1].strip('"\'')
+
+    def seed(self, targets):
+        """Use already resolved OPEN targets ({raw target: resolved}, e.g. from a macro) as they are."""
+        for raw, resolved in (targets or {}).items():
+            future = Future()
+            future.set_result(('url' if is_likely_url(resolved) else 'app', resolved))
+            with self._lock:
+                self._futures[('OPEN', raw.lower())] = future
+
+    def on_line(self, line):
+        parsed = self.parse(line)
+        if parsed:
+            self.submit(*parsed)
+
+    def _resolve(self, action, target):
+        started = time.time()
+        try:
+            if action == 'OPEN':
+                return resolve_open_target(self.client, target, self.user_command, self.language)
+            return 'app', load_app_mappings().get(target.lower(), '')
+        finally:
+            with self._lock:
+                self.resolve_ms += (time.time() - started) * 1000
+
+    def submit(self, action, target):
+        key = (action, target.lower())
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = _get_resolve_pool().submit(self._resolve, action, target)
+                self._futures[key] = future
+        return future
+
+    def result(self, action, target):
+        """Resolved (kind, value) for `target`; waits only if its resolution is still running."""
+        future = self.submit(action, target)
+        waited_from = time.time()
+        try:
+            return future.result()
+        finally:
+            self.wait_ms += (time.time() - waited_from) * 1000
+
+    def summary(self):
+        return {'targets': len(self._futures), 'wait_ms': round(self.wait_ms, 1),
+                'resolve_ms': round(self.resolve_ms, 1)}
+
+
+# --- Plan IR and action registry ---
+# Plan lines are compiled once, as they arrive, into slotted PlanStep records: the action type is
+# upper-cased, the parameter parsed and validated, so the executor never re-parses strings.
+# Handlers are registered per action type; adding an action does not touch execute_via_ai_plan.
+PRESS_KEY_MAP = {
+    'enter': 'enter', 'return': 'enter', 'space': 'space', 'tab': 'tab', 'escape': 'esc', 'esc': 'esc',
+    'backspace': 'backspace', 'delete': 'delete', 'insert': 'insert', 'home': 'home', 'end': 'end',
+    'pageup': 'pageup', 'pagedown': 'pagedown', 'up': 'up', 'down': 'down', 'left': 'left', 'right': 'right',
+    'volumeup': 'volumeup', 'volumedown': 'volumedown',
+    'n': 'n',  # Spotify next shortcut
+    'p': 'p',  # Spotify previous shortcut
+    **{f'f{i}': f'f{i}' for i in range(1, 11)},
+}
+
+# action type -> ActionSpec
+ACTION_REGISTRY = {}
+# Independent launches: waits after each OPEN run concurrently on this pool
+LAUNCH_CONCURRENCY = os.getenv('LAUNCH_CONCURRENCY', 'true').lower() in ['1', 'true', 'yes']
+LAUNCH_WORKERS = int(os.getenv('LAUNCH_WORKERS', '4'))
+_LAUNCH_POOL = None
+_LAUNCH_POOL_LOCK = threading.Lock()
+PLAN_OPTIMIZER_ENABLED = os.getenv('PLAN_OPTIMIZER_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+
+
+class ActionSpec:
+    """A registered action type: `handler(run, step)`, `parse_args(param)` (raises ValueError when
+    invalid) and the properties PlanOptimizer relies on:
+      wait      - the step only waits (SLEEP, WAIT_FOR_PAGE)
+      blocking  - the step itself waits until its effect is complete, so a SLEEP right after it is redundant
+      focus     - the step brings its target to the foreground (OPEN, SWITCH)
+      launch    - the step starts an app/page independently of earlier steps; waits that follow it run
+                  concurrently with later launches (see PlanRun.defer)
+      focus_sensitive - the step acts on the foreground window (TYPE, PRESS, CLICK, tab keys)
+      absorbs   - action types made redundant right after a successful run of this step
+      estimate  - typical duration in seconds (number or callable(step)), used to report time saved
+    """
+    __slots__ = ('name', 'handler', 'parse_args', 'wait', 'blocking', 'focus', 'launch', 'focus_sensitive', 'absorbs',
+                 'estimate')
+
+    def __init__(self, name, handler, parse_args, wait=False, blocking=False, focus=False, launch=False,
+                 focus_sensitive=False, absorbs=(), estimate=0.0):
+        self.name = name
+        self.handler = handler
+        self.parse_args = parse_args
+        self.wait = wait
+        self.blocking = blocking
+        self.focus = focus
+        self.launch = launch
+        self.focus_sensitive = focus_sensitive
+        self.absorbs = tuple(absorbs)
+        self.estimate = estimate
+
+    def seconds(self, step):
+        return self.estimate(step) if callable(self.estimate) else self.estimate
+
+
+class PlanStep:
+    """One compiled plan line. `action` is None for non-ACTION lines; `error` is set when validation failed."""
+    __slots__ = ('line', 'action', 'param', 'args', 'error')
+
+    def __init__(self, line, action=None, param='', args=None, error=None):
+        self.line = line
+        self.action = action
+        self.param = param
+        self.args = args
+        self.error = error
+
+    @classmethod
+    def parse(cls, line):
+        if not line.lower().startswith('action:'):
+            return cls(line)
+        parts = line[7:].strip().split(None, 1)
+        if not parts:
+            return cls(line)
+        action = parts[0].upper()
+        param = parts[1] if len(parts) > 1 else ''
+        spec = ACTION_REGISTRY.get(action)
+        if spec is None:
+            return cls(line, action, param, error='unknown action')
+        try:
+            return cls(line, action, param, spec.parse_args(param))
+        except ValueError as e:
+            return cls(line, action, param, error=str(e) or 'invalid parameter')
+
+    def __repr__(self):
+        return f"PlanStep({self.action!r}, {self.args!r})"
+
+
+def _text_arg(param):
+    return param.strip('"\'')
+
+
+def _required_text_arg(param):
+    text = param.strip('"\'')
+    if not text:
+        raise ValueError('missing parameter')
+    return text
+
+
+def _no_arg(param):
+    return None
+
+
+def _press_arg(param):
+    """('hotkey', (keys...), raw) for combinations, ('press', key, raw) for a single key."""
+    keys = param.strip('"\'').lower()
+    if not keys:
+        raise ValueError('missing keys')
+    if '+' in keys:
+        return 'hotkey', tuple(k.strip() for k in keys.split('+')), keys
+    return 'press', PRESS_KEY_MAP.get(keys, keys), keys
+
+
+def _sleep_arg(param):
+    seconds = float(param) if param else 1
+    if seconds < 0:
+        raise ValueError('negative sleep')
+    return seconds
+
+
+def register_action(name, parse_args=_text_arg, **properties):
+    """Decorator registering `handler(run, step)` for plan lines 'ACTION: <name> ...'.
+    `properties` are ActionSpec properties (wait, blocking, focus, launch, focus_sensitive, absorbs, estimate).
+    """
+    def decorator(handler):
+        ACTION_REGISTRY[name.upper()] = ActionSpec(name.upper(), handler, parse_args, **properties)
+        return handler
+    return decorator
+
+
+# --- Cancellation ---
+# Every plan runs under a CancelToken: "stop" (voice or floating window) or a superseding prompt cancels it,
+# waits return at once and the executor stops before its next step.
+PLAN_SUPERSEDE = os.getenv('PLAN_SUPERSEDE', 'false').lower() in ['1', 'true', 'yes']
+_REAL_SLEEP = time.sleep
+_ACTIVE_TOKENS = set()
+_ACTIVE_TOKENS_LOCK = threading.Lock()
+_PLAN_CONTEXT = threading.local()
+
+
+class CancelToken:
+    """Cancellation flag shared by one command's plan(s), its deferred waits and its handlers."""
+    __slots__ = ('_event', '_lock', '_callbacks', 'reason', 'command')
+
+    def __init__(self, command=''):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = None
+        self.command = command
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason='cancelled'):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Cancel callback failed: {e}")
+
+    def on_cancel(self, callback):
+        """Call `callback()` once the token is cancelled (at once if it already is)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def sleep(self, seconds):
+        """time.sleep() that ends as soon as the token is cancelled. Returns False if cancelled."""
+        seconds = max(0.0, float(seconds or 0))
+        if self.cancelled:
+            return False
+        if time.sleep is not _REAL_SLEEP:
+            # Virtual clock / scaled or patched sleep (dry runs, replay): the wait is simulated as is
+            time.sleep(seconds)
+        else:
+            self._event.wait(seconds)
+        return not self.cancelled
+
+
+def current_cancel_token():
+    """The CancelToken of the plan running on this thread (None outside plan execution)."""
+    return getattr(_PLAN_CONTEXT, 'token', None)
+
+
+def _set_cancel_token(token):
+    previous = current_cancel_token()
+    _PLAN_CONTEXT.token = token
+    return previous
+
+
+def interruptible_sleep(seconds):
+    """Sleep that a cancelled plan cuts short; returns False if the running plan was cancelled."""
+    token = current_cancel_token()
+    if token is None:
+        time.sleep(seconds)
+        return True
+    return token.sleep(seconds)
+
+
+def plan_cancelled():
+    token = current_cancel_token()
+    return token is not None and token.cancelled
+
+
+def cancel_running_plans(reason='stopped'):
+    """Cancel every running plan (and its in-flight LLM requests). Returns how many were running."""
+    with _ACTIVE_TOKENS_LOCK:
+        tokens = [t for t in _ACTIVE_TOKENS if not t.cancelled]
+    for token in tokens:
+        token.cancel(reason)
+        print(f"[CANCEL] '{token.command}' {reason}")
+    if tokens:
+        cancel_llm_requests()
+    return len(tokens)
+
+
+class PlanRun:
+    """State of one plan execution, shared by the action handlers.
+    Waits that follow a launch (OPEN) are deferred to the launch pool by defer(), so several apps
+    start up concurrently; join_launches() is the barrier before any other kind of step.
+    """
+    __slots__ = ('client', 'user_command', 'language', 'plan', 'prefetcher', 'log_entry', 'actions_executed',
+                 'suppress_done_speak', 'startup_sleep', 'post_space_delay', 'ready', 'pending', 'chain', 'launches',
+                 'token', 'step_started')
+
+    def __init__(self, client, user_command, language, plan, prefetcher, log_entry, startup_sleep=0.0,
+                 post_space_delay=0.0, token=None):
+        self.client = client
+        self.user_command = user_command
+        self.language = language
+        self.plan = plan
+        self.prefetcher = prefetcher
+        self.log_entry = log_entry
+        self.actions_executed = 0
+        self.suppress_done_speak = False
+        self.startup_sleep = startup_sleep
+        self.post_space_delay = post_space_delay
+        # (target, probe, launched_at) of the last OPEN/SWITCH: opened target, readiness probe and dispatch time,
+        # consumed by the next wait
+        self.ready = None
+        # Deferred waits: (future, sub-run) pairs, the last one of the current launch, launched targets
+        self.pending = []
+        self.chain = None
+        self.launches = []
+        self.token = token or CancelToken(user_command)
+        # When the step being executed started (stamped onto its action records)
+        self.step_started = None
+
+    def record(self, entry, started=None):
+        """Add `entry` to the audit log with its start/end time and duration (default start: the current step)."""
+        started = self.step_started if started is None else started
+        if started is not None:
+            ended = time.time()
+            entry.update(started_at=round(started, 3), ended_at=round(ended, 3),
+                         duration_ms=round((ended - started) * 1000, 1))
+        self.log_entry['actions'].append(entry)
+
+    def done(self, entry=None):
+        """Count one executed action and add `entry` to the audit log."""
+        self.actions_executed += 1
+        if entry:
+            self.record(entry)
+
+    def can_defer(self):
+        """True while the steps since the last launch are only waits for it."""
+        return LAUNCH_CONCURRENCY and (self.chain is not None or (self.ready is not None and self.ready[0] is not None))
+
+    def defer(self, handler, step):
+        """Run wait `step` on the launch pool, after the launch's earlier waits; the plan moves on."""
+        sub = PlanRun(self.client, self.user_command, self.language, self.plan, self.prefetcher, self.log_entry,
+                      self.startup_sleep, self.post_space_delay, self.token)
+        sub.ready, self.ready = self.ready, None
+        after, submitted_at = self.chain, time.time()
+
+        def task():
+            _clock_enter(submitted_at)
+            if after is not None:
+                _clock_advance(after.result())
+            previous = _set_cancel_token(sub.token)
+            sub.step_started = time.time()
+            try:
+                if not sub.token.cancelled:
+                    handler(sub, step)
+            except Exception as e:
+                print(f"[ACTION ERROR] {step.action}: {e}")
+            finally:
+                _set_cancel_token(previous)
+            return time.time()
+
+        self.chain = _get_launch_pool().submit(task)
+        self.pending.append((self.chain, sub))
+
+    def join_launches(self, refocus=False):
+        """Barrier: wait for every deferred wait. With `refocus`, bring the last launched app back to the
+        front when several started concurrently (a slower one may have taken the focus)."""
+        pending, self.pending, self.chain = self.pending, [], None
+        launches, self.launches = self.launches, []
+        finished = []
+        for future, sub in pending:
+            try:
+                finished.append(future.result())
+            except Exception as e:
+                print(f"[LAUNCH WAIT ERROR] {e}")
+            self.actions_executed += sub.actions_executed
+        if finished:
+            _clock_advance(max(finished))
+        if refocus and pending and len(launches) > 1 and HAS_PYGETWINDOW and not self.token.cancelled:
+            switch_to_app(launches[-1])
+            self.record({'action': 'SWITCH', 'app': launches[-1], 'reason': 'refocus_after_launches'}, time.time())
+            print(f"[LAUNCH] Refocused {launches[-1]} after {len(launches)} concurrent launches")
+
+
+def _get_launch_pool():
+    global _LAUNCH_POOL
+    with _LAUNCH_POOL_LOCK:
+        if _LAUNCH_POOL is None:
+            _LAUNCH_POOL = ThreadPoolExecutor(max_workers=max(1, LAUNCH_WORKERS), thread_name_prefix='nova-launch')
+        return _LAUNCH_POOL
+
+
+def _clock_enter(at):
+    # Dry runs: start a worker's virtual clock at the submitter's time (no-op with the real clock)
+    enter = getattr(time, 'enter', None)
+    if enter:
+        enter(at)
+
+
+def _clock_advance(at):
+    advance = getattr(time, 'advance_to', None)
+    if advance:
+        advance(at)
+
+
+class WindowProbe:
+    """Readiness probe: true once a window titled like `hint` is in the foreground, or one more
+    such window exists than when the probe was created."""
+
+    def __init__(self, hint):
+        self.hint = hint.lower()
+        self.baseline = self._count()
+
+    def _count(self):
+        return sum(1 for title in gw.getAllTitles() if title and self.hint in title.lower())
+
+    def __call__(self):
+        active = (_active_window_title() or '').lower()
+        return self.hint in active or self._count() > self.baseline
+
+
+def _window_hint(target):
+    """Word expected in the window title of an opened target: the app_mappings.json name it resolved
+    from, else the site name for URLs (registrable domain: 'slack' for app.slack.com), the URI scheme
+    ('spotify:' -> 'spotify') or the file stem."""
+    target = (target or '').strip()
+    # Prefer a name that also appears in the target ('instagram' over 'insta inbox'), else the shortest
+    names = {key.split()[0] for key, value in load_app_mappings().items()
+             if isinstance(value, str) and key.strip() and value.strip().lower() == target.lower()}
+    if names:
+        named = [name for name in names if name.lower() in target.lower()]
+        return max(named, key=len) if named else min(names, key=len)
+    is_path = '\\' in target or re.match(r"^[a-zA-Z]:[\\/]", target) or \
+        re.search(r"\.(?:exe|lnk|bat|cmd|msc)$", target, flags=re.IGNORECASE)
+    if not is_path and (is_likely_url(target) or target.startswith('http')):
+        host = urllib.parse.urlparse(target if '//' in target else 'https://' + target).hostname or ''
+        labels = [label for label in host.split('.') if label not in ('www', 'm')]
+        if len(labels) >= 3 and labels[-2] in ('co', 'com', 'net', 'org', 'gov', 'ac', 'edu'):
+            return labels[-3]
+        return labels[-2] if len(labels) >= 2 else (labels[0] if labels else '')
+    scheme = re.match(r"^(?:ms-)?([a-zA-Z][\w+.-]+):(?!//)", target)
+    if scheme and not is_path:
+        return scheme.group(1)
+    return os.path.basename(target.replace('\\', '/')).split('.')[0].strip()
+
+
+def _readiness_probe(target, driver=None):
+    """Cheap readiness check for an OPEN/SWITCH target, or None when readiness cannot be observed."""
+    if driver is not None:
+        return lambda: driver.execute_script('return document.readyState') == 'complete'
+    hint = _window_hint(target)
+    if not hint or not HAS_PYGETWINDOW:
+        return None
+    try:
+        return WindowProbe(hint)
+    except Exception:
+        return None
+
+
+class StartupLatencyModel:
+    """Per-app launch-to-ready latency histogram, persisted to disk as JSON.
+    Keeps the last `max_samples` readiness times per app (plus how often it never became ready)
+    and suggests waits at a percentile of them.
+    """
+
+    def __init__(self, path, percentile=90, margin=1.25, min_samples=3, max_samples=50):
+        self.path = path
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self._apps = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def app_key(target):
+        return _window_hint(target).lower()
+
+    def _load(self):
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for app, entry in data.get('apps', {}).items():
+                self._apps[app] = {'samples': list(entry.get('samples', []))[-self.max_samples:],
+                                   'timeouts': int(entry.get('timeouts', 0))}
+        except Exception as e:
+            print(f"[STARTUP MODEL] Could not load {self.path}: {e}")
+            self._apps = {}
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'apps': self._apps}, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[STARTUP MODEL] Could not save {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def record(self, target, seconds=None, timed_out=False):
+        """Add a launch-to-ready time for `target`; None records that it never became ready.
+        With `timed_out`, `seconds` is how long it was waited for: a censored sample (the app took at
+        least that long), kept at no less than the current percentile so a timeout never shortens the wait.
+        """
+        app = self.app_key(target)
+        if not app:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._apps.setdefault(app, {'samples': [], 'timeouts': 0})
+            if seconds is None or timed_out:
+                entry['timeouts'] += 1
+            if seconds is not None:
+                if timed_out and entry['samples']:
+                    seconds = max(seconds, _percentile(entry['samples'], self.percentile))
+                entry['samples'] = (entry['samples'] + [round(seconds, 3)])[-self.max_samples:]
+            self._save()
+
+    def wait_for(self, target):
+        """Suggested wait (seconds) after opening `target`, or None while there are too few samples."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            samples = self._apps.get(self.app_key(target), {}).get('samples', [])
+            if len(samples) < max(1, self.min_samples):
+                return None
+            return _percentile(samples, self.percentile) * self.margin
+
+    def report(self):
+        """Per-app rows (slowest p50 first): samples, timeouts, p50/p90/max seconds and the suggested wait."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            apps = {app: dict(entry) for app, entry in self._apps.items()}
+        rows = []
+        for app, entry in apps.items():
+            samples = entry['samples']
+            learned = len(samples) >= max(1, self.min_samples)
+            rows.append({
+                'app': app, 'samples': len(samples), 'timeouts': entry['timeouts'],
+                'p50': _percentile(samples, 50), 'p90': _percentile(samples, 90),
+                'max': max(samples) if samples else None,
+                'wait': _percentile(samples, self.percentile) * self.margin if learned else None,
+            })
+        return sorted(rows, key=lambda r: -(r['p50'] or 0))
+
+
+STARTUP_LATENCY = StartupLatencyModel(STARTUP_LATENCY_FILE, STARTUP_WAIT_PERCENTILE, STARTUP_WAIT_MARGIN,
+                                      STARTUP_MIN_SAMPLES, STARTUP_MAX_SAMPLES)
+
+
+def wait_until_ready(probe, timeout, interval=None):
+    """Poll `probe()` until it is true (plus READY_SETTLE_SECONDS) or `timeout` seconds pass.
+    Returns (ready, seconds_until_ready_or_timeout). A failing probe waits out the full timeout;
+    a cancelled plan stops waiting at once (not ready).
+    """
+    interval = READY_POLL_INTERVAL if interval is None else interval
+    started = time.time()
+    while True:
+        try:
+            ready = bool(probe())
+        except Exception as e:
+            logger.debug(f"Readiness probe failed: {e}")
+            ready = None
+        elapsed = time.time() - started
+        remaining = timeout - elapsed
+        if ready:
+            if remaining > 0 and READY_SETTLE_SECONDS > 0:
+                interruptible_sleep(min(READY_SETTLE_SECONDS, remaining))
+            return True, elapsed
+        if remaining <= 0 or plan_cancelled():
+            return False, time.time() - started
+        interruptible_sleep(remaining if ready is None else min(interval, remaining))
+
+
+def _wait_step(run, seconds, entry):
+    """Wait up to `seconds`; returns `entry` (for the audit log) with the outcome.
+    `run.ready` is (opened target or None, readiness probe or None, dispatch time) from the preceding
+    OPEN/SWITCH. A target with a learned startup latency replaces `seconds` with the learned wait,
+    less the time since the OPEN was dispatched. With a probe the wait ends as soon as the target is
+    ready (and the dispatch-to-ready time is learned); otherwise the full time is slept.
+    """
+    (target, probe, launched_at), run.ready = run.ready or (None, None, None), None
+    # Time already spent since the OPEN was dispatched (the launch itself, earlier waits)
+    lead = max(0.0, time.time() - launched_at) if launched_at else 0.0
+    if target:
+        entry['target'] = target
+    if target and STARTUP_LATENCY_ENABLED and seconds > 0:
+        learned = STARTUP_LATENCY.wait_for(target)
+        if learned is not None:
+            entry['learned_wait'] = round(learned, 3)
+            seconds = max(0.0, learned - lead)
+    if probe is not None and READY_WAITS and seconds > 0:
+        ready, waited = wait_until_ready(probe, seconds)
+        entry.update(waited=round(waited, 3), ready=ready)
+        if plan_cancelled():
+            entry['cancelled'] = True
+        elif target and STARTUP_LATENCY_ENABLED:
+            STARTUP_LATENCY.record(target, lead + waited, timed_out=not ready)
+    elif not interruptible_sleep(seconds):
+        entry['cancelled'] = True
+    return entry
+
+
+def _waited_note(entry):
+    if 'waited' not in entry:
+        return ''
+    return f" (ready after {entry['waited']:.2f}s)" if entry['ready'] else " (not ready, waited it out)"
+
+
+def _wait_for_spotify_startup(run, target):
+    # If opening Spotify, and the next action is PRESS space, wait (up to startup_sleep) for the app to start
+    if 'spotify' not in target.lower():
+        return
+    nxt = run.plan.peek_step()
+    if nxt is not None and nxt.action == 'PRESS' and 'space' in nxt.param.lower():
+        started = time.time()
+        entry = _wait_step(run, run.startup_sleep,
+                           {'action': 'SLEEP', 'seconds': run.startup_sleep, 'reason': 'spotify_startup'})
+        run.record(entry, started)
+        print(f"[AUTO SLEEP] Waited {run.startup_sleep}s for Spotify to start{_waited_note(entry)}")
+
+
+@register_action('OPEN', _required_text_arg, focus=True, launch=True, estimate=lambda step: DEFAULT_OPEN_SLEEP)
+def _action_open(run, step):
+    global CURRENT_APP_CONTEXT, LAST_OPENED_TARGET
+    target = step.args
+    # Smart resolution: try mappings and AI to normalize ambiguous targets
+    try:
+        kind, resolved = run.prefetcher.result('OPEN', target)
+        if kind in ('url', 'path', 'app') and resolved:
+            target = resolved
+    except Exception:
+        pass
+    # Special-case: if user or AI referenced alarms/clock, open Windows Alarms & Clock
+    if target and any(k in target.lower() for k in ['alarm', 'alarms', 'clock']):
+        try:
+            # Use Windows URI to open Alarms & Clock
+            subprocess.Popen(['cmd', '/c', 'start', '', 'ms-clock:'], shell=True)
+            CURRENT_APP_CONTEXT = 'alarm'
+            LAST_OPENED_TARGET = 'ms-clock:'
+            run.done()
+            print("[EXECUTED] OPEN ms-clock:")
+            return
+        except Exception as e:
+            print(f"[OPEN ALARM ERROR] {e}")
+            # fallthrough to other attempts
+    # Determine if it's a local app, path, or URL
+    is_url = is_likely_url(target)
+    is_local_app = target.lower() in ['notepad', 'notepad.exe', 'chrome', 'firefox', 'edge', 'vs code', 'code',
+                                      'explorer', 'cmd', 'powershell']
+
+    driver = None
+    if is_url or target.startswith('http'):
+        # It's a URL, open in Chrome
+        if HAS_SELENIUM and not target.endswith('.com'):
+            try:
+                options = webdriver.ChromeOptions()
+                options.add_argument('--new-window')
+                driver = webdriver.Chrome(ChromeDriverManager().install(), options=options)
+                driver.get(target)
+            except Exception:
+                # Fallback to webbrowser
+                driver = None
+                webbrowser.open(target)
+            CURRENT_APP_CONTEXT = 'chrome'
+            run.done()
+        else:
+            webbrowser.open(target)
+            CURRENT_APP_CONTEXT = 'chrome'
+            run.done({'action': 'OPEN', 'target': target, 'result': 'opened_in_browser'})
+    elif is_local_app or os.path.exists(target):
+        # It's a local application or file/folder
+        open_path(target)
+        LAST_OPENED_TARGET = target
+        CURRENT_APP_CONTEXT = target.split('\\')[-1].lower() if '\\' in target else target.lower()
+        run.done({'action': 'OPEN', 'target': target, 'result': 'opened_local'})
+    else:
+        # Try as a local app/path anyway
+        open_path(target)
+        LAST_OPENED_TARGET = target
+        CURRENT_APP_CONTEXT = target.lower()
+        run.done({'action': 'OPEN', 'target': target, 'result': 'opened_fallback'})
+    print(f"[EXECUTED] OPEN {target}")
+    run.ready = (target, _readiness_probe(target, driver), run.step_started)
+    try:
+        _wait_for_spotify_startup(run, target)
+    except Exception:
+        pass
+
+
+@register_action('SET_ALARM', _required_text_arg)
+def _action_set_alarm(run, step):
+    # param expected like '19:00' or '7 pm' or '07:00 PM'
+    raw = step.args
+    normalized = parse_time_string(raw)
+    if normalized:
+        res = set_windows_alarm(normalized)
+        run.actions_executed += 1 if res else 0
+        run.record({'action': 'SET_ALARM', 'time': normalized, 'result': 'ok' if res else 'partial'})
+        print(f"[EXECUTED] SET_ALARM {normalized} -> {'ok' if res else 'partial'}")
+        return
+    print(f"[SET_ALARM] Could not parse time: {raw}")
+    run.record({'action': 'SET_ALARM', 'time_raw': raw, 'result': 'failed_parse'})
+    # Try to open the Clock app so user can complete manually
+    try:
+        subprocess.Popen(['cmd', '/c', 'start', '', 'ms-clock:'], shell=True)
+        run.done({'action': 'OPEN', 'target': 'ms-clock:', 'result': 'opened_for_manual'})
+    except Exception as e:
+        print(f"[SET_ALARM] fallback open error: {e}")
+
+
+@register_action('SEARCH', _required_text_arg)
+def _action_search(run, step):
+    global CURRENT_APP_CONTEXT
+    query = step.args
+    # If the user's original command referenced YouTube or asked to play a video,
+    # prefer the quick YOUTUBE_PLAY path to avoid slow typed-search + clicks.
+    uc = (run.user_command or '').lower()
+    if 'youtube' in uc or ('play' in uc and 'video' in uc):
+        status = play_youtube(query)
+        if status in ('playing', 'search_opened'):
+            CURRENT_APP_CONTEXT = 'youtube'
+            run.done({'action': 'SEARCH', 'query': query, 'result': status})
+            print(f"[EXECUTED] SEARCH (youtube) {query}")
+            return
+        # else fall through to normal search behavior
+    # Detect if browser is open, otherwise use Chrome
+    if not CURRENT_APP_CONTEXT or CURRENT_APP_CONTEXT not in ['chrome', 'browser']:
+        detect_and_set_browser_context()
+    if not CURRENT_APP_CONTEXT or CURRENT_APP_CONTEXT not in ['chrome', 'browser']:
+        # Open Chrome first if no browser detected
+        webbrowser.open('about:blank')
+        CURRENT_APP_CONTEXT = 'chrome'
+    webbrowser.open(f"https://www.google.com/search?q={urllib.parse.quote_plus(query)}")
+    run.done({'action': 'SEARCH', 'query': query, 'result': 'opened_search'})
+    print(f"[EXECUTED] SEARCH {query}")
+
+
+@register_action('TYPE', focus_sensitive=True)
+def _action_type(run, step):
+    text = step.args
+    set_clipboard_and_paste(text)
+    run.done({'action': 'TYPE', 'text': text[:200]})
+    print(f"[EXECUTED] TYPE {text[:50]}...")
+
+
+@register_action('PRESS', _press_arg, focus_sensitive=True)
+def _action_press(run, step):
+    kind, key, keys = step.args
+    if not HAS_PYAUTOGUI:
+        what = 'key combination' if kind == 'hotkey' else 'key'
+        print(f"[PRESS ERROR] pyautogui not available for {what}: {keys}")
+    elif kind == 'hotkey':
+        # Key combinations (ctrl+c, alt+tab, etc.)
+        try:
+            pyautogui.hotkey(*key)
+            run.done({'action': 'PRESS', 'keys': keys, 'result': 'hotkey_executed'})
+            print(f"[EXECUTED] PRESS {keys}")
+        except Exception as e:
+            print(f"[PRESS ERROR] pyautogui hotkey failed: {e}")
+    else:
+        # Single key press (including media keys like volumeup, volumedown)
+        try:
+            pyautogui.press(key)
+            run.done({'action': 'PRESS', 'keys': key, 'result': 'pressed'})
+            print(f"[EXECUTED] PRESS {keys}")
+        except Exception as e:
+            print(f"[PRESS ERROR] pyautogui press failed: {e}")
+    # If we just pressed space (or attempted to), and the next action switches/minimizes or
+    # is another key press, give a short pause
+    if kind == 'press' and key == 'space':
+        try:
+            nxt = run.plan.peek_step()
+            if nxt is not None and nxt.action in ('PRESS', 'SWITCH', 'OPEN'):
+                started = time.time()
+                interruptible_sleep(run.post_space_delay)
+                run.record({'action': 'SLEEP', 'seconds': run.post_space_delay, 'reason': 'post_space_delay'}, started)
+                print(f"[AUTO SLEEP] Waited {run.post_space_delay}s after space before next action")
+        except Exception:
+            pass
+
+
+@register_action('CLICK', lambda param: param.strip('"\'').lower() or 'left', focus_sensitive=True)
+def _action_click(run, step):
+    if HAS_PYAUTOGUI:
+        click_mouse(step.args)
+        run.done({'action': 'CLICK', 'button': step.args, 'result': 'clicked'})
+        print(f"[EXECUTED] CLICK {step.args}")
+    else:
+        print("[CLICK ERROR] pyautogui not available")
+
+
+@register_action('SWITCH', _required_text_arg, focus=True)
+def _action_switch(run, step):
+    global CURRENT_APP_CONTEXT
+    app = step.args
+    _, switch_target = run.prefetcher.result('SWITCH', app)
+    switch_to_app(app, resolved_target=switch_target or None)
+    run.ready = (None, _readiness_probe(app), run.step_started)
+    CURRENT_APP_CONTEXT = app.lower()
+    run.done({'action': 'SWITCH', 'app': app, 'result': 'switched'})
+    print(f"[EXECUTED] SWITCH {app}")
+
+
+def _tab_action(name, direction):
+    def handler(run, step):
+        if HAS_PYAUTOGUI:
+            browser_tab_action(direction)
+            run.done({'action': name, 'result': 'done'})
+            print(f"[EXECUTED] {name}")
+    return register_action(name, _no_arg, focus_sensitive=True)(handler)
+
+
+for _name, _direction in [('NEXT_TAB', 'next'), ('PREV_TAB', 'previous'), ('NEW_TAB', 'new'), ('CLOSE_TAB', 'close')]:
+    _tab_action(_name, _direction)
+
+
+@register_action('SLEEP', _sleep_arg, wait=True, estimate=lambda step: step.args)
+def _action_sleep(run, step):
+    entry = _wait_step(run, step.args, {'action': 'SLEEP', 'seconds': step.args})
+    run.done(entry)
+    print(f"[EXECUTED] SLEEP {step.args}s{_waited_note(entry)}")
+
+
+@register_action('WAIT_FOR_PAGE', _no_arg, wait=True, blocking=True, estimate=lambda step: WAIT_FOR_PAGE_SECONDS)
+def _action_wait_for_page(run, step):
+    # Wait (up to WAIT_FOR_PAGE_SECONDS) for the page to load
+    entry = _wait_step(run, WAIT_FOR_PAGE_SECONDS, {'action': 'WAIT_FOR_PAGE', 'result': 'waited'})
+    run.done(entry)
+    print(f"[EXECUTED] WAIT_FOR_PAGE{_waited_note(entry)}")
+
+
+@register_action('YOUTUBE_PLAY', _required_text_arg, blocking=True,
+                 absorbs=('SLEEP', 'PRESS', 'CLICK', 'WAIT_FOR_PAGE'))
+def _action_youtube_play(run, step):
+    global CURRENT_APP_CONTEXT, LISTEN_SUSPEND_UNTIL
+    video_query = step.args
+    status = play_youtube(video_query)
+    if status == 'playing':
+        CURRENT_APP_CONTEXT = 'youtube'
+        run.suppress_done_speak = True
+        # pause listening briefly to avoid capturing the video's audio
+        LISTEN_SUSPEND_UNTIL = time.time() + 3.0
+        run.done({'action': 'YOUTUBE_PLAY', 'query': video_query, 'result': 'playing'})
+        print(f"[EXECUTED] YOUTUBE_PLAY {video_query}")
+        # Skip any immediately following UI steps that try to click the search results
+        # (common plans include PRESS enter / SLEEP / CLICK left after a YOUTUBE_PLAY)
+        absorbs = ACTION_REGISTRY['YOUTUBE_PLAY'].absorbs
+        while True:
+            nxt = run.plan.peek_step()
+            if nxt is None or nxt.action not in absorbs:
+                break
+            print(f"[SKIPPED] {run.plan.next_step().line}")
+    elif status == 'search_opened':
+        # Search page opened; still count as an executed action
+        CURRENT_APP_CONTEXT = 'youtube'
+        run.done({'action': 'YOUTUBE_PLAY', 'query': video_query, 'result': 'search_opened'})
+        print(f"[EXECUTED] YOUTUBE_PLAY (search opened) {video_query}")
+    else:
+        print(f"[YOUTUBE_PLAY ERROR] Could not find or play video: {video_query}")
+        run.record({'action': 'YOUTUBE_PLAY', 'query': video_query, 'result': 'failed'})
+
+
+def _blocking_step_completed(actions, step):
+    """Whether the last run of blocking `step` in the audit log finished its effect (e.g. the video is playing)."""
+    for entry in reversed(actions):
+        if entry.get('action') == step.action:
+            return entry.get('result') not in ('failed', 'search_opened') and entry.get('ready') is not False
+    return False
+
+
+class PlanOptimizer:
+    """Rule-based pass between plan parsing and execution, driven by ActionSpec properties.
+    Wraps a PlanLineStream (same next_step()/peek_step() interface) and, as steps arrive:
+      - drops a wait right after a blocking step (e.g. SLEEP after WAIT_FOR_PAGE, or after YOUTUBE_PLAY
+        when `completed(step)` says it finished its effect: a failed or fallback run keeps the wait)
+      - drops an OPEN/SWITCH of the target that the previous non-wait step already focused
+      - merges back-to-back SLEEPs that are already parsed into one SLEEP (one readiness-bounded wait)
+    Lookahead never waits for the LLM, so streamed plans still start on their first line.
+    """
+
+    def __init__(self, plan, completed=None):
+        self.plan = plan
+        self.completed = completed or (lambda step: True)
+        self.before = []
+        self.after = []
+        self.rules = {}
+        self.saved_s = 0.0
+        self._prev = None
+        self._prev_action = None
+
+    def peek_step(self):
+        return self.plan.peek_step()
+
+    def _drop(self, step, rule, saved=0.0):
+        self.rules[rule] = self.rules.get(rule, 0) + 1
+        self.saved_s += saved
+        print(f"[PLAN OPT] {rule}: dropped {step.line}")
+
+    def _redundant(self, step, spec):
+        prev, prev_action = self._prev, self._prev_action
+        if spec.wait and prev is not None and ACTION_REGISTRY[prev.action].blocking \
+                and (ACTION_REGISTRY[prev.action].wait or self.completed(prev)):
+            return 'wait_after_blocking'
+        if spec.focus and prev_action is not None and ACTION_REGISTRY[prev_action.action].focus \
+                and str(step.args).lower() == str(prev_action.args).lower() \
+                and (step.action == prev_action.action or step.action == 'SWITCH'):
+            return 'duplicate_focus'
+        return None
+
+    def next_step(self):
+        while True:
+            step = self.plan.next_step()
+            if step is None or step.action is None or step.error:
+                return step
+            self.before.append(step.line)
+            spec = ACTION_REGISTRY[step.action]
+            rule = self._redundant(step, spec)
+            if rule:
+                self._drop(step, rule, spec.seconds(step))
+                continue
+            if step.action == 'SLEEP':
+                merged = step.args
+                while True:
+                    nxt = self.plan.peek_step_nowait()
+                    if nxt is None or nxt.action != 'SLEEP' or nxt.error:
+                        break
+                    self.plan.next_step()
+                    self.before.append(nxt.line)
+                    self._drop(nxt, 'merge_sleep')
+                    merged += nxt.args
+                if merged != step.args:
+                    step = PlanStep(f"ACTION: SLEEP {merged:g}", 'SLEEP', f"{merged:g}", merged)
+            self.after.append(step.line)
+            self._prev = step
+            if not spec.wait:
+                self._prev_action = step
+            return step
+
+    def summary(self):
+        """Before/after plan and estimated seconds saved, or None when nothing changed."""
+        if not self.rules:
+            return None
+        return {'before': self.before, 'after': self.after, 'rules': dict(self.rules),
+                'saved_s': round(self.saved_s, 3)}
+
+
+def _append_action_log(log_entry):
+    """Write one turn to the audit log (action_log.jsonl)."""
+    try:
+        with open(ACTION_LOG_FILE, 'a', encoding='utf-8') as lf:
+            lf.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+    except Exception as e:
+        print(f"[LOG ERROR] Could not write action log: {e}")
+
+
+def execute_via_ai_plan(client, user_command, language='en', plan=None, batch=None, cancel=None, targets=None,
+                        local_intent=None):
+    """
+    Universal executor: Ask AI to plan and output executable actions for any user command.
+    The AI will produce a structured plan that Nova then executes.
+    `plan` (a PlanLineStream) skips planning, e.g. for a segment planned by execute_batch; `batch`
+    marks a segment of a compound command (logged; the 'Done' confirmation is left to execute_batch).
+    The plan runs under `cancel` (a CancelToken, new by default): once cancelled it stops before the
+    next step and the action log records how far it got. `targets` ({raw OPEN target: resolved})
+    skips re-resolving those targets, e.g. when replaying a macro. `local_intent` is the
+    (intent, match) pair when the caller already ran match_local_intent on this command.
+    Returns True if execution succeeded or was attempted.
+    """
+    if not system_control_enabled():
+        return False
 
-        m_code = re.match(r"^\s*type\s+code(?:\s+(.+))?$", user_command, flags=re.IGNORECASE)
-        if m_code:
-            topic = (m_code.group(1) or '').strip()
-            if not client:
-                print("[TYPE CODE ERROR] AI client required to generate code.")
-                speak("I need the AI client configured to generate code. Please set GROQ_API_KEY.", language)
-                return False
-            prompt = (
-                f"Write a clear, runnable code snippet{(' to ' + topic) if topic else ''}. "
-                "Include brief comments and only return the code and comments."
-            )
-            try:
-                content = generate_long_text(client, prompt, language=language)
-                if not content:
-                    print("[TYPE CODE ERROR] AI returned empty content")
-                    return False
-                set_clipboard_and_paste(content)
-                print(f"[EXECUTED] TYPED code{(' for ' + topic) if topic else ''} into current focus")
-                try:
-                    set_floating_focus()
-                except Exception:
-                    pass
-                return True
-            except Exception as e:
-                print(f"[TYPE CODE ERROR] {e}")
-                return False
+    token = cancel or CancelToken(user_command)
+    if cancel is None:
+        with _ACTIVE_TOKENS_LOCK:
+            _ACTIVE_TOKENS.add(token)
+    previous_token = _set_cancel_token(token)
+    try:
+        print(f"[DEBUG EXECUTE] user_command='{user_command}'")
+        turn_started = time.time()
+        # Read configurable delays from environment at runtime so tests can override them
+        startup_sleep = float(os.getenv('SPOTIFY_STARTUP_SLEEP', str(SPOTIFY_STARTUP_SLEEP)))
+        post_space_delay = float(os.getenv('POST_SPACE_DELAY', str(POST_SPACE_DELAY)))
+        default_open_sleep = float(os.getenv('DEFAULT_OPEN_SLEEP', str(DEFAULT_OPEN_SLEEP)))
+        # Local fast path: deterministic intents (and the long-form writing commands)
+        # are matched by the compiled grammar in intents.json, in microseconds.
+        planned_by_caller = plan is not None
+        match_started = time.perf_counter()
+        if planned_by_caller:
+            intent, intent_match = None, None
+        else:
+            intent, intent_match = local_intent or match_local_intent(user_command)
+        match_us = (time.perf_counter() - match_started) * 1e6
+        if intent is not None and intent.get('handler'):
+            print(f"[INTENT] {intent['name']} ({match_us:.0f}us)")
+            ok = LOCAL_INTENT_HANDLERS[intent['handler']](client, intent_match, user_command, language)
+            # Handler turns have no plan (so they are never saved into macros) but are audited like any other
+            log_entry = {
+                "timestamp": turn_started,
+                "user_command": user_command,
+                "plan": None,
+                "prompt_version": PLANNER_PROMPT_VERSION,
+                "actions": [],
+                "intent": {'name': intent['name'], 'handler': intent['handler'], 'match_us': round(match_us, 1)},
+                "status": 'cancelled' if token.cancelled else ('completed' if ok else 'failed'),
+                "timing": {'first_action_ms': None, 'total_ms': round((time.time() - turn_started) * 1000, 1)},
+            }
+            if batch is not None:
+                log_entry['batch'] = batch
+            if token.cancelled:
+                log_entry['cancel'] = {'reason': token.reason}
+            _append_action_log(log_entry)
+            return ok
+        # Repeat commands in the same context reuse a previously successful plan (no LLM round-trip)
+        cache_key = PlanCache.make_key(user_command, CURRENT_APP_CONTEXT, language)
+        cache_fingerprint = hashlib.sha1(
+            (PLANNER_PROMPT_VERSION + PLANNER_PROMPT + _file_fingerprint(APP_MAPPINGS_FILE)).encode('utf-8')
+        ).hexdigest()[:16]
+        plan_text = None
+        if plan is not None:
+            pass
+        elif intent is not None:
+            # Template intent: the plan is rendered locally, no cache or LLM needed
+            plan_text = render_intent_plan(intent, intent_match)
+            print(f"[INTENT] {intent['name']} ({match_us:.0f}us)")
+        elif PLAN_CACHE_ENABLED:
+            plan_text = PLAN_CACHE.get(cache_key, cache_fingerprint)
+        plan_cache_hit = intent is None and plan_text is not None
+        if plan_cache_hit:
+            print(f"[PLAN CACHE] Hit for '{normalize_command(user_command)}'")
+        plan_usage = {}
+        if plan is not None:
+            pass
+        elif plan_text is not None:
+            plan = PlanLineStream.from_text(plan_text)
+        else:
+            # Stream the plan: each ACTION line is dispatched as soon as it is complete,
+            # while the rest of the completion is still being generated.
+            plan = PlanLineStream()
+            messages = [{"role": "user", "content": user_command}]
 
-        # ------------------------------------------------------------------
-        # Generic write command: 'write <anything>' -> open Notepad and write AI response
-        m2 = re.match(r"^\s*write\s+(.+)$", user_command, flags=re.IGNORECASE)
-        if m2:
-            prompt_body = m2.group(1).strip()
-            # Avoid matching the 'write essay' case which is handled above
-            if re.match(r"^(esaay|essay|type)\b", prompt_body, flags=re.IGNORECASE):
-                pass
-            else:
-                if not client:
-                    print("[WRITE ERROR] AI client required to write content.")
-                    speak("I need the AI client configured to write content. Please set GROQ_API_KEY.", language)
-                    return False
+            def produce_plan():
                 try:
-                    # Use a flexible prompt to generate a relevant piece of text
-                    gen_prompt = f"Write a helpful and well-structured piece based on: {prompt_body}."
-                    content = generate_long_text(client, gen_prompt, language=language)
-                    if not content:
-                        print("[WRITE ERROR] AI returned empty content")
-                        return False
-                    open_path('notepad')
-                    time.sleep(1.0)
-                    set_clipboard_and_paste(content)
-                    print(f"[EXECUTED] WROTE '{prompt_body}' to Notepad")
-                    try:
-                        set_floating_focus()
-                    except Exception:
-                        pass
-                    return True
+                    text = get_ai_response(client, messages, language, preprompt=PLANNER_PROMPT, on_token=plan.feed,
+                                           echo=False, persona=False, usage=plan_usage, call_site='planner')
+                    plan.close(text)
                 except Exception as e:
-                    print(f"[WRITE ERROR] {e}")
-                    return False
-        # Build a meta-instruction for the AI: analyze the command and output executable actions
-        meta_instruction = (
-            f"You are Nova's AI action executor. Analyze the user's command and output a list of executable actions.\n"
-            f"THINK STEP-BY-STEP: Break down complex commands into logical sub-actions.\n"
-            f"\n"
-            f"MUSIC & MEDIA EXAMPLES:\n"
-            f"- 'play music' or 'play song' → OPEN spotify → SLEEP 1 → PRESS space (to play, stays visible)\n"
-            f"- 'play music in background' → OPEN spotify → SLEEP 1 → PRESS space → PRESS alt+tab (to minimize/background)\n"
-            f"- 'skip song' or 'skip music' → PRESS right (next track) or PRESS n (Spotify shortcut)\n"
-            f"- 'pause music' → PRESS space (pause/play toggle)\n"
-            f"- 'volume up' → PRESS volumeup\n"
-            f"- 'volume down' → PRESS volumedown\n"
-            f"\n"
-            f"YOUTUBE & WEB EXAMPLES:\n"
-            f"- 'play video on youtube' or 'youtube video':\n"
-            f"ACTION: YOUTUBE_PLAY song name\n"
-            f"\n"
-            f"- 'youtube play in background':\n"
-            f"ACTION: YOUTUBE_PLAY song name\n"
-            f"ACTION: PRESS alt+tab\n"
-            f"\n"
-            f"- For web apps like Instagram, if the user mentions 'chat', 'inbox', or 'messages', open the direct inbox URL (e.g., https://www.instagram.com/direct/inbox/).\n"
-            f"OTHER EXAMPLES:\n"
-            f"- 'open notepad and write' → OPEN notepad → SLEEP 1 → TYPE the content\n"
-            f"- 'set alarm for 7 pm' → SET_ALARM 19:00\n"
-            f"- 'open chatgpt and click' → OPEN https://chatgpt.com → WAIT_FOR_PAGE → CLICK left\n"
-            f"\n"
-            f"Format each action as a single line starting with ACTION: followed by the type and parameters.\n"
-            f"\n"
-            f"Valid action types:\n"
-            f"  OPEN <path/url/app> - Opens a file, folder, URL, or application\n"
-            f"  SEARCH <query> - Searches in current browser (opens Chrome if needed)\n"
-            f"  TYPE <text> - Types text into currently focused window\n"
-            f"  PRESS <keys> - Presses keyboard keys (space, enter, right, left, volumeup, volumedown, etc.)\n"
-            f"    Media keys: 'space' (play/pause), 'right' or 'n' (next), 'left' or 'p' (previous)\n"
-            f"    Volume: 'volumeup', 'volumedown'\n"
-            f"    Combinations: 'ctrl+c', 'alt+tab', 'ctrl+v', etc.\n"
-            f"  CLICK <button> - Clicks mouse button ('left', 'right', 'middle')\n"
-            f"  SWITCH <app> - Switches to an open application\n"
-            f"  NEXT_TAB - Ctrl+Tab to next browser tab\n"
-            f"  PREV_TAB - Ctrl+Shift+Tab to previous browser tab\n"
-            f"  NEW_TAB - Ctrl+T to open new browser tab\n"
-            f"  CLOSE_TAB - Ctrl+W to close current browser tab\n"
-            f"  SET_ALARM <HH:MM or time string> - Set an alarm (e.g., '19:00' or '7:00 PM')\n"
-            f"  YOUTUBE_PLAY <video name/query> - Search YouTube and play first result (auto-plays instantly)\n"
-            f"  SLEEP <seconds> - Wait/pause for specified seconds\n"
-            f"  WAIT_FOR_PAGE - Wait 3 seconds for page to load\n"
-            f"\n"
-            f"OUTPUT RULES:\n"
-            f"- MANDATORY: Output ONLY ACTION lines, NOTHING ELSE\n"
-            f"- Do NOT include 'Reason:', explanations, reasoning, or any text after actions\n"
-            f"- Do NOT output arrows (→), examples, or commentary\n"
-            f"- EVERY action MUST be on a new line and start with 'ACTION:'\n"
-            f"- ALWAYS add SLEEP or WAIT_FOR_PAGE after OPEN (use SLEEP 1-2 for web URLs, SLEEP 1 for apps)\n"
-            f"- Add SLEEP 0.5 between TYPE and PRESS enter for page interaction\n"
-            f"- For YouTube: Prefer using 'YOUTUBE_PLAY <query>' which should auto-open and play the first result; do NOT add extra SLEEP/CLICK/PRESS steps after a YOUTUBE_PLAY action.\n"
-            f"- IMPORTANT: Only add PRESS alt+tab if user explicitly says 'background' or 'minimize'\n"
-            f"- For media/music: assume the media player or Spotify is already focused when user says 'skip', 'pause', etc.\n"
-            f"- If user says 'skip again' or 'skip more', chain multiple PRESS right actions\n"
-        )
+                    plan.close(error=e)
 
-        # Encourage the AI to correct minor spelling mistakes, normalize app names,
-        # and prefer local applications when appropriate (e.g., alarms -> Windows Alarms & Clock).
-        # This makes the AI more robust to user typos and ambiguous phrases.
-        # Also hint about common music commands and background operations.
-        meta_instruction = (
-            "Correct any minor spelling mistakes in the user's command, normalize app names, and prefer opening local applications when appropriate.\n"
-            "For music commands (play, pause, stop, skip), use spotify: if available, else assume music player is open.\n"
-            "For background operations, use PRESS alt+tab or PRESS alt+f9 (minimize) after the main action.\n"
-            + meta_instruction
-        )
+            threading.Thread(target=produce_plan, daemon=True).start()
+            # Cancelling ends the plan at once, even while the planner is still streaming
+            token.on_cancel(lambda: plan.close(error=LLMCancelled(token.reason)))
 
-        messages = [{"role": "user", "content": user_command}]
-        plan_text = get_ai_response(client, messages, language, preprompt=meta_instruction)
+        # Start resolving OPEN/SWITCH targets as soon as their lines are parsed
+        prefetcher = TargetPrefetcher(client, user_command, language)
+        prefetcher.seed(targets)
+        plan.watch(prefetcher.on_line)
 
         # Prepare audit log entry
         log_entry = {
             "timestamp": time.time(),
             "user_command": user_command,
             "plan": plan_text,
+            "prompt_version": PLANNER_PROMPT_VERSION,
             "actions": []
         }
-
-        # Parse and execute actions (use index-based loop so we can skip redundant steps)
-        print(f"[AI PLAN]\n{plan_text}\n")
-        actions_executed = 0
-        suppress_done_speak = False
-        plan_lines = [l.strip() for l in plan_text.splitlines() if l.strip()]
-        i = 0
-        while i < len(plan_lines):
-            line = plan_lines[i]
-            i += 1
-            if not line.lower().startswith('action:'):
+        if batch is not None:
+            log_entry['batch'] = batch
+        if intent is not None:
+            log_entry['intent'] = {'name': intent['name'], 'match_us': round(match_us, 1)}
+        elif PLAN_CACHE_ENABLED and not planned_by_caller:
+            log_entry['plan_cache'] = dict(PLAN_CACHE.stats(), hit=plan_cache_hit)
+
+        # Execute compiled steps as they arrive (peek_step() gives lookahead; next_step() lets handlers skip steps)
+        optimizer = None
+        if PLAN_OPTIMIZER_ENABLED:
+            optimizer = PlanOptimizer(plan, completed=lambda step: _blocking_step_completed(log_entry['actions'], step))
+        run = PlanRun(client, user_command, language, optimizer or plan, prefetcher, log_entry, startup_sleep,
+                      post_space_delay, token)
+        first_action_at = None
+        steps = 0
+        # Executor overhead: from a parsed step to its handler being called (waits for launches excluded)
+        dispatch_s = 0.0
+        interrupted = None
+        while not token.cancelled:
+            try:
+                step = run.plan.next_step()
+            except Exception:
+                # Cancelling aborts the planner stream too
+                if token.cancelled:
+                    break
+                raise
+            if step is None:
+                break
+            print(f"[AI PLAN] {step.line}")
+            if step.action is None:
                 continue
-
-            action_str = line[7:].strip()  # Remove 'ACTION:' prefix
-            parts = action_str.split(None, 1)
-            if not parts:
+            dispatch_started = time.perf_counter()
+            if first_action_at is None:
+                first_action_at = time.time()
+            steps += 1
+            if step.error:
+                print(f"[PLAN INVALID] {step.line} ({step.error})")
+                run.record({'action': step.action, 'param': step.param[:200], 'result': 'invalid', 'error': step.error},
+                           time.time())
                 continue
-
-            action_type = parts[0].upper()
-            action_param = parts[1] if len(parts) > 1 else ""
-
-            # Execute the action
+            spec = ACTION_REGISTRY[step.action]
+            # Dependency scheduling: waits for a launch run beside later launches; any other step
+            # depends on everything before it and waits for the deferred ones first
+            if spec.wait and run.can_defer():
+                run.defer(spec.handler, step)
+                dispatch_s += time.perf_counter() - dispatch_started
+                continue
+            if spec.launch:
+                run.chain = None
+                run.launches.append(step.args)
+            elif not spec.wait:
+                join_started = time.perf_counter()
+                run.join_launches(refocus=spec.focus_sensitive)
+                dispatch_started += time.perf_counter() - join_started
+            ready_before = run.ready
+            run.step_started = time.time()
+            dispatch_s += time.perf_counter() - dispatch_started
             try:
-                if action_type == "OPEN":
-                    # Parse URL or path from param
-                    target = action_param.strip('"\'')
-                    # Smart resolution: try mappings and AI to normalize ambiguous targets
-                    try:
-                        kind, resolved = resolve_open_target(client, target, user_command, language)
-                        if kind == 'url' and resolved:
-                            target = resolved
-                        elif kind == 'path' and resolved:
-                            target = resolved
-                        elif kind == 'app' and resolved:
-                            target = resolved
-                    except Exception:
-                        pass
-                    # Special-case: if user or AI referenced alarms/clock, open Windows Alarms & Clock
-                    if target and any(k in target.lower() for k in ['alarm', 'alarms', 'clock']):
-                        try:
-                            # Use Windows URI to open Alarms & Clock
-                            subprocess.Popen(['cmd', '/c', 'start', '', 'ms-clock:'], shell=True)
-                            CURRENT_APP_CONTEXT = 'alarm'
-                            LAST_OPENED_TARGET = 'ms-clock:'
-                            actions_executed += 1
-                            print(f"[EXECUTED] OPEN ms-clock:")
-                            continue
-                        except Exception as e:
-                            print(f"[OPEN ALARM ERROR] {e}")
-                            # fallthrough to other attempts
-                    # Determine if it's a local app, path, or URL
-                    is_url = is_likely_url(target)
-                    is_local_app = target.lower() in ['notepad', 'notepad.exe', 'chrome', 'firefox', 'edge', 'vs code', 'code', 'explorer', 'cmd', 'powershell']
-                    
-                    if is_url or target.startswith('http'):
-                        # It's a URL, open in Chrome
-                        if HAS_SELENIUM and not target.endswith('.com'):
-                            try:
-                                options = webdriver.ChromeOptions()
-                                options.add_argument('--new-window')
-                                driver = webdriver.Chrome(ChromeDriverManager().install(), options=options)
-                                driver.get(target)
-                                CURRENT_APP_CONTEXT = 'chrome'
-                                actions_executed += 1
-                                print(f"[EXECUTED] OPEN {target}")
-                            except Exception as e:
-                                # Fallback to webbrowser
-                                webbrowser.open(target)
-                                CURRENT_APP_CONTEXT = 'chrome'
-                                actions_executed += 1
-                                print(f"[EXECUTED] OPEN {target}")
-                        else:
-                            webbrowser.open(target)
-                            CURRENT_APP_CONTEXT = 'chrome'
-                            actions_executed += 1
-                            log_entry['actions'].append({
-                                'action': 'OPEN', 'target': target, 'result': 'opened_in_browser'
-                            })
-                            print(f"[EXECUTED] OPEN {target}")
-                        # If opening Spotify, and next action is an immediate PRESS space, wait briefly to allow app to start
-                        try:
-                            if 'spotify' in target.lower() and i < len(plan_lines):
-                                nxt = plan_lines[i].lower()
-                                if nxt.startswith('action: press') and 'space' in nxt:
-                                    time.sleep(startup_sleep)
-                                    log_entry['actions'].append({'action': 'SLEEP', 'seconds': startup_sleep, 'reason': 'spotify_startup'})
-                                    print(f"[AUTO SLEEP] Waited {startup_sleep}s for Spotify to start")
-                        except Exception:
-                            pass
-                    elif is_local_app or os.path.exists(target):
-                        # It's a local application or file/folder
-                        open_path(target)
-                        LAST_OPENED_TARGET = target
-                        CURRENT_APP_CONTEXT = target.split('\\')[-1].lower() if '\\' in target else target.lower()
-                        actions_executed += 1
-                        log_entry['actions'].append({
-                            'action': 'OPEN', 'target': target, 'result': 'opened_local'
-                        })
-                        print(f"[EXECUTED] OPEN {target}")
-                        # If opening Spotify, and next action is PRESS space, wait briefly before the next action
-                        try:
-                            if 'spotify' in target.lower() and i < len(plan_lines):
-                                nxt = plan_lines[i].lower()
-                                if nxt.startswith('action: press') and 'space' in nxt:
-                                    time.sleep(startup_sleep)
-                                    log_entry['actions'].append({'action': 'SLEEP', 'seconds': startup_sleep, 'reason': 'spotify_startup'})
-                                    print(f"[AUTO SLEEP] Waited {startup_sleep}s for Spotify to start")
-                        except Exception:
-                            pass
-                    else:
-                        # Try as a local app/path anyway
-                        open_path(target)
-                        LAST_OPENED_TARGET = target
-                        CURRENT_APP_CONTEXT = target.lower()
-                        actions_executed += 1
-                        log_entry['actions'].append({
-                            'action': 'OPEN', 'target': target, 'result': 'opened_fallback'
-                        })
-                        print(f"[EXECUTED] OPEN {target}")
-                        # If opening Spotify (fallback case), and next action is PRESS space, wait briefly
-                        try:
-                            if 'spotify' in target.lower() and i < len(plan_lines):
-                                nxt = plan_lines[i].lower()
-                                if nxt.startswith('action: press') and 'space' in nxt:
-                                    time.sleep(startup_sleep)
-                                    log_entry['actions'].append({'action': 'SLEEP', 'seconds': startup_sleep, 'reason': 'spotify_startup'})
-                                    print(f"[AUTO SLEEP] Waited {startup_sleep}s for Spotify to start")
-                        except Exception:
-                            pass
-
-                elif action_type == "SET_ALARM":
-                    # action_param expected like '19:00' or '7 pm' or '07:00 PM'
-                    raw = action_param.strip('"\'')
-                    normalized = parse_time_string(raw)
-                    if normalized:
-                        res = set_windows_alarm(normalized)
-                        actions_executed += 1 if res else 0
-                        log_entry['actions'].append({'action': 'SET_ALARM', 'time': normalized, 'result': 'ok' if res else 'partial'})
-                        print(f"[EXECUTED] SET_ALARM {normalized} -> {'ok' if res else 'partial'}")
-                    else:
-                        print(f"[SET_ALARM] Could not parse time: {raw}")
-                        log_entry['actions'].append({'action': 'SET_ALARM', 'time_raw': raw, 'result': 'failed_parse'})
-                        # Try to open the Clock app so user can complete manually
-                        try:
-                            subprocess.Popen(['cmd', '/c', 'start', '', 'ms-clock:'], shell=True)
-                            actions_executed += 1
-                            log_entry['actions'].append({'action': 'OPEN', 'target': 'ms-clock:', 'result': 'opened_for_manual'})
-                        except Exception as e:
-                            print(f"[SET_ALARM] fallback open error: {e}")
-
-                elif action_type == "SEARCH":
-                    query = action_param.strip('"\'')
-                    # If the user's original command referenced YouTube or asked to play a video,
-                    # prefer the quick YOUTUBE_PLAY path to avoid slow typed-search + clicks.
-                    uc = user_command.lower() if 'user_command' in locals() else ''
-                    if 'youtube' in uc or ('play' in uc and 'video' in uc):
-                        status = play_youtube(query)
-                        if status in ('playing', 'search_opened'):
-                            actions_executed += 1
-                            CURRENT_APP_CONTEXT = 'youtube'
-                            log_entry['actions'].append({'action': 'SEARCH', 'query': query, 'result': status})
-                            print(f"[EXECUTED] SEARCH (youtube) {query}")
-                            continue
-                        # else fall through to normal search behavior
-                    # Detect if browser is open, otherwise use Chrome
-                    if not CURRENT_APP_CONTEXT or CURRENT_APP_CONTEXT not in ['chrome', 'browser']:
-                        detect_and_set_browser_context()
-                    if not CURRENT_APP_CONTEXT or CURRENT_APP_CONTEXT not in ['chrome', 'browser']:
-                        # Open Chrome first if no browser detected
-                        webbrowser.open('about:blank')
-                        CURRENT_APP_CONTEXT = 'chrome'
-                    
-                    q = urllib.parse.quote_plus(query)
-                    search_url = f"https://www.google.com/search?q={q}"
-                    webbrowser.open(search_url)
-                    actions_executed += 1
-                    log_entry['actions'].append({
-                        'action': 'SEARCH', 'query': query, 'result': 'opened_search'
-                    })
-                    print(f"[EXECUTED] SEARCH {query}")
-
-                elif action_type == "TYPE":
-                    text = action_param.strip('"\'')
-                    set_clipboard_and_paste(text)
-                    actions_executed += 1
-                    log_entry['actions'].append({
-                        'action': 'TYPE', 'text': text[:200]
-                    })
-                    print(f"[EXECUTED] TYPE {text[:50]}...")
-
-                elif action_type == "PRESS":
-                    keys = action_param.strip('"\'').lower()
-                    # Convert common key names
-                    key_map = {
-                        'enter': 'enter',
-                        'return': 'enter',
-                        'space': 'space',
-                        'tab': 'tab',
-                        'escape': 'esc',
-                        'esc': 'esc',
-                        'backspace': 'backspace',
-                        'delete': 'delete',
-                        'insert': 'insert',
-                        'home': 'home',
-                        'end': 'end',
-                        'pageup': 'pageup',
-                        'pagedown': 'pagedown',
-                        'up': 'up',
-                        'down': 'down',
-                        'left': 'left',
-                        'right': 'right',
-                        'volumeup': 'volumeup',
-                        'volumedown': 'volumedown',
-                        'n': 'n',  # Spotify next shortcut
-                        'p': 'p',  # Spotify previous shortcut
-                        'f1': 'f1', 'f2': 'f2', 'f3': 'f3', 'f4': 'f4', 'f5': 'f5',
-                        'f6': 'f6', 'f7': 'f7', 'f8': 'f8', 'f9': 'f9', 'f10': 'f10',
-                    }
-                    
-                    # Handle key combinations (ctrl+c, alt+tab, etc.)
-                    if '+' in keys:
-                        key_parts = [k.strip() for k in keys.split('+')]
-                        if HAS_PYAUTOGUI:
-                            try:
-                                pyautogui.hotkey(*key_parts)
-                                actions_executed += 1
-                                log_entry['actions'].append({
-                                    'action': 'PRESS', 'keys': keys, 'result': 'hotkey_executed'
-                                })
-                                print(f"[EXECUTED] PRESS {keys}")
-                            except Exception as e:
-                                print(f"[PRESS ERROR] pyautogui hotkey failed: {e}")
-                        else:
-                            print(f"[PRESS ERROR] pyautogui not available for key combination: {keys}")
-                    else:
-                        # Single key press (including media keys like volumeup, volumedown)
-                        mapped_key = key_map.get(keys, keys)
-                        if HAS_PYAUTOGUI:
-                            try:
-                                pyautogui.press(mapped_key)
-                                actions_executed += 1
-                                log_entry['actions'].append({
-                                    'action': 'PRESS', 'keys': mapped_key, 'result': 'pressed'
-                                })
-                                print(f"[EXECUTED] PRESS {keys}")
-                            except Exception as e:
-                                print(f"[PRESS ERROR] pyautogui press failed: {e}")
-                        else:
-                            print(f"[PRESS ERROR] pyautogui not available for key: {keys}")
-                        # If we just pressed space (or attempted to), and next action is an immediate alt+tab, give a short pause
-                        try:
-                            if mapped_key == 'space' and i < len(plan_lines):
-                                nxt = plan_lines[i].lower()
-                                # If next action will switch/minimize or is another key press, allow a short delay
-                                if 'alt+tab' in nxt or 'alt+f9' in nxt or nxt.startswith('action: press') or nxt.startswith('action: switch') or nxt.startswith('action: open'):
-                                    time.sleep(post_space_delay)
-                                    log_entry['actions'].append({'action': 'SLEEP', 'seconds': post_space_delay, 'reason': 'post_space_delay'})
-                                    print(f"[AUTO SLEEP] Waited {post_space_delay}s after space before next action")
-                        except Exception:
-                            pass
-
-                elif action_type == "CLICK":
-                    button = action_param.strip('"\'').lower() or 'left'
-                    if HAS_PYAUTOGUI:
-                        click_mouse(button)
-                        actions_executed += 1
-                        log_entry['actions'].append({
-                            'action': 'CLICK', 'button': button, 'result': 'clicked'
-                        })
-                        print(f"[EXECUTED] CLICK {button}")
-                    else:
-                        print(f"[CLICK ERROR] pyautogui not available")
-
-                elif action_type == "SWITCH":
-                    app = action_param.strip('"\'')
-                    switch_to_app(app)
-                    CURRENT_APP_CONTEXT = app.lower()
-                    actions_executed += 1
-                    log_entry['actions'].append({
-                        'action': 'SWITCH', 'app': app, 'result': 'switched'
-                    })
-                    print(f"[EXECUTED] SWITCH {app}")
-
-                elif action_type == "NEXT_TAB":
-                    if HAS_PYAUTOGUI:
-                        browser_tab_action('next')
-                        actions_executed += 1
-                        log_entry['actions'].append({'action': 'NEXT_TAB', 'result': 'done'})
-                        print(f"[EXECUTED] NEXT_TAB")
-
-                elif action_type == "PREV_TAB":
-                    if HAS_PYAUTOGUI:
-                        browser_tab_action('previous')
-                        actions_executed += 1
-                        log_entry['actions'].append({'action': 'PREV_TAB', 'result': 'done'})
-                        print(f"[EXECUTED] PREV_TAB")
-
-                elif action_type == "NEW_TAB":
-                    if HAS_PYAUTOGUI:
-                        browser_tab_action('new')
-                        actions_executed += 1
-                        log_entry['actions'].append({'action': 'NEW_TAB', 'result': 'done'})
-                        print(f"[EXECUTED] NEW_TAB")
-
-                elif action_type == "CLOSE_TAB":
-                    if HAS_PYAUTOGUI:
-                        browser_tab_action('close')
-                        actions_executed += 1
-                        log_entry['actions'].append({'action': 'CLOSE_TAB', 'result': 'done'})
-                        print(f"[EXECUTED] CLOSE_TAB")
-
-                elif action_type == "SLEEP":
-                    seconds = float(action_param) if action_param else 1
-                    time.sleep(seconds)
-                    actions_executed += 1
-                    log_entry['actions'].append({'action': 'SLEEP', 'seconds': seconds})
-                    print(f"[EXECUTED] SLEEP {seconds}s")
-
-                elif action_type == "WAIT_FOR_PAGE":
-                    # Simple wait for page to load
-                    time.sleep(3)
-                    actions_executed += 1
-                    log_entry['actions'].append({'action': 'WAIT_FOR_PAGE', 'result': 'waited'})
-                    print(f"[EXECUTED] WAIT_FOR_PAGE")
-
-                elif action_type == "YOUTUBE_PLAY":
-                    video_query = action_param.strip('"\'')
-                    status = play_youtube(video_query)
-                    if status == 'playing':
-                        actions_executed += 1
-                        CURRENT_APP_CONTEXT = 'youtube'
-                        suppress_done_speak = True
-                        # pause listening briefly to avoid capturing the video's audio
-                        try:
-                            global LISTEN_SUSPEND_UNTIL
-                            LISTEN_SUSPEND_UNTIL = time.time() + 3.0
-                        except Exception:
-                            pass
-                        log_entry['actions'].append({
-                            'action': 'YOUTUBE_PLAY', 'query': video_query, 'result': 'playing'
-                        })
-                        print(f"[EXECUTED] YOUTUBE_PLAY {video_query}")
-                        # Skip any immediately following UI steps that try to click the search results
-                        # (common plans include PRESS enter / SLEEP / CLICK left after a YOUTUBE_PLAY)
-                        while i < len(plan_lines):
-                            nxt = plan_lines[i].lower()
-                            if nxt.startswith('action: sleep') or nxt.startswith('action: press') or nxt.startswith('action: click') or nxt.startswith('action: wait_for_page'):
-                                i += 1
-                                continue
-                            break
-                    elif status == 'search_opened':
-                        # Search page opened; still count as an executed action
-                        actions_executed += 1
-                        CURRENT_APP_CONTEXT = 'youtube'
-                        log_entry['actions'].append({
-                            'action': 'YOUTUBE_PLAY', 'query': video_query, 'result': 'search_opened'
-                        })
-                        print(f"[EXECUTED] YOUTUBE_PLAY (search opened) {video_query}")
-                    else:
-                        print(f"[YOUTUBE_PLAY ERROR] Could not find or play video: {video_query}")
-                        log_entry['actions'].append({
-                            'action': 'YOUTUBE_PLAY', 'query': video_query, 'result': 'failed'
-                        })
-
+                spec.handler(run, step)
             except Exception as e:
-                print(f"[ACTION ERROR] {action_type}: {e}")
-                continue
+                print(f"[ACTION ERROR] {step.action}: {e}")
+            if token.cancelled:
+                interrupted = step.line
+            # A step other than a wait makes the last OPEN/SWITCH readiness probe irrelevant
+            if run.ready is ready_before and not spec.wait:
+                run.ready = None
+        run.join_launches()
+        executed_at = time.time()
+        actions_executed = run.actions_executed
+        suppress_done_speak = run.suppress_done_speak
+        cancelled = token.cancelled
+        log_entry['status'] = 'cancelled' if cancelled else 'completed'
+        if cancelled:
+            log_entry['cancel'] = {'reason': token.reason, 'executed': actions_executed, 'steps': steps,
+                                   'interrupted': interrupted}
+            print(f"[CANCELLED] {token.reason} after {actions_executed} action(s)")
+
+        # The stream has ended: record the full plan and how long planning vs. acting took
+        plan_text = plan.text()
+        log_entry['plan'] = plan_text
+        if plan_usage:
+            log_entry['tokens'] = plan_usage
+        log_entry['resolution'] = prefetcher.summary()
+        optimized = optimizer.summary() if optimizer else None
+        if optimized:
+            log_entry['optimizer'] = optimized
+            print(f"[PLAN OPT] {len(optimized['before'])} -> {len(optimized['after'])} step(s), "
+                  f"~{optimized['saved_s']:g}s saved")
+        log_entry['timing'] = {
+            'first_action_ms': round((first_action_at - turn_started) * 1000, 1) if first_action_at else None,
+            'plan_ms': round(max(0.0, (plan.done_at or time.time()) - turn_started) * 1000, 1),
+            'resolve_ms': prefetcher.summary()['resolve_ms'],
+            'execute_ms': round((executed_at - first_action_at) * 1000, 1) if first_action_at else None,
+            'total_ms': round((time.time() - turn_started) * 1000, 1),
+            'steps': steps,
+            'dispatch_us': round(dispatch_s * 1e6, 1),
+        }
 
-        if actions_executed > 0:
-            print(f"[SUCCESS] Executed {actions_executed} action(s)")
+        if actions_executed > 0 or cancelled:
+            if actions_executed > 0:
+                print(f"[SUCCESS] Executed {actions_executed} action(s)")
+            # A partially executed plan is not cached
+            if PLAN_CACHE_ENABLED and intent is None and not planned_by_caller and not plan_cache_hit and not cancelled:
+                PLAN_CACHE.put(cache_key, cache_fingerprint, plan_text, user_command)
             try:
-                # Speak a short 'Done' confirmation after executing actions
-                if not suppress_done_speak:
+                # Speak a short 'Done' confirmation after executing actions (once per batch, by execute_batch)
+                if not suppress_done_speak and batch is None and not cancelled:
                     speak('Done', language)
             except Exception:
                 pass
@@ -1482,19 +4164,530 @@ def execute_via_ai_plan(client, user_command, language='en'):
             except Exception:
                 pass
             # write audit log line
-            try:
-                with open(ACTION_LOG_FILE, 'a', encoding='utf-8') as lf:
-                    lf.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
-            except Exception as e:
-                print(f"[LOG ERROR] Could not write action log: {e}")
+            _append_action_log(log_entry)
             return True
         else:
+            # A cached plan that no longer executes anything should not be replayed again
+            if plan_cache_hit:
+                PLAN_CACHE.invalidate(cache_key)
             # Silent fail if no valid actions found (AI will try again or speak response)
             return False
 
     except Exception as e:
         print(f"[EXECUTE VIA AI ERROR] {e}")
         return False
+    finally:
+        _set_cancel_token(previous_token)
+        if cancel is None:
+            with _ACTIVE_TOKENS_LOCK:
+                _ACTIVE_TOKENS.discard(token)
+
+
+# Compound utterances ("open notepad then type hello and switch to chrome") are split locally
+# and every segment that needs the planner is planned in a single request.
+SEGMENT_SEPARATOR_RE = re.compile(r"\s*(?:;|,?\s+(?:and\s+)?then\s+|,?\s+after\s+that\s+)\s*", re.IGNORECASE)
+# ' and ' / ', ' only split when the next word starts a new command
+SEGMENT_AND_RE = re.compile(
+    r"\s*(?:,\s*and|\s+and|,)\s+(?=(?:open|launch|start|close|press|hit|click|switch|go|search|"
+    r"play|pause|resume|skip|set|turn|mute|unmute|minimize|maximize)\b)", re.IGNORECASE)
+# A command that dictates text (write/type, incl. essays and code) at the start or after ' and ' / ', '
+SEGMENT_PAYLOAD_RE = re.compile(r"(?:^|(?:,\s*and|\s+and|,)\s+)(?=(?:write|type)\b)", re.IGNORECASE)
+
+
+def split_compound_command(text):
+    """Split an utterance into its commands, in order. Returns [text] when there is nothing to split.
+    Dictated text ('write a story about a boy who went to school then came home') is never split: it runs
+    to the end of the utterance or an explicit ';'. A payload joined with 'and' stays with the command
+    before it ('open notepad and write hi' is one segment for the planner, not the write intent).
+    """
+    text = (text or '').strip()
+    segments = []
+    rest = text
+    while rest:
+        sep = SEGMENT_SEPARATOR_RE.search(rest)
+        end = sep.start() if sep else len(rest)
+        payload = SEGMENT_PAYLOAD_RE.search(rest, 0, end)
+        if payload is None:
+            segments.extend(p.strip() for p in SEGMENT_AND_RE.split(rest[:end]))
+            rest = rest[sep.end():] if sep else ''
+            continue
+        stop = rest.find(';', payload.end())
+        stop = len(rest) if stop < 0 else stop
+        start = 0
+        for m in SEGMENT_AND_RE.finditer(rest, 0, payload.start()):
+            segments.append(rest[start:m.start()].strip())
+            start = m.end()
+        segments.append(rest[start:stop].strip())
+        rest = rest[stop + 1:].strip()
+    segments = [seg for seg in segments if seg]
+    return segments or ([text] if text else [])
+
+
+def build_batch_prompt(segments):
+    numbered = '\n'.join(f"{n}. {segment}" for n, segment in enumerate(segments, 1))
+    return ("Plan these commands. They run in this order, so a command can rely on what the previous ones "
+            "opened or focused.\nBefore the actions of each command output a line 'SEGMENT <number>'.\n" + numbered)
+
+
+def execute_batch(client, utterance, language='en'):
+    """Run a possibly compound utterance: segments run in order with shared context (CURRENT_APP_CONTEXT).
+    Local intents run locally; all remaining segments are planned together in one LLM request whose
+    plan is streamed, so the first segment starts while later ones are still being planned.
+    Returns one {'segment', 'ok', 'source', 'ms'} dict per segment; segments left after the command
+    is cancelled are not run.
+    """
+    segments = split_compound_command(utterance)
+    if len(segments) <= 1:
+        started = time.time()
+        ok = execute_via_ai_plan(client, utterance, language)
+        return [{'segment': (utterance or '').strip(), 'ok': bool(ok), 'source': 'single',
+                 'ms': round((time.time() - started) * 1000, 1)}]
+    token = CancelToken(utterance)
+    with _ACTIVE_TOKENS_LOCK:
+        _ACTIVE_TOKENS.add(token)
+    try:
+        return _execute_segments(client, utterance, segments, language, token)
+    finally:
+        with _ACTIVE_TOKENS_LOCK:
+            _ACTIVE_TOKENS.discard(token)
+
+
+def _execute_segments(client, utterance, segments, language, token):
+    matches = [match_local_intent(segment) for segment in segments]
+    local = {i for i, (intent, _) in enumerate(matches) if intent is not None}
+    planned = [i for i in range(len(segments)) if i not in local]
+    streams = {}
+    if len(planned) > 1:
+        streams = {i: PlanLineStream() for i in planned}
+        batch_plan = PlanLineStream()
+        current = [planned[0]]
+
+        def route(line):
+            m = re.match(r"^\W*segment\s+(\d+)", line, flags=re.IGNORECASE)
+            if m:
+                n = int(m.group(1))
+                if 1 <= n <= len(planned):
+                    current[0] = planned[n - 1]
+                return
+            streams[current[0]].feed(line + '\n')
+
+        def produce_batch():
+            error = None
+            try:
+                messages = [{"role": "user", "content": build_batch_prompt([segments[i] for i in planned])}]
+                text = get_ai_response(client, messages, language, preprompt=PLANNER_PROMPT, on_token=batch_plan.feed,
+                                       echo=False, persona=False, call_site='batch_planner')
+                batch_plan.close(text)
+            except Exception as e:
+                error = e
+                batch_plan.close(error=e)
+            for stream in streams.values():
+                stream.close(error=error)
+
+        batch_plan.watch(route)
+        threading.Thread(target=produce_batch, daemon=True).start()
+        print(f"[BATCH] {len(segments)} segment(s), {len(planned)} planned in one request")
+
+    results = []
+    for i, segment in enumerate(segments):
+        started = time.time()
+        batch = {'utterance': utterance, 'index': i, 'segments': len(segments)}
+        if token.cancelled:
+            print(f"[BATCH] {token.reason}: skipping {len(segments) - i} segment(s)")
+            break
+        if i in streams:
+            ok = execute_via_ai_plan(client, segment, language, plan=streams[i], batch=batch, cancel=token)
+            source = 'batch'
+        else:
+            ok = execute_via_ai_plan(client, segment, language, batch=batch, cancel=token, local_intent=matches[i])
+            source = 'intent' if i in local else 'single'
+        results.append({'segment': segment, 'ok': bool(ok), 'source': source,
+                        'ms': round((time.time() - started) * 1000, 1)})
+        print(f"[BATCH] {i + 1}/{len(segments)} '{segment}' -> {'ok' if ok else 'failed'}")
+    if any(r['ok'] for r in results) and not token.cancelled:
+        try:
+            speak('Done', language)
+        except Exception:
+            pass
+    return results
+
+
+# --- Macros ---
+# A macro is a named sequence of logged turns. Each step keeps the turn's plan and the targets its
+# OPEN steps resolved to, so a replay makes no LLM call (planning or normalization) at all.
+class MacroStore:
+    """Named macros, persisted to disk as JSON ({name: {'steps': [...], 'created': ts}})."""
+
+    def __init__(self, path):
+        self.path = path
+        self._macros = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name):
+        return normalize_command(name)
+
+    def _load(self):
+        self._macros = {}
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._macros = json.load(f).get('macros', {})
+        except Exception as e:
+            print(f"[MACRO] Could not load {self.path}: {e}")
+
+    def _save(self):
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'macros': self._macros}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[MACRO] Could not save {self.path}: {e}")
+
+    def get(self, name):
+        with self._lock:
+            if self._macros is None:
+                self._load()
+            return self._macros.get(self.key(name))
+
+    def names(self):
+        with self._lock:
+            if self._macros is None:
+                self._load()
+            return sorted(self._macros)
+
+    def put(self, name, steps):
+        macro = {'name': self.key(name), 'steps': steps, 'created': time.time()}
+        with self._lock:
+            if self._macros is None:
+                self._load()
+            self._macros[macro['name']] = macro
+            self._save()
+        return macro
+
+    def delete(self, name):
+        with self._lock:
+            if self._macros is None:
+                self._load()
+            if self._macros.pop(self.key(name), None) is None:
+                return False
+            self._save()
+            return True
+
+
+MACROS = MacroStore(MACROS_FILE)
+
+
+def load_action_log(path=None):
+    """Every entry of the action log, oldest first (unreadable lines are skipped)."""
+    entries = []
+    try:
+        with open(path or ACTION_LOG_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError as e:
+        print(f"[MACRO] Could not read action log: {e}")
+    return entries
+
+
+def macro_step_from_log(entry):
+    """Macro step for one logged turn, or None if the turn has no plan or was cancelled.
+    OPEN targets are pinned to what they resolved to when the turn ran.
+    """
+    plan_text = entry.get('plan')
+    if not plan_text or entry.get('status') == 'cancelled':
+        return None
+    raw = [parsed[1] for parsed in map(TargetPrefetcher.parse, plan_text.splitlines())
+           if parsed and parsed[0] == 'OPEN']
+    opened = [a['target'] for a in entry.get('actions', []) if a.get('action') == 'OPEN' and a.get('target')]
+    # Only pin when every OPEN was logged; otherwise the order cannot be matched up
+    targets = {t.lower(): r for t, r in zip(raw, opened)} if len(raw) == len(opened) else {}
+    timing = entry.get('timing') or {}
+    return {
+        'command': entry.get('user_command', ''),
+        'plan': plan_text,
+        'targets': targets,
+        'original': {
+            'timestamp': entry.get('timestamp'),
+            'total_ms': timing.get('total_ms'),
+            'plan_ms': timing.get('plan_ms'),
+            'llm_planned': 'intent' not in entry and not (entry.get('plan_cache') or {}).get('hit'),
+        },
+    }
+
+
+def save_macro_from_log(name, last=1, indices=None, log_path=None):
+    """Save logged turns as macro `name`: the `last` N replayable turns, or the log entries at
+    `indices` (0-based, negative from the end). Returns the macro, or None if nothing was found.
+    """
+    entries = load_action_log(log_path)
+    if indices is not None:
+        try:
+            chosen = [entries[i] for i in indices]
+        except IndexError:
+            print(f"[MACRO] No such action log entry (log has {len(entries)})")
+            return None
+    else:
+        chosen = [e for e in entries if macro_step_from_log(e) is not None][-max(1, last):]
+    steps = [step for step in map(macro_step_from_log, chosen) if step is not None]
+    if not steps:
+        return None
+    macro = MACROS.put(name, steps)
+    print(f"[MACRO] Saved '{macro['name']}': " + ' -> '.join(step['command'] for step in steps))
+    return macro
+
+
+def run_macro(name, language='en', cancel=None):
+    """Replay macro `name` through the executor with no LLM calls and no target re-resolution.
+    Returns a report with per-step and total latency next to the original (LLM-planned) runs,
+    or None if there is no such macro.
+    """
+    macro = MACROS.get(name)
+    if macro is None:
+        print(f"[MACRO] No macro named '{name}'")
+        return None
+    token = cancel or CancelToken(f"macro {macro['name']}")
+    if cancel is None:
+        with _ACTIVE_TOKENS_LOCK:
+            _ACTIVE_TOKENS.add(token)
+    llm_before = LLM_CALLS_STARTED
+    started = time.time()
+    results = []
+    try:
+        for i, step in enumerate(macro['steps']):
+            if token.cancelled:
+                break
+            step_started = time.time()
+            # client=None: nothing in a replay may fall back to the LLM
+            ok = execute_via_ai_plan(None, step['command'], language, plan=PlanLineStream.from_text(step['plan']),
+                                     batch={'macro': macro['name'], 'index': i, 'segments': len(macro['steps'])},
+                                     cancel=token, targets=step.get('targets'))
+            results.append({'command': step['command'], 'ok': bool(ok),
+                            'replay_ms': round((time.time() - step_started) * 1000, 1),
+                            'original_ms': step['original'].get('total_ms')})
+    finally:
+        if cancel is None:
+            with _ACTIVE_TOKENS_LOCK:
+                _ACTIVE_TOKENS.discard(token)
+    originals = [r['original_ms'] for r in results]
+    report = {
+        'macro': macro['name'],
+        'ok': bool(results) and all(r['ok'] for r in results) and not token.cancelled,
+        'steps': results,
+        'replay_ms': round((time.time() - started) * 1000, 1),
+        'original_ms': round(sum(originals), 1) if originals and None not in originals else None,
+        'llm_calls': LLM_CALLS_STARTED - llm_before,
+    }
+    original = f"{report['original_ms']:.0f} ms" if report['original_ms'] is not None else "not timed"
+    print(f"[MACRO] '{macro['name']}' replayed {len(results)} step(s) in {report['replay_ms']:.0f} ms "
+          f"(original: {original}), {report['llm_calls']} LLM call(s)")
+    if any(r['ok'] for r in results) and not token.cancelled:
+        try:
+            speak('Done', language)
+        except Exception:
+            pass
+    return report
+
+
+# --- Dry-run execution ---
+# Plans run against recording backends and a virtual clock: nothing touches the desktop and
+# every SLEEP / WAIT_FOR_PAGE / startup delay advances simulated time instantly, so large
+# plan corpora replay in milliseconds (see dry_run.py).
+DRY_RUN_BACKENDS = {
+    'launcher': ['open_path', 'switch_to_app', 'play_youtube', 'set_windows_alarm', 'browser_tab_action'],
+    'keyboard': ['type_text'],
+    'clipboard': ['set_clipboard_and_paste'],
+    'mouse': ['click_mouse', 'move_mouse'],
+    'ui': ['speak', 'set_floating_focus', 'detect_and_set_browser_context', 'confirmation_beep'],
+}
+# Return values the recorders give back where the executor branches on them
+DRY_RUN_RESULTS = {'play_youtube': 'playing', 'detect_and_set_browser_context': None}
+_DRY_RUN_LOCK = threading.Lock()
+_MISSING = object()
+
+
+class VirtualClock:
+    """Stand-in for op's `time` module: sleep() advances simulated time instead of blocking.
+    Worker threads that enter() the clock keep their own simulated "now", so concurrent waits
+    overlap; `elapsed` is the calling thread's offset and `horizon` the latest offset reached.
+    """
+    _time = time
+
+    def __init__(self, on_sleep=None):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shared = 0.0
+        self.start = self._time.time()
+        self.horizon = 0.0
+        self.on_sleep = on_sleep
+
+    @property
+    def elapsed(self):
+        return getattr(self._local, 'offset', self._shared)
+
+    def _set(self, offset):
+        if hasattr(self._local, 'offset'):
+            self._local.offset = offset
+        else:
+            self._shared = offset
+        self.horizon = max(self.horizon, offset)
+
+    def time(self):
+        return self.start + self.elapsed
+
+    def sleep(self, seconds):
+        seconds = max(0.0, float(seconds or 0))
+        if self.on_sleep:
+            self.on_sleep(seconds)
+        with self._lock:
+            self._set(self.elapsed + seconds)
+
+    def enter(self, at):
+        """Make the calling (worker) thread's simulated now `at` (a time() value)."""
+        self._local.offset = at - self.start
+
+    def advance_to(self, at):
+        """Move the calling thread's simulated now forward to `at`, e.g. after joining workers."""
+        with self._lock:
+            self._set(max(self.elapsed, at - self.start))
+
+    def __getattr__(self, name):
+        return getattr(self._time, name)
+
+
+class _RecordingModule:
+    """Proxy for a module whose listed functions are replaced by recorders."""
+
+    def __init__(self, module, overrides):
+        self._module = module
+        self._overrides = overrides
+
+    def __getattr__(self, name):
+        if name in self._overrides:
+            return self._overrides[name]
+        return getattr(self._module, name)
+
+
+def _plain(value):
+    return value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+
+
+class DryRun:
+    """Context manager that swaps op's desktop backends for recorders and `time` for a VirtualClock.
+    `timeline` lists every backend call and wait with its simulated time (ms since the start);
+    `log_entries` holds the action-log entries written meanwhile (the real log is untouched).
+    Only one dry run can be active at a time; not meant to run while Nova is serving commands.
+    """
+
+    def __init__(self, app_context=None, results=None, ready_after=None, startup_model=None):
+        self.app_context = app_context
+        # Learned startup latencies used (and updated) by the run; in-memory unless one is passed
+        self.startup_model = startup_model or StartupLatencyModel(None, STARTUP_WAIT_PERCENTILE, STARTUP_WAIT_MARGIN,
+                                                                  STARTUP_MIN_SAMPLES, STARTUP_MAX_SAMPLES)
+        # Simulated readiness: OPEN/SWITCH targets become ready this many seconds after the step
+        self.ready_after = ready_after
+        self.results = dict(DRY_RUN_RESULTS, **(results or {}))
+        self.timeline = []
+        self.log_entries = []
+        self.clock = VirtualClock(on_sleep=lambda seconds: self._record('wait', 'sleep', (seconds,), {}))
+        self._saved = {}
+        self._log_path = None
+        self._timeline_lock = threading.Lock()
+
+    def _record(self, kind, name, args, kwargs):
+        entry = {'t_ms': round(self.clock.elapsed * 1000, 1), 'kind': kind, 'call': name,
+                 'args': [_plain(a) for a in args]}
+        if kwargs:
+            entry['kwargs'] = {k: _plain(v) for k, v in kwargs.items()}
+        with self._timeline_lock:
+            self.timeline.append(entry)
+
+    def _simulated_probe(self, target, driver=None):
+        if self.ready_after is None:
+            return None
+        ready_at = self.clock.elapsed + self.ready_after
+        return lambda: self.clock.elapsed >= ready_at
+
+    def _recorder(self, kind, name):
+        def record(*args, **kwargs):
+            self._record(kind, name, args, kwargs)
+            return self.results.get(name, True)
+        return record
+
+    def __enter__(self):
+        _DRY_RUN_LOCK.acquire()
+        fd, self._log_path = tempfile.mkstemp(suffix='.jsonl', prefix='nova_dry_run_')
+        os.close(fd)
+        overrides = {name: self._recorder(kind, name) for kind, names in DRY_RUN_BACKENDS.items() for name in names}
+        overrides.update({
+            'time': self.clock,
+            'pyautogui': _RecordingModule(globals().get('pyautogui'), {
+                'press': self._recorder('keyboard', 'press'), 'hotkey': self._recorder('keyboard', 'hotkey'),
+                'click': self._recorder('mouse', 'click'), 'moveTo': self._recorder('mouse', 'moveTo'),
+            }),
+            'webbrowser': _RecordingModule(webbrowser, {'open': self._recorder('launcher', 'webbrowser.open')}),
+            'subprocess': _RecordingModule(subprocess, {'Popen': self._recorder('launcher', 'subprocess.Popen')}),
+            '_readiness_probe': self._simulated_probe,
+            'STARTUP_LATENCY': self.startup_model,
+            'system_control_enabled': lambda: True,
+            'HAS_PYAUTOGUI': True,
+            'HAS_SELENIUM': False,
+            'PLAN_CACHE_ENABLED': False,
+            'CURRENT_APP_CONTEXT': self.app_context,
+            'LAST_OPENED_TARGET': globals().get('LAST_OPENED_TARGET'),
+            'LISTEN_SUSPEND_UNTIL': LISTEN_SUSPEND_UNTIL,
+            'ACTION_LOG_FILE': self._log_path,
+        })
+        module = globals()
+        for name, value in overrides.items():
+            self._saved[name] = module.get(name, _MISSING)
+            module[name] = value
+        return self
+
+    def __exit__(self, *exc):
+        module = globals()
+        try:
+            for name, value in self._saved.items():
+                if value is _MISSING:
+                    module.pop(name, None)
+                else:
+                    module[name] = value
+            with open(self._log_path, 'r', encoding='utf-8') as f:
+                self.log_entries = [json.loads(line) for line in f if line.strip()]
+        except Exception as e:
+            print(f"[DRY RUN] Could not read dry-run log: {e}")
+        finally:
+            try:
+                os.remove(self._log_path)
+            except OSError:
+                pass
+            _DRY_RUN_LOCK.release()
+        return False
+
+
+def dry_run_plan(plan_text, user_command='', client=None, language='en', app_context=None, ready_after=None,
+                 startup_model=None):
+    """Execute `plan_text` in a DryRun. Returns ok, the timeline, simulated and wall-clock duration,
+    and the action-log entry the turn would have written. OPEN targets still resolve through
+    app_mappings.json (and the LLM normalizer only if `client` is given). `ready_after` simulates
+    targets becoming ready that many seconds after OPEN/SWITCH (None: waits are slept in full);
+    `startup_model` lets several dry runs share learned startup latencies.
+    """
+    wall_started = time.perf_counter()
+    with DryRun(app_context, ready_after=ready_after, startup_model=startup_model) as dry:
+        ok = execute_via_ai_plan(client, user_command or plan_text, language,
+                                 plan=PlanLineStream.from_text(plan_text))
+    return {
+        'ok': bool(ok),
+        'timeline': sorted(dry.timeline, key=lambda event: event['t_ms']),
+        'virtual_ms': round(dry.clock.horizon * 1000, 1),
+        'wall_ms': round((time.perf_counter() - wall_started) * 1000, 2),
+        'log': dry.log_entries[-1] if dry.log_entries else None,
+    }
 
 
 ### --- System control helpers ---
@@ -1554,21 +4747,30 @@ def confirm_and_execute(action_desc, func, language='en', *args, **kwargs):
         return False
 
 
+_APP_MAPPINGS_CACHE = {'mtime': None, 'map': {}}
+
+
+def load_app_mappings():
+    """Return app_mappings.json as a dict, re-reading it only when the file changes."""
+    try:
+        mtime = os.path.getmtime(APP_MAPPINGS_FILE)
+    except OSError:
+        return {}
+    if mtime != _APP_MAPPINGS_CACHE['mtime']:
+        try:
+            with open(APP_MAPPINGS_FILE, 'r', encoding='utf-8') as mf:
+                _APP_MAPPINGS_CACHE['map'] = json.load(mf)
+        except Exception as e:
+            print(f"[MAPPINGS ERROR] Could not read {APP_MAPPINGS_FILE}: {e}")
+            _APP_MAPPINGS_CACHE['map'] = {}
+        _APP_MAPPINGS_CACHE['mtime'] = mtime
+    return _APP_MAPPINGS_CACHE['map']
+
+
 def open_path(path):
     """Open a file or folder or URL using system default"""
     # Try to resolve common app names via app_mappings.json
-    try:
-        mappings_file = os.path.join(os.path.dirname(__file__), 'app_mappings.json')
-        if os.path.exists(mappings_file):
-            try:
-                with open(mappings_file, 'r', encoding='utf-8') as mf:
-                    app_map = json.load(mf)
-            except Exception:
-                app_map = {}
-        else:
-            app_map = {}
-    except Exception:
-        app_map = {}
+    app_map = load_app_mappings()
 
     global CURRENT_APP_CONTEXT, LAST_OPENED_TARGET
 
@@ -1735,21 +4937,13 @@ def open_notepad():
         subprocess.Popen(["powershell", "-Command", "Start-Process notepad.exe"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
 
-def switch_to_app(app_key):
+def switch_to_app(app_key, resolved_target=None):
     """Bring an application window to the foreground by app key or name (best-effort).
     Uses pygetwindow if available, otherwise falls back to alt-tab cycling or opens the app.
+    `resolved_target` skips the mapping lookup when the caller already resolved the app.
     """
     try:
-        mappings_file = os.path.join(os.path.dirname(__file__), 'app_mappings.json')
-        app_map = {}
-        if os.path.exists(mappings_file):
-            try:
-                with open(mappings_file, 'r', encoding='utf-8') as mf:
-                    app_map = json.load(mf)
-            except Exception:
-                app_map = {}
-
-        target = app_map.get(app_key.lower()) or app_key
+        target = resolved_target or load_app_mappings().get(app_key.lower()) or app_key
 
         # Try to find window with pygetwindow
         if HAS_PYGETWINDOW:
@@ -1797,7 +4991,8 @@ def switch_to_app(app_key):
                 pyautogui.keyDown('alt')
                 pyautogui.press('tab')
                 pyautogui.keyUp('alt')
-                time.sleep(0.2)
+                if not interruptible_sleep(0.2):
+                    return False
                 # If pygetwindow available, check active window title for a match
                 if HAS_PYGETWINDOW:
                     try:
@@ -1908,8 +5103,7 @@ def play_youtube(query: str) -> str:
                 url = url + sep + 'autoplay=1'
             webbrowser.open(url)
             # give browser a moment then attempt to ensure playback
-            if HAS_PYAUTOGUI:
-                time.sleep(0.4)
+            if HAS_PYAUTOGUI and interruptible_sleep(0.4):
                 try:
                     pyautogui.press('space')
                 except Exception:
@@ -1932,8 +5126,7 @@ def play_youtube(query: str) -> str:
                 watch_url = f"https://www.youtube.com/watch?v={vid}&autoplay=1"
                 webbrowser.open(watch_url)
                 # short delay then ensure playback keypress if available
-                if HAS_PYAUTOGUI:
-                    time.sleep(0.4)
+                if HAS_PYAUTOGUI and interruptible_sleep(0.4):
                     try:
                         pyautogui.press('space')
                     except Exception:
@@ -1953,6 +5146,18 @@ def play_youtube(query: str) -> str:
         return 'failed'
 
 
+def build_normalizer_prompt(raw_target, user_command=''):
+    """Prompt asking the AI to normalize an OPEN target to a single URL:/APP:/PATH: line."""
+    return (
+        "You are a concise normalizer. Given a brief open target and the user's original command, "
+        "return a single line identifying the concrete target in one of these formats:\n"
+        "URL:<url>\nAPP:<app_key>\nPATH:<path>\nIf you cannot determine, return NONE.\nExamples:\n"
+        "open instagram chats -> URL:https://www.instagram.com/direct/inbox/\n"
+        "open instagram -> URL:https://www.instagram.com/\nopen notepad -> APP:notepad\n"
+        f"Now, target: '{raw_target}'\nuser_command: '{user_command}'\n"
+    )
+
+
 def resolve_open_target(client, raw_target: str, user_command: str = '', language='en') -> Tuple[str, str]:
     """Resolve an OPEN target to a concrete URL, local app, or path.
     Returns: (kind, value) where kind in ('url','app','path','none').
@@ -1962,66 +5167,65 @@ def resolve_open_target(client, raw_target: str, user_command: str = '', languag
         return 'none', ''
     t = raw_target.strip().lower().strip('"\'')
     # Load mappings
-    mappings_file = os.path.join(os.path.dirname(__file__), 'app_mappings.json')
     try:
-        if os.path.exists(mappings_file):
-            with open(mappings_file, 'r', encoding='utf-8') as mf:
-                app_map = json.load(mf)
-                # If user_command mentions a sub-target (e.g., 'chats','inbox') prefer more specific mappings
-                uc = (user_command or '').lower()
-                if 'instagram' in t or 'instagram' in uc:
-                    if any(k in uc for k in ['chat', 'chats', 'inbox', 'message', 'messages', 'direct']):
-                        for key in ['instagram chats', 'instagram chat', 'instagram inbox', 'insta inbox']:
-                            if key in app_map:
-                                val = app_map[key]
-                                return 'url', val
-                if t in app_map:
-                    # If the user command references a more specific sub-target (inbox/messages/chats),
-                    # prefer a combined mapping like 'twitter messages' over the generic 'twitter'.
-                    uc = (user_command or '').lower()
-                    for suffix in [' messages', ' dms', ' dm', ' inbox', ' chats', ' chat']:
-                        combined = f"{t}{suffix}"
-                        if combined in app_map and any(k.strip() in uc for k in [suffix.strip()]):
-                            val = app_map[combined]
-                            if is_likely_url(val):
-                                return 'url', val
-                            elif os.path.exists(val) or val.lower().endswith('.exe') or ':' in val:
-                                return 'path', val
-                            else:
-                                return 'app', val
-                    # Otherwise return the generic mapping
-                    val = app_map[t]
-                    if is_likely_url(val):
-                        return 'url', val
-                    elif os.path.exists(val) or val.lower().endswith('.exe') or ':' in val:
-                        return 'path', val
-                    else:
-                        return 'app', val
-                # If no exact match, try substring keys (e.g., user said 'gmail inbox' or 'open gmail')
-                # Iterate keys in order of decreasing length so specific mappings win (e.g., 'twitter messages' before 'twitter')
-                for key in sorted(app_map.keys(), key=len, reverse=True):
-                    if key in t or key in uc:
-                        val = app_map[key]
-                        if is_likely_url(val):
+        app_map = load_app_mappings()
+        if app_map:
+            # If user_command mentions a sub-target (e.g., 'chats','inbox') prefer more specific mappings
+            uc = (user_command or '').lower()
+            if 'instagram' in t or 'instagram' in uc:
+                if any(k in uc for k in ['chat', 'chats', 'inbox', 'message', 'messages', 'direct']):
+                    for key in ['instagram chats', 'instagram chat', 'instagram inbox', 'insta inbox']:
+                        if key in app_map:
+                            val = app_map[key]
                             return 'url', val
-                        elif os.path.exists(val) or val.lower().endswith('.exe') or ':' in val:
-                            return 'path', val
-                        else:
-                            return 'app', val
-                # Fallback: try fuzzy match on keys
-                try:
-                    from difflib import get_close_matches
-                    candidates = get_close_matches(t, list(app_map.keys()), n=1, cutoff=0.7)
-                    if candidates:
-                        val = app_map[candidates[0]]
+            if t in app_map:
+                # If the user command references a more specific sub-target (inbox/messages/chats),
+                # prefer a combined mapping like 'twitter messages' over the generic 'twitter'.
+                uc = (user_command or '').lower()
+                for suffix in [' messages', ' dms', ' dm', ' inbox', ' chats', ' chat']:
+                    combined = f"{t}{suffix}"
+                    if combined in app_map and any(k.strip() in uc for k in [suffix.strip()]):
+                        val = app_map[combined]
                         if is_likely_url(val):
                             return 'url', val
                         elif os.path.exists(val) or val.lower().endswith('.exe') or ':' in val:
                             return 'path', val
                         else:
                             return 'app', val
-                except Exception:
-                    pass
+                # Otherwise return the generic mapping
+                val = app_map[t]
+                if is_likely_url(val):
+                    return 'url', val
+                elif os.path.exists(val) or val.lower().endswith('.exe') or ':' in val:
+                    return 'path', val
+                else:
+                    return 'app', val
+            # If no exact match, try substring keys (e.g., user said 'gmail inbox' or 'open gmail')
+            # Iterate keys in order of decreasing length so specific mappings win
+            # (e.g., 'twitter messages' before 'twitter')
+            for key in sorted(app_map.keys(), key=len, reverse=True):
+                if key in t or key in uc:
+                    val = app_map[key]
+                    if is_likely_url(val):
+                        return 'url', val
+                    elif os.path.exists(val) or val.lower().endswith('.exe') or ':' in val:
+                        return 'path', val
+                    else:
+                        return 'app', val
+            # Fallback: try fuzzy match on keys
+            try:
+                from difflib import get_close_matches
+                candidates = get_close_matches(t, list(app_map.keys()), n=1, cutoff=0.7)
+                if candidates:
+                    val = app_map[candidates[0]]
+                    if is_likely_url(val):
+                        return 'url', val
+                    elif os.path.exists(val) or val.lower().endswith('.exe') or ':' in val:
+                        return 'path', val
+                    else:
+                        return 'app', val
+            except Exception:
+                pass
     except Exception:
         pass
 
@@ -2031,12 +5235,10 @@ def resolve_open_target(client, raw_target: str, user_command: str = '', languag
 
     # If client available, ask AI to normalize target (single-line response: URL:<url> or APP:<app> or PATH:<path>)
     if client:
-        prompt = (
-            f"You are a concise normalizer. Given a brief open target and the user's original command, return a single line identifying the concrete target in one of these formats:\n"
-            f"URL:<url>\nAPP:<app_key>\nPATH:<path>\nIf you cannot determine, return NONE.\nExamples:\nopen instagram chats -> URL:https://www.instagram.com/direct/inbox/\nopen instagram -> URL:https://www.instagram.com/\nopen notepad -> APP:notepad\nNow, target: '{raw_target}'\nuser_command: '{user_command}'\n"
-        )
+        prompt = build_normalizer_prompt(raw_target, user_command)
         try:
-            resp = get_ai_response(client, [{"role": "user", "content": prompt}], language=language)
+            resp = get_ai_response(client, [{"role": "user", "content": prompt}], language=language,
+                                   call_site='resolve_target')
             if not resp:
                 return 'none', ''
             line = resp.strip().splitlines()[0].strip()
@@ -2265,17 +5467,24 @@ def is_likely_url(s: str) -> bool:
     return False
 
 
+def build_step_plan_prompt(app_key, action, query):
+    return (
+        f"You are an assistant that writes short, numbered step plans.\n"
+        f"Task: perform '{action}' for '{query}' in app '{app_key}'.\n"
+        "Return 3-6 short numbered steps "
+        "(like '1. Open Chrome', '2. Focus search box', '3. Type query and press Enter')."
+    )
+
+
 def plan_and_execute(client, app_key, action, query, language='en'):
     """Ask the AI to produce a short plan for the requested action, speak the plan, then execute a best-effort automation."""
     try:
         # Ask the AI to produce a concise ordered plan (numbered steps)
-        prompt = (
-            f"You are an assistant that writes short, numbered step plans.\n"
-            f"Task: perform '{action}' for '{query}' in app '{app_key}'.\n"
-            f"Return 3-6 short numbered steps (like '1. Open Chrome', '2. Focus search box', '3. Type query and press Enter')."
-        )
+        prompt = build_step_plan_prompt(app_key, action, query)
         messages = [{"role": "user", "content": prompt}]
-        plan_text = get_ai_response(client, messages, language, preprompt=CONTROL_PREPROMPT if system_control_enabled() else None)
+        plan_text = get_ai_response(client, messages, language,
+                                    preprompt=CONTROL_PREPROMPT if system_control_enabled() else None,
+                                    call_site='plan_and_execute')
         # Speak a one-line summary: what we'll do
         summary = plan_text.splitlines()[0] if plan_text else f"I'll try to {action} {query} in {app_key}."
         print(f"[PLAN]\n{plan_text}")
@@ -2296,14 +5505,7 @@ def perform_contextual_action(client, app_key, action, query, language='en'):
     global CURRENT_APP_CONTEXT, LAST_OPENED_TARGET
     try:
         # Load mappings to find exact targets
-        mappings_file = os.path.join(os.path.dirname(__file__), 'app_mappings.json')
-        app_map = {}
-        if os.path.exists(mappings_file):
-            try:
-                with open(mappings_file, 'r', encoding='utf-8') as mf:
-                    app_map = json.load(mf)
-            except Exception:
-                app_map = {}
+        app_map = load_app_mappings()
 
         target = app_map.get(app_key, LAST_OPENED_TARGET)
 
@@ -2380,7 +5582,8 @@ def perform_contextual_action(client, app_key, action, query, language='en'):
                     driver.get(url)
                     CURRENT_APP_CONTEXT = 'whatsapp'
                     # Wait for page to load and try to find the search box
-                    time.sleep(5)
+                    if not interruptible_sleep(5):
+                        return False
                     try:
                         # WhatsApp Web search box has aria-label 'Search or start new chat' or input with title
                         el = None
@@ -2404,7 +5607,8 @@ def perform_contextual_action(client, app_key, action, query, language='en'):
             # Fallback to open in browser and try pyautogui
             webbrowser.open(url)
             CURRENT_APP_CONTEXT = 'whatsapp'
-            time.sleep(5)
+            if not interruptible_sleep(5):
+                return False
             if HAS_PYAUTOGUI:
                 try:
                     pyautogui.hotkey('ctrl', 'f')
@@ -2433,6 +5637,7 @@ def perform_contextual_action(client, app_key, action, query, language='en'):
 
 def main():
     """Main conversation loop"""
+    global stop_speaking
     print("=" * 60)
     print("NOVA - AI Assistant")
     print("=" * 60)
@@ -2444,18 +5649,17 @@ def main():
     print("  'switch to hindi' - Change to Hindi")
     print("  'switch to english' - Change to English\n")
     
-    # Initialize
+    # Initialize: open and keep warm the shared LLM connection in the background
+    start_llm_warmup()
     client = create_nova()
-    conversation_history = []
+    # Bounded history: older turns are folded into a rolling summary after each reply is spoken
+    memory = ConversationMemory(client, MEMORY_FILE if SAVE_MEMORY else None)
 
     # Load persistent memory if enabled
     if SAVE_MEMORY and os.path.exists(MEMORY_FILE):
         try:
-            with open(MEMORY_FILE, 'r', encoding='utf-8') as f:
-                loaded = json.load(f)
-                if isinstance(loaded, list):
-                    conversation_history = loaded[-MEMORY_SIZE:]
-                    print(f"[MEMORY] Loaded {len(conversation_history)} messages from memory.")
+            if memory.load():
+                print(f"[MEMORY] Loaded {len(memory.messages())} messages from memory.")
         except Exception as e:
             print(f"[MEMORY ERROR] Failed to load memory: {e}")
     language = os.getenv('LANGUAGE', 'en')
@@ -2478,6 +5682,55 @@ def main():
         except Exception as e:
             print(f"[FLOATING ERROR] {e}")
 
+    def respond(user_input, language):
+        """Run one voice command on the command worker: system actions first, else a spoken AI reply."""
+        if system_control_enabled():
+            executed = any(r['ok'] for r in execute_batch(client, user_input, language))
+            if executed:
+                # Successfully executed via AI plan, skip conversational AI
+                return True
+
+        # If not system control or execution failed, fall back to conversational AI
+
+        # Add to conversation history
+        memory.add("user", user_input)
+
+        # Get AI response
+        response = get_ai_response(client, memory.messages(), language,
+                                   preprompt=CONTROL_PREPROMPT if system_control_enabled() else None,
+                                   call_site='conversation')
+
+        # If reasoning is disabled, remove short 'Reason:' lines from the response
+        if not ENABLE_REASONING_FLAG:
+            filtered_lines = []
+            for line in response.splitlines():
+                stripped = line.strip().lower()
+                # remove lines that start with 'reason' (case-insensitive)
+                if stripped.startswith('reason'):
+                    continue
+                # also remove lines that start with 'because' if they are just short reasoning
+                if stripped.startswith('because') and len(stripped.split()) < 20:
+                    continue
+                filtered_lines.append(line)
+            new_response = "\n".join(filtered_lines).strip()
+            if new_response:
+                response = new_response
+
+        # Add to history
+        memory.add("assistant", response)
+
+        # Speak response
+        speak_thread = threading.Thread(
+            target=speak,
+            args=(response, language, speech_rate, speech_volume),
+            daemon=True
+        )
+        speak_thread.start()
+        speak_thread.join(timeout=60)
+        # Summarize older turns and persist memory in the background
+        memory.compact_async()
+        return False
+
     while True:
         try:
             # If audio output (e.g., YouTube) just started, pause wake-word listening briefly
@@ -2518,6 +5771,9 @@ def main():
             
             if lower_input == 'stop':
                 stop_speaking = True
+                COMMAND_QUEUE.clear('stopped')
+                cancel_running_plans('stopped')
+                cancel_llm_requests()
                 print("[STOPPED]")
                 continue
             
@@ -2587,16 +5843,9 @@ def main():
                 if not conv_text:
                     continue
                 # send directly to AI for a conversational response
-                conversation_history.append({"role": "user", "content": conv_text})
-                response = get_ai_response(client, conversation_history, language, preprompt=None)
-                conversation_history.append({"role": "assistant", "content": response})
-                # Persist memory if enabled
-                if SAVE_MEMORY:
-                    try:
-                        with open(MEMORY_FILE, 'w', encoding='utf-8') as f:
-                            json.dump(conversation_history[-MEMORY_SIZE:], f, ensure_ascii=False, indent=2)
-                    except Exception as e:
-                        print(f"[MEMORY ERROR] Failed to save memory: {e}")
+                memory.add("user", conv_text)
+                response = get_ai_response(client, memory.messages(), language, preprompt=None, call_site='hey')
+                memory.add("assistant", response)
                 # Speak the conversational response
                 speak_thread = threading.Thread(
                     target=speak,
@@ -2605,67 +5854,14 @@ def main():
                 )
                 speak_thread.start()
                 speak_thread.join(timeout=60)
+                # Summarize older turns and persist memory in the background
+                memory.compact_async()
                 continue
 
-            if system_control_enabled():
-                executed = execute_via_ai_plan(client, user_input, language)
-                if executed:
-                    # Successfully executed via AI plan, skip conversational AI
-                    continue
-            
-            # If not system control or execution failed, fall back to conversational AI
-
-            # Add to conversation history
-            conversation_history.append({
-                "role": "user",
-                "content": user_input
-            })
-            
-            # Get AI response
-            response = get_ai_response(client, conversation_history, language, preprompt=CONTROL_PREPROMPT if system_control_enabled() else None)
-
-            # If reasoning is disabled, remove short 'Reason:' lines from the response
-            if not ENABLE_REASONING_FLAG:
-                filtered_lines = []
-                for line in response.splitlines():
-                    l = line.strip()
-                    # remove lines that start with 'reason' (case-insensitive)
-                    if l.lower().startswith('reason'):
-                        continue
-                    # also remove lines that start with 'because' if they are just short reasoning
-                    if l.lower().startswith('because') and len(l.split()) < 20:
-                        continue
-                    filtered_lines.append(line)
-                new_response = "\n".join(filtered_lines).strip()
-                if new_response:
-                    response = new_response
-            
-            # Add to history
-            conversation_history.append({
-                "role": "assistant",
-                "content": response
-            })
-            
-            # Keep conversation history short according to MEMORY_SIZE
-            if len(conversation_history) > MEMORY_SIZE:
-                conversation_history = conversation_history[-MEMORY_SIZE:]
-
-            # Persist memory if enabled
-            if SAVE_MEMORY:
-                try:
-                    with open(MEMORY_FILE, 'w', encoding='utf-8') as f:
-                        json.dump(conversation_history[-MEMORY_SIZE:], f, ensure_ascii=False, indent=2)
-                except Exception as e:
-                    print(f"[MEMORY ERROR] Failed to save memory: {e}")
-            
-            # Speak response
-            speak_thread = threading.Thread(
-                target=speak,
-                args=(response, language, speech_rate, speech_volume),
-                daemon=True
-            )
-            speak_thread.start()
-            speak_thread.join(timeout=60)
+            # Commands (and their conversational fallback) run on the command worker, so this loop
+            # keeps listening and a spoken 'stop' can cancel them
+            COMMAND_QUEUE.submit(user_input, client, supersede=PLAN_SUPERSEDE,
+                                 run=lambda cmd, text=user_input, lang=language: respond(text, lang))
         
         except KeyboardInterrupt:
             print("\n[STOPPED] Goodbye!")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Latency report for Nova's action log: p50/p95/p99 per action type, per target and per hour of day.
+
+Every action record in action_log.jsonl carries its start/end time and duration, and every turn
+its planning, target-resolution and execution time. This aggregates them so slow apps (long
+open-to-ready times) and slow LLM periods (planning time by hour) stand out.
+
+Per target, an OPEN/SWITCH counts together with the waits for that same target in its turn
+(startup sleeps, WAIT_FOR_PAGE), i.e. roughly how long the app took to become usable.
+
+Usage:
+    python perf_report.py
+    python perf_report.py --log path/to/action_log.jsonl --min-count 3 --top 15
+    python perf_report.py --json
+"""
+
+import argparse
+import datetime
+import json
+
+import op
+
+TURN_PHASES = ['plan_ms', 'resolve_ms', 'execute_ms', 'total_ms']
+
+
+def collect(entries):
+    """Duration samples (ms) grouped by action type, by target and (turn phases) by hour of day."""
+    by_action, by_target, by_hour = {}, {}, {}
+    for entry in entries:
+        per_target = {}
+        for action in entry.get('actions', []):
+            ms = action.get('duration_ms')
+            if ms is None:
+                continue
+            by_action.setdefault(action.get('action', '?'), []).append(ms)
+            target = action.get('target') or (action.get('app') if action.get('action') == 'SWITCH' else None)
+            if target:
+                per_target[target] = per_target.get(target, 0.0) + ms
+        for target, ms in per_target.items():
+            by_target.setdefault(target, []).append(ms)
+        timing = entry.get('timing') or {}
+        if entry.get('timestamp') and timing:
+            hour = datetime.datetime.fromtimestamp(entry['timestamp']).hour
+            phases = by_hour.setdefault(hour, {phase: [] for phase in TURN_PHASES})
+            for phase in TURN_PHASES:
+                if timing.get(phase) is not None:
+                    phases[phase].append(timing[phase])
+    return by_action, by_target, by_hour
+
+
+def summarize(values):
+    return {'count': len(values), 'p50': op._percentile(values, 50), 'p95': op._percentile(values, 95),
+            'p99': op._percentile(values, 99)}
+
+
+def build_report(entries, min_count=1, top=None):
+    by_action, by_target, by_hour = collect(entries)
+
+    def rows(groups):
+        out = [dict(summarize(values), key=key) for key, values in groups.items() if len(values) >= min_count]
+        return sorted(out, key=lambda r: r['p95'], reverse=True)
+
+    return {
+        'turns': len(entries),
+        'actions': rows(by_action),
+        'targets': rows(by_target)[:top] if top else rows(by_target),
+        'hours': [dict(hour=hour, **{phase: summarize(values) for phase, values in phases.items()})
+                  for hour, phases in sorted(by_hour.items())],
+    }
+
+
+def fmt(v):
+    return f"{v:9.0f}" if v is not None else "        -"
+
+
+def print_table(title, rows):
+    print(f"\n{title:<36}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    if not rows:
+        print("  (no timed records yet)")
+    for r in rows:
+        print(f"{str(r['key'])[:35]:<36}{r['count']:>7}{fmt(r['p50'])}{fmt(r['p95'])}{fmt(r['p99'])}")
+
+
+def print_report(report):
+    print(f"{report['turns']} turn(s) in the action log")
+    print_table('action', report['actions'])
+    print_table('target (open/switch + waits)', report['targets'])
+    print(f"\n{'hour':<6}{'turns':>6}" + ''.join(f"{phase[:-3] + ' p50/p95':>20}" for phase in TURN_PHASES))
+    if not report['hours']:
+        print("  (no timed turns yet)")
+    for row in report['hours']:
+        cells = ''.join(f"{fmt(row[p]['p50']).strip() + '/' + fmt(row[p]['p95']).strip():>20}" for p in TURN_PHASES)
+        print(f"{row['hour']:02d}:00{row['total_ms']['count']:>7}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-action, per-target and per-hour latency from Nova's action log")
+    parser.add_argument('--log', default=op.ACTION_LOG_FILE, help="action log to read (action_log.jsonl)")
+    parser.add_argument('--min-count', type=int, default=1, help="hide actions/targets with fewer samples")
+    parser.add_argument('--top', type=int, default=None, help="only show the N slowest targets")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = build_report(op.load_action_log(args.log), args.min_count, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
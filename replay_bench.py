@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Replay benchmark for Nova's executor, runnable offline (CI) against stub_llm_server.py.
+
+Replays the commands recorded in action_log.jsonl through execute_via_ai_plan. The planner
+(and OPEN-target normalizer) talk to a local stand-in server serving the recorded plans,
+and desktop side effects (opening apps, key presses, speech) are replaced by no-op recorders.
+Reports commands/sec, time-to-first-action and p50/p95/p99 turn latency.
+
+Usage:
+    python replay_bench.py
+    python replay_bench.py --log action_log.jsonl --first-token-ms 120 --token-delay-ms 15 --repeat 5
+    python replay_bench.py --base-url http://127.0.0.1:8765   # use an already running stand-in
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import op
+from groq import Groq
+from stub_llm_server import StubLLMServer, load_plans
+
+# op functions that touch the desktop; replaced by recorders while replaying
+DESKTOP_BACKENDS = [
+    'open_path', 'switch_to_app', 'set_windows_alarm', 'play_youtube', 'browser_tab_action',
+    'set_clipboard_and_paste', 'type_text', 'click_mouse', 'speak', 'set_floating_focus',
+    'detect_and_set_browser_context', 'confirmation_beep',
+]
+
+
+class ScaledTime:
+    """Stand-in for op's `time` module whose sleep() is scaled (0 = skip plan SLEEPs)."""
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def sleep(self, seconds):
+        if self.scale > 0 and seconds > 0:
+            time.sleep(seconds * self.scale)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class OfflineBackends:
+    """Context manager that swaps op's desktop backends for recorders and restores them on exit."""
+
+    def __init__(self, sleep_scale=0.0, plan_cache=False):
+        self.calls = []
+        self.sleep_scale = sleep_scale
+        self.plan_cache = plan_cache
+        self._saved = {}
+        self._saved_env = {}
+
+    def _recorder(self, name):
+        def record(*args, **kwargs):
+            self.calls.append((name, args))
+            return True
+        return record
+
+    def __enter__(self):
+        overrides = {name: self._recorder(name) for name in DESKTOP_BACKENDS}
+        overrides.update({
+            'HAS_PYAUTOGUI': False,
+            'time': ScaledTime(self.sleep_scale),
+            'PLAN_CACHE_ENABLED': self.plan_cache,
+            'LLM_CACHE_ENABLED': self.plan_cache,
+            'CURRENT_APP_CONTEXT': None,
+        })
+        for name, value in overrides.items():
+            self._saved[name] = getattr(op, name)
+            setattr(op, name, value)
+        for key, value in {'ENABLE_SYSTEM_CONTROL': 'true', 'UNATTENDED_CONTROL': 'true'}.items():
+            self._saved_env[key] = os.environ.get(key)
+            os.environ[key] = value
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self._saved.items():
+            setattr(op, name, value)
+        for key, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        return False
+
+
+def load_commands(log_path, limit=None):
+    commands = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('user_command'):
+                commands.append(entry['user_command'])
+    return commands[:limit] if limit else commands
+
+
+def run_replay(commands, base_url, repeat=1, sleep_scale=0.0, plan_cache=False):
+    """Replay `commands` through execute_via_ai_plan against the LLM server at `base_url`."""
+    client = Groq(api_key=os.getenv('GROQ_API_KEY') or 'offline', base_url=base_url)
+    turn_ms, ttfa_ms, failures = [], [], 0
+    fd, trace_log = tempfile.mkstemp(suffix='.jsonl', prefix='nova_replay_')
+    os.close(fd)
+    saved_log = op.ACTION_LOG_FILE
+    op.ACTION_LOG_FILE = trace_log
+    try:
+        with OfflineBackends(sleep_scale, plan_cache) as backends:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for command in commands:
+                    t0 = time.perf_counter()
+                    if not op.execute_via_ai_plan(client, command):
+                        failures += 1
+                    turn_ms.append((time.perf_counter() - t0) * 1000.0)
+            elapsed = time.perf_counter() - started
+        with open(trace_log, 'r', encoding='utf-8') as f:
+            for line in f:
+                first_action = json.loads(line).get('timing', {}).get('first_action_ms')
+                if first_action is not None:
+                    ttfa_ms.append(first_action)
+    finally:
+        op.ACTION_LOG_FILE = saved_log
+        os.remove(trace_log)
+
+    def summary(values):
+        return {'p50': op._percentile(values, 50), 'p95': op._percentile(values, 95), 'p99': op._percentile(values, 99)}
+
+    return {
+        'commands': len(turn_ms),
+        'failures': failures,
+        'elapsed_s': elapsed,
+        'commands_per_sec': (len(turn_ms) / elapsed) if elapsed else 0.0,
+        'turn_ms': summary(turn_ms),
+        'ttfa_ms': summary(ttfa_ms),
+        'backend_calls': len(backends.calls),
+    }
+
+
+def print_report(report):
+    def fmt(v):
+        return f"{v:8.1f}" if v is not None else "     n/a"
+
+    print(f"Replayed {report['commands']} command(s) in {report['elapsed_s']:.2f}s "
+          f"({report['commands_per_sec']:.1f} commands/sec, {report['failures']} failed)")
+    print(f"\n{'metric':<24}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for label, key in [('turn latency (ms)', 'turn_ms'), ('time to 1st action (ms)', 'ttfa_ms')]:
+        row = report[key]
+        print(f"{label:<24}{fmt(row['p50'])}{fmt(row['p95'])}{fmt(row['p99'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay action_log.jsonl commands through Nova's executor offline")
+    parser.add_argument('--log', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'action_log.jsonl'),
+                        help="action log to replay commands (and recorded plans) from")
+    parser.add_argument('--plans', default=None, help="scripted plans for the stand-in server (default: --log)")
+    parser.add_argument('--base-url', default=None, help="use a running stand-in/real endpoint instead of starting one")
+    parser.add_argument('--first-token-ms', type=float, default=0.0)
+    parser.add_argument('--token-delay-ms', type=float, default=0.0)
+    parser.add_argument('--repeat', type=int, default=1, help="replay the command list this many times")
+    parser.add_argument('--limit', type=int, default=None, help="only replay the first N commands")
+    parser.add_argument('--sleep-scale', type=float, default=0.0,
+                        help="scale for plan SLEEP/startup waits (0 = skip, 1 = real time)")
+    parser.add_argument('--plan-cache', action='store_true',
+                        help="allow the plan and response caches (default: every turn hits the server)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    commands = load_commands(args.log, args.limit)
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        plans, resolutions = load_plans(args.plans or args.log)
+        server = StubLLMServer(('127.0.0.1', 0), plans, resolutions, args.first_token_ms / 1000.0,
+                               args.token_delay_ms / 1000.0)
+        server.start()
+        base_url = server.base_url
+    try:
+        report = run_replay(commands, base_url, args.repeat, args.sleep_scale, args.plan_cache)
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Report of learned app startup latencies (launch-to-ready), slowest first.
+
+Nova measures how long each opened app or site takes to become ready (see READY_WAITS) and keeps
+a per-app histogram in startup_latency.json; waits after opening an app use a percentile of it.
+This prints that histogram. --rebuild re-learns it from the waits recorded in action_log.jsonl.
+
+Usage:
+    python startup_report.py
+    python startup_report.py --rebuild --log path/to/action_log.jsonl
+    python startup_report.py --json
+"""
+
+import argparse
+import json
+
+import op
+
+
+def samples_from_log(log_path):
+    """(target, seconds or None) for every readiness wait that followed an OPEN in the action log."""
+    samples = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            target = None
+            for action in entry.get('actions', []):
+                if action.get('action') == 'OPEN':
+                    target = action.get('target')
+                elif target and 'ready' in action:
+                    samples.append((target, action.get('waited') if action['ready'] else None))
+                    target = None
+                else:
+                    target = None
+    return samples
+
+
+def print_report(rows, percentile):
+    def fmt(v):
+        return f"{v:8.2f}" if v is not None else "       -"
+
+    if not rows:
+        print("No startup latencies recorded yet.")
+        return
+    print(f"{'app':<24}{'samples':>8}{'timeouts':>9}{'p50 s':>8}{'p90 s':>8}{'max s':>8}{'wait s':>8}")
+    for r in rows:
+        print(f"{r['app'][:23]:<24}{r['samples']:>8}{r['timeouts']:>9}{fmt(r['p50'])}{fmt(r['p90'])}"
+              f"{fmt(r['max'])}{fmt(r['wait'])}")
+    print(f"\nwait = p{percentile:g} x {op.STARTUP_WAIT_MARGIN:g} once an app has {op.STARTUP_MIN_SAMPLES}+ samples")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show per-app startup latency learned by Nova")
+    parser.add_argument('--file', default=op.STARTUP_LATENCY_FILE, help="startup latency file (startup_latency.json)")
+    parser.add_argument('--rebuild', action='store_true', help="re-learn the histogram from the action log")
+    parser.add_argument('--log', default=op.ACTION_LOG_FILE, help="action log used by --rebuild")
+    parser.add_argument('--json', action='store_true', help="print the rows as JSON")
+    args = parser.parse_args()
+
+    model = op.StartupLatencyModel(args.file, op.STARTUP_WAIT_PERCENTILE, op.STARTUP_WAIT_MARGIN,
+                                   op.STARTUP_MIN_SAMPLES, op.STARTUP_MAX_SAMPLES)
+    if args.rebuild:
+        model = op.StartupLatencyModel(None, op.STARTUP_WAIT_PERCENTILE, op.STARTUP_WAIT_MARGIN,
+                                       op.STARTUP_MIN_SAMPLES, op.STARTUP_MAX_SAMPLES)
+        samples = samples_from_log(args.log)
+        for target, seconds in samples:
+            model.record(target, seconds)
+        model.path = args.file
+        model.save()
+        print(f"Learned {len(samples)} sample(s) from {args.log} into {args.file}\n")
+    rows = model.report()
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_report(rows, model.percentile)
+
+
+if __name__ == '__main__':
+    main()
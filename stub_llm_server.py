@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Groq chat-completions API, for offline executor benchmarks and CI.
+
+Speaks the OpenAI-compatible protocol Nova uses (streamed SSE chunks or a single JSON body)
+and answers from scripted or recorded plans, with configurable first-token and per-token
+latency. No API key or network access is needed.
+
+Plans are looked up by the (normalized) last user message:
+  - a `.jsonl` action log: each entry's `user_command` -> recorded `plan`
+  - a `.json` file: {"plans": {command: plan}, "resolutions": {target: "URL:..."}} or a flat {command: plan}
+OPEN-target normalizer requests are answered from `resolutions` (default `NONE`).
+Embedding code can pass `responder(messages) -> str | None` to script replies dynamically.
+Tail-latency scenarios: per-model first-token delays (`--slow-model`) and 429 responses with
+Retry-After for the first N requests (`--rate-limit-first`).
+
+Usage:
+    python stub_llm_server.py --plans action_log.jsonl --port 8765 --token-delay-ms 15
+    set GROQ_BASE_URL=http://127.0.0.1:8765
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = 'ACTION: SLEEP 0'
+
+
+def normalize(text):
+    s = re.sub(r"\s+", " ", (text or '').lower()).strip()
+    return s.rstrip('.!?, ')
+
+
+def load_plans(path):
+    """Return (plans, resolutions) dicts keyed by normalized command / target."""
+    plans, resolutions = {}, {}
+    if not path:
+        return plans, resolutions
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('user_command') and entry.get('plan'):
+                    plans[normalize(entry['user_command'])] = entry['plan']
+        else:
+            data = json.load(f)
+            plans = {normalize(k): v for k, v in data.get('plans', data).items() if isinstance(v, str)}
+            resolutions = {normalize(k): v for k, v in data.get('resolutions', {}).items()}
+    return plans, resolutions
+
+
+def split_tokens(text):
+    """Split a reply into word-sized pieces, roughly how the real API streams it."""
+    return re.findall(r"\S+\s*|\s+", text) or ['']
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, plans=None, resolutions=None, first_token_delay=0.0, token_delay=0.0,
+                 default_reply=DEFAULT_REPLY, model='stub-model', responder=None, model_delays=None,
+                 rate_limit_first=0, retry_after=1.0, model_errors=None):
+        super().__init__(address, StubLLMHandler)
+        self.responder = responder
+        self.model_delays = model_delays or {}
+        # model -> HTTP status every request for that model is answered with (e.g. 400, 401)
+        self.model_errors = model_errors or {}
+        self.requested_models = []
+        self.rate_limit_first = rate_limit_first
+        self.retry_after = retry_after
+        self.rate_limited = 0
+        self.plans = plans or {}
+        self.resolutions = resolutions or {}
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.default_reply = default_reply
+        self.model = model
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply_for(self, messages):
+        if self.responder is not None:
+            reply = self.responder(messages)
+            if reply is not None:
+                return reply
+        user = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        if user.startswith('You are a concise normalizer'):
+            m = re.search(r"target: '(.*?)'", user)
+            return self.resolutions.get(normalize(m.group(1) if m else ''), 'NONE')
+        return self.plans.get(normalize(user), self.default_reply)
+
+    def start(self):
+        """Serve in a daemon thread; returns the thread."""
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        raw = data.encode('utf-8')
+        self.wfile.write(f"{len(raw):x}\r\n".encode('ascii') + raw + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': self.server.model, 'object': 'model'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'invalid JSON'}})
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        server = self.server
+        model = body.get('model') or server.model
+        with server._lock:
+            server.requested_models.append(model)
+            throttle = server.rate_limited < server.rate_limit_first
+            if throttle:
+                server.rate_limited += 1
+            else:
+                server.requests_served += 1
+        if throttle:
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'tokens',
+                                            'code': 'rate_limit_exceeded'}},
+                            {'Retry-After': f"{server.retry_after:g}"})
+            return
+        if model in server.model_errors:
+            self._send_json(server.model_errors[model], {'error': {'message': f'Stub error for {model}',
+                                                                   'type': 'invalid_request_error'}})
+            return
+        messages = body.get('messages') or []
+        reply = server.reply_for(messages)
+        first_token_delay = server.model_delays.get(model, server.first_token_delay)
+        created = int(time.time())
+        usage = {
+            'prompt_tokens': sum(max(1, len(str(m.get('content', ''))) // 4) for m in messages),
+            'completion_tokens': max(1, len(reply) // 4),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        if not body.get('stream'):
+            time.sleep(first_token_delay + server.token_delay * len(split_tokens(reply)))
+            self._send_json(200, {
+                'id': f'stub-{created}', 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def event(delta, finish_reason=None, extra=None):
+            chunk = {
+                'id': f'stub-{created}', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+            if extra:
+                chunk.update(extra)
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+
+        try:
+            time.sleep(first_token_delay)
+            event({'role': 'assistant', 'content': ''})
+            for i, piece in enumerate(split_tokens(reply)):
+                if i and server.token_delay:
+                    time.sleep(server.token_delay)
+                event({'content': piece})
+            event({}, 'stop', {'x_groq': {'id': f'stub-{created}', 'usage': usage}})
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream mid-flight
+            self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible stand-in for the Groq API")
+    parser.add_argument('--plans', default=None, help="action_log.jsonl or a JSON file of scripted plans")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--first-token-ms', type=float, default=0.0, help="delay before the first streamed token")
+    parser.add_argument('--token-delay-ms', type=float, default=0.0, help="delay between streamed tokens")
+    parser.add_argument('--default-reply', default=DEFAULT_REPLY, help="reply for commands without a plan")
+    parser.add_argument('--slow-model', action='append', default=[], metavar='MODEL=MS',
+                        help="first-token delay for one model (repeatable), e.g. to exercise hedging")
+    parser.add_argument('--rate-limit-first', type=int, default=0, help="answer the first N requests with 429")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    plans, resolutions = load_plans(args.plans)
+    model_delays = {}
+    for item in args.slow_model:
+        name, _, ms = item.partition('=')
+        model_delays[name] = float(ms or 0) / 1000.0
+    server = StubLLMServer((args.host, args.port), plans, resolutions, args.first_token_ms / 1000.0,
+                           args.token_delay_ms / 1000.0, args.default_reply, model_delays=model_delays,
+                           rate_limit_first=args.rate_limit_first, retry_after=args.retry_after)
+    print(f"[STUB LLM] Serving {len(plans)} plan(s) on {server.base_url}")
+    print(f"[STUB LLM] Point Nova at it with GROQ_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,7 @@
+import json
+import re
+import tempfile
+import time
 import unittest
 from unittest import mock
 import webbrowser
@@ -5,6 +9,32 @@ import requests
 
 import op
 
+# Patches applied for the whole module, so no test reads or writes state in the working tree
+_MODULE_PATCHES = []
+_SANDBOX = None
+
+
+def setUpModule():
+    global _SANDBOX
+    _SANDBOX = tempfile.TemporaryDirectory()
+    _MODULE_PATCHES.extend([
+        # Plans must come from each test's mocked planner, never from plan_cache.json of an earlier run
+        mock.patch('op.PLAN_CACHE_ENABLED', False),
+        # Plan runs and LLM calls log to a scratch dir instead of the tracked action_log.jsonl / llm_trace.jsonl
+        mock.patch('op.ACTION_LOG_FILE', op.os.path.join(_SANDBOX.name, 'action_log.jsonl')),
+        mock.patch('op.LLM_TRACE_FILE', op.os.path.join(_SANDBOX.name, 'llm_trace.jsonl')),
+    ])
+    for patch in _MODULE_PATCHES:
+        patch.start()
+
+
+def tearDownModule():
+    for patch in reversed(_MODULE_PATCHES):
+        patch.stop()
+    _MODULE_PATCHES.clear()
+    _SANDBOX.cleanup()
+
+
 class TestCore(unittest.TestCase):
     def test_resolve_instagram_inbox_mapping(self):
         kind, val = op.resolve_open_target(None, 'instagram', 'open my instagram chats')
@@ -350,5 +380,983 @@ class TestCore(unittest.TestCase):
                 # after() should be called to schedule bringing the window forward
                 fake_root.after.assert_called()
 
+    @mock.patch.dict('os.environ', {'GROQ_API_KEY': 'test-key'})
+    def test_create_nova_returns_shared_client(self):
+        with mock.patch('op._SHARED_CLIENT', None):
+            first = op.create_nova()
+            second = op.create_nova()
+            self.assertIs(first, second)
+
+    def test_get_ai_response_records_ttft(self):
+        class Delta:
+            def __init__(self, content):
+                self.content = content
+
+        class Choice:
+            def __init__(self, content):
+                self.delta = Delta(content)
+
+        class Chunk:
+            def __init__(self, content):
+                self.choices = [Choice(content)]
+
+        class FakeClient:
+            class chat:
+                class completions:
+                    @staticmethod
+                    def create(**kwargs):
+                        return iter([Chunk('hel'), Chunk('lo')])
+
+        before = op.get_llm_stats()['requests']
+        res = op.get_ai_response(FakeClient(), [{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(res, 'hello')
+        stats = op.get_llm_stats()
+        self.assertEqual(stats['requests'], before + 1)
+        self.assertIsNotNone(stats['ttft_last_ms'])
+
+    def test_plan_cache_skips_llm_on_repeat_command(self):
+        import os
+        import tempfile
+        cache_path = os.path.join(tempfile.mkdtemp(), 'plan_cache.json')
+        cache = op.PlanCache(cache_path)
+        with mock.patch('op.PLAN_CACHE', cache), mock.patch('op.PLAN_CACHE_ENABLED', True):
+            with mock.patch('op.get_ai_response', return_value='ACTION: SLEEP 0') as mock_ai:
+                self.assertTrue(op.execute_via_ai_plan(None, 'Do a short sleep'))
+                self.assertTrue(op.execute_via_ai_plan(None, 'do a  short sleep!'))
+                self.assertEqual(mock_ai.call_count, 1)
+        self.assertEqual(cache.hits, 1)
+        # Persisted across restarts
+        reloaded = op.PlanCache(cache_path)
+        key = op.PlanCache.make_key('do a short sleep', op.CURRENT_APP_CONTEXT, 'en')
+        self.assertEqual(reloaded.get(key, cache._fingerprint), 'ACTION: SLEEP 0')
+
+    def test_plan_cache_invalidates_on_fingerprint_change(self):
+        import os
+        import tempfile
+        cache = op.PlanCache(os.path.join(tempfile.mkdtemp(), 'plan_cache.json'))
+        cache.put('k', 'fp1', 'ACTION: SLEEP 1')
+        self.assertEqual(cache.get('k', 'fp1'), 'ACTION: SLEEP 1')
+        self.assertIsNone(cache.get('k', 'fp2'))
+
+    def test_local_intent_grammar_matches_common_commands(self):
+        cases = {
+            'open notepad': 'ACTION: OPEN notepad\nACTION: SLEEP 1',
+            'switch to chrome': 'ACTION: SWITCH chrome',
+            'volume up': 'ACTION: PRESS volumeup',
+            'next tab': 'ACTION: NEXT_TAB',
+            'pause music': 'ACTION: PRESS space',
+            'set alarm for 7 pm': 'ACTION: SET_ALARM 7 pm',
+        }
+        for command, plan in cases.items():
+            intent, match = op.match_local_intent(command)
+            self.assertIsNotNone(intent, command)
+            self.assertEqual(op.render_intent_plan(intent, match), plan)
+        for command in ['open instagram and search for reel', 'play song', 'switch to hindi']:
+            intent, _ = op.match_local_intent(command)
+            self.assertIsNone(intent, command)
+
+    @mock.patch('op.pyautogui', create=True)
+    def test_local_intent_bypasses_llm(self, mock_pyautogui):
+        with mock.patch('op.HAS_PYAUTOGUI', True):
+            with mock.patch('op.get_ai_response') as mock_ai:
+                res = op.execute_via_ai_plan(None, 'volume up')
+                self.assertTrue(res)
+                mock_ai.assert_not_called()
+        mock_pyautogui.press.assert_called_with('volumeup')
+        self.assertGreaterEqual(op.get_intent_stats()['intents']['volume_up']['hits'], 1)
+
+    def test_streamed_plan_executes_first_action_before_stream_ends(self):
+        import threading
+        first_action_done = threading.Event()
+        seen_before_end = []
+
+        def fake_stream(client, messages, language='en', preprompt=None, on_token=None, **kwargs):
+            on_token('ACTION: SLE')
+            on_token('EP 0\nACTION: ')
+            # The first SLEEP must run while the rest of the plan is still being generated
+            seen_before_end.append(first_action_done.wait(timeout=2))
+            on_token('SLEEP 0\n')
+            return 'ACTION: SLEEP 0\nACTION: SLEEP 0\n'
+
+        with mock.patch('op.time.sleep', side_effect=lambda s: first_action_done.set()) as mock_sleep:
+            with mock.patch('op.get_ai_response', side_effect=fake_stream):
+                res = op.execute_via_ai_plan(None, 'sleep twice please')
+        self.assertTrue(res)
+        self.assertEqual(seen_before_end, [True])
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_plan_line_stream_peek_and_close(self):
+        stream = op.PlanLineStream()
+        stream.feed('ACTION: OPEN spotify\nACTION: PRE')
+        self.assertEqual(stream.next(), 'ACTION: OPEN spotify')
+        stream.close()
+        self.assertEqual(stream.peek(), 'ACTION: PRE')
+        self.assertEqual(stream.next(), 'ACTION: PRE')
+        self.assertIsNone(stream.next())
+        self.assertEqual(op.PlanLineStream.from_text('a\n\nb').text(), 'a\n\nb')
+
+    def test_planner_prompt_trimmed_to_budget(self):
+        sections = [(0, 'core ' * 40), (1, 'rules ' * 40), (2, 'examples ' * 40)]
+        full = op.build_planner_prompt(None, sections)
+        self.assertIn('examples', full)
+        trimmed = op.build_planner_prompt(op.estimate_tokens(full) - 1, sections)
+        self.assertNotIn('examples', trimmed)
+        self.assertIn('rules', trimmed)
+        # The core section is always kept
+        self.assertIn('core', op.build_planner_prompt(1, sections))
+
+    def test_planner_logs_prompt_version_and_tokens(self):
+        calls = []
+
+        def fake_planner(client, messages, language='en', preprompt=None, usage=None, **kwargs):
+            calls.append((preprompt, kwargs.get('persona')))
+            usage.update({'prompt': 120, 'completion': 6, 'estimated': False})
+            return 'ACTION: SLEEP 0'
+
+        written = []
+        with mock.patch('op.get_ai_response', side_effect=fake_planner):
+            with mock.patch('builtins.open', mock.mock_open()) as mock_file:
+                self.assertTrue(op.execute_via_ai_plan(None, 'nap for zero seconds'))
+                written = [c[0][0] for c in mock_file().write.call_args_list]
+        self.assertEqual(calls, [(op.PLANNER_PROMPT, False)])
+        entry = json.loads(written[-1])
+        self.assertEqual(entry['prompt_version'], op.PLANNER_PROMPT_VERSION)
+        self.assertEqual(entry['tokens'], {'prompt': 120, 'completion': 6, 'estimated': False})
+
+    @mock.patch('op.open_path')
+    def test_open_targets_are_resolved_concurrently(self, mock_open_path):
+        import threading
+        barrier = threading.Barrier(2, timeout=2)
+        resolved = []
+
+        def slow_resolve(client, target, user_command='', language='en'):
+            # Both resolutions must be in flight at the same time to pass the barrier
+            barrier.wait()
+            resolved.append(target)
+            return 'app', target + '-resolved'
+
+        plan = 'ACTION: OPEN alpha\nACTION: SLEEP 0\nACTION: OPEN beta'
+        with mock.patch('op.get_ai_response', return_value=plan):
+            with mock.patch('op.resolve_open_target', side_effect=slow_resolve):
+                self.assertTrue(op.execute_via_ai_plan(None, 'open alpha then beta'))
+        self.assertEqual(sorted(resolved), ['alpha', 'beta'])
+        opened = [c[0][0] for c in mock_open_path.call_args_list]
+        self.assertEqual(opened, ['alpha-resolved', 'beta-resolved'])
+
+    def test_plan_steps_compiled_and_validated_up_front(self):
+        stream = op.PlanLineStream.from_text('ACTION: press Ctrl+C\nReason: copy\nACTION: PRESS return\n'
+                                             'ACTION: SLEEP soon\nACTION: FLY away')
+        hotkey = stream.next_step()
+        self.assertEqual((hotkey.action, hotkey.args), ('PRESS', ('hotkey', ('ctrl', 'c'), 'ctrl+c')))
+        self.assertIsNone(stream.next_step().action)
+        self.assertEqual(stream.peek_step().args, ('press', 'enter', 'return'))
+        stream.next_step()
+        self.assertTrue(stream.next_step().error)
+        self.assertEqual(stream.next_step().error, 'unknown action')
+        self.assertIsNone(stream.next_step())
+
+    @mock.patch('op.speak')
+    def test_registered_action_dispatched_and_invalid_steps_skipped(self, mock_speak):
+        seen = []
+        # A slow handler: its own time is not dispatch overhead
+        op.register_action('NOTE')(lambda run, step: (seen.append(step.args), op._REAL_SLEEP(0.1),
+                                                      run.done({'action': 'NOTE'})))
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = op.os.path.join(tmp, 'log.jsonl')
+            try:
+                with mock.patch('op.get_ai_response', return_value='ACTION: NOTE hello\nACTION: SLEEP -1'), \
+                        mock.patch('op.time.sleep') as mock_sleep, mock.patch('op.ACTION_LOG_FILE', log_path):
+                    self.assertTrue(op.execute_via_ai_plan(None, 'take a note'))
+            finally:
+                op.ACTION_REGISTRY.pop('NOTE', None)
+            with open(log_path, encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f]
+        self.assertEqual(seen, ['hello'])
+        mock_sleep.assert_not_called()
+        self.assertEqual(entries[-1]['actions'][-1]['result'], 'invalid')
+        self.assertEqual(entries[-1]['timing']['steps'], 2)
+        self.assertLess(entries[-1]['timing']['dispatch_us'], 50000)
+
+    def test_dry_run_records_timeline_on_virtual_clock(self):
+        plan = 'ACTION: OPEN https://example.org\nACTION: WAIT_FOR_PAGE\nACTION: TYPE hi\nACTION: PRESS enter'
+        with mock.patch('time.sleep') as real_sleep, mock.patch('op.open_path') as real_open:
+            started = time.perf_counter()
+            result = op.dry_run_plan(plan, 'say hi on example')
+            elapsed = time.perf_counter() - started
+        self.assertTrue(result['ok'])
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(result['virtual_ms'], 3000.0)
+        real_sleep.assert_not_called()
+        real_open.assert_not_called()
+        calls = [(e['t_ms'], e['call'], e['args']) for e in result['timeline'] if e['kind'] != 'ui']
+        self.assertEqual(calls, [(0.0, 'webbrowser.open', ['https://example.org']), (0.0, 'sleep', [3.0]),
+                                 (3000.0, 'set_clipboard_and_paste', ['hi']), (3000.0, 'press', ['enter'])])
+        self.assertEqual(result['log']['user_command'], 'say hi on example')
+        # Backends and the clock are restored afterwards
+        self.assertIs(op.time, time)
+        self.assertIs(op.webbrowser, webbrowser)
+
+    def test_readiness_wait_ends_sleep_once_target_is_ready(self):
+        plan = 'ACTION: OPEN spotify\nACTION: SLEEP 3\nACTION: TYPE hi\nACTION: SLEEP 0.5\nACTION: PRESS enter'
+        with mock.patch('op.READY_SETTLE_SECONDS', 0.1):
+            full = op.dry_run_plan(plan, 'open spotify and type hi')
+            fast = op.dry_run_plan(plan, 'open spotify and type hi', ready_after=0.4)
+        self.assertEqual(full['virtual_ms'], 3500.0)
+        # The planner's SLEEP 3 is only an upper bound; the SLEEP after TYPE is still honoured
+        self.assertAlmostEqual(fast['virtual_ms'], 400 + 100 + 500, delta=60)
+        sleeps = [a for a in fast['log']['actions'] if a['action'] == 'SLEEP']
+        self.assertTrue(sleeps[0]['ready'])
+        self.assertNotIn('waited', sleeps[1])
+
+    def test_startup_latency_model_percentile_and_persistence(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = op.os.path.join(tmp, 'startup.json')
+            model = op.StartupLatencyModel(path, percentile=90, margin=1.0, min_samples=3)
+            model.record('C:\\Apps\\Slow.exe', 2.0)
+            model.record('slow.exe', 4.0)
+            self.assertIsNone(model.wait_for('slow'))
+            for seconds in (1.0, 3.0, 5.0):
+                model.record('slow.exe', seconds)
+            model.record('slow.exe', None)
+            model.record('https://app.fast.com', 0.2)
+            reloaded = op.StartupLatencyModel(path, percentile=90, margin=1.0, min_samples=3)
+            self.assertEqual(reloaded.wait_for('SLOW.EXE'), 5.0)
+            rows = reloaded.report()
+            self.assertEqual([r['app'] for r in rows], ['slow', 'fast'])
+            self.assertEqual((rows[0]['samples'], rows[0]['timeouts'], rows[0]['p50']), (5, 1, 3.0))
+
+    def test_startup_latency_timed_from_dispatch_and_timeouts_censored(self):
+        model = op.StartupLatencyModel(None, percentile=90, margin=1.0, min_samples=3)
+        run = mock.Mock(ready=('https://app.slack.com/client', lambda: True, time.time() - 1.0))
+        with mock.patch('op.STARTUP_LATENCY', model), mock.patch('op.READY_SETTLE_SECONDS', 0):
+            entry = op._wait_step(run, 3, {'action': 'SLEEP'})
+        self.assertTrue(entry['ready'])
+        self.assertIsNone(run.ready)
+        # The second the launch took before the wait started counts, under the app's mapping name
+        self.assertGreaterEqual(model.report()[0]['p50'], 1.0)
+        self.assertEqual(model.report()[0]['app'], 'slack')
+        for seconds in (2.0, 2.0):
+            model.record('slack', seconds)
+        before = model.wait_for('slack')
+        # A wait cut short by a timeout says the app took at least that long: never a shorter wait
+        model.record('slack', 0.5, timed_out=True)
+        self.assertGreaterEqual(model.wait_for('slack'), before)
+        self.assertEqual(model.report()[0]['timeouts'], 1)
+
+    def test_learned_startup_latency_replaces_planned_sleep(self):
+        model = op.StartupLatencyModel(None, percentile=90, margin=1.25, min_samples=3)
+        plan = 'ACTION: OPEN spotify\nACTION: SLEEP 3\nACTION: PRESS enter'
+        with mock.patch('op.READY_SETTLE_SECONDS', 0):
+            for _ in range(3):
+                op.dry_run_plan(plan, 'open spotify', ready_after=0.4, startup_model=model)
+            # No readiness signal this time: the learned p90 x margin is slept instead of SLEEP 3
+            result = op.dry_run_plan(plan, 'open spotify', startup_model=model)
+        self.assertAlmostEqual(result['virtual_ms'], 500.0, delta=80)
+        self.assertIn('learned_wait', result['log']['actions'][1])
+
+    def test_window_hint_uses_mapping_name_or_registrable_domain(self):
+        mappings = op.load_app_mappings()
+        self.assertEqual(mappings['slack'], 'https://app.slack.com/client')
+        self.assertEqual(op._window_hint(mappings['slack']), 'slack')
+        self.assertEqual(op._window_hint(mappings['whatsapp']), 'whatsapp')
+        self.assertEqual(op._window_hint(mappings['spotify']), 'spotify')
+        self.assertEqual(op._window_hint(mappings['gmail']), 'gmail')
+        # Not in app_mappings.json: the registrable domain, not the subdomain
+        self.assertEqual(op._window_hint('https://open.spotify.com/track/1'), 'spotify')
+        self.assertEqual(op._window_hint('https://news.bbc.co.uk/'), 'bbc')
+        self.assertEqual(op._window_hint('zoommtg:'), 'zoommtg')
+
+    def test_window_readiness_probe(self):
+        self.assertEqual(op._window_hint('https://www.youtube.com/watch?v=1'), 'youtube')
+        self.assertEqual(op._window_hint('C:\\Program Files\\Spotify\\Spotify.exe'), 'Spotify')
+        titles = [['Untitled - Notepad']]
+        fake_gw = mock.Mock(getAllTitles=lambda: titles[0], getActiveWindow=lambda: None)
+        with mock.patch('op.gw', fake_gw, create=True), mock.patch('op.HAS_PYGETWINDOW', True):
+            probe = op._readiness_probe('notepad.exe')
+            self.assertFalse(probe())
+            titles[0] = ['Untitled - Notepad', 'notes.txt - Notepad']
+            self.assertTrue(probe())
+
+    def test_plan_optimizer_merges_and_prunes_redundant_steps(self):
+        plan = ('ACTION: OPEN notepad\nACTION: SLEEP 1\nACTION: SLEEP 0.5\nACTION: OPEN notepad\n'
+                'ACTION: SWITCH Notepad\nACTION: TYPE hi\nACTION: OPEN https://example.org\n'
+                'ACTION: WAIT_FOR_PAGE\nACTION: SLEEP 2')
+        with mock.patch('op.DEFAULT_OPEN_SLEEP', 1.0):
+            result = op.dry_run_plan(plan, 'notes then example')
+        optimized = result['log']['optimizer']
+        self.assertEqual(optimized['after'], ['ACTION: OPEN notepad', 'ACTION: SLEEP 1.5', 'ACTION: TYPE hi',
+                                              'ACTION: OPEN https://example.org', 'ACTION: WAIT_FOR_PAGE'])
+        self.assertEqual(len(optimized['before']), 9)
+        self.assertEqual(optimized['rules'], {'merge_sleep': 1, 'duplicate_focus': 2, 'wait_after_blocking': 1})
+        self.assertEqual(optimized['saved_s'], 3.0)
+        self.assertEqual(result['virtual_ms'], 4500.0)
+        with mock.patch('op.PLAN_OPTIMIZER_ENABLED', False):
+            self.assertEqual(op.dry_run_plan(plan, 'notes then example')['virtual_ms'], 6500.0)
+
+    def test_plan_optimizer_keeps_wait_after_youtube_fallback(self):
+        plan = 'ACTION: YOUTUBE_PLAY lofi beats\nACTION: SLEEP 2\nACTION: CLICK left'
+        # Only the search page opened: the page still loads, so the SLEEP before the click stays
+        with mock.patch.dict('op.DRY_RUN_RESULTS', {'play_youtube': 'search_opened'}):
+            result = op.dry_run_plan(plan, 'play lofi beats')
+        self.assertNotIn('optimizer', result['log'])
+        self.assertEqual(result['virtual_ms'], 2000.0)
+
+    def test_independent_launch_waits_run_concurrently(self):
+        plan = ('ACTION: OPEN alpha\nACTION: SLEEP 2\nACTION: OPEN beta\nACTION: SLEEP 3\n'
+                'ACTION: OPEN gamma\nACTION: SLEEP 1\nACTION: TYPE hi')
+        with mock.patch('op.HAS_PYGETWINDOW', True):
+            result = op.dry_run_plan(plan, 'open three apps and type hi')
+        self.assertTrue(result['ok'])
+        # Runs as long as the slowest launch, not the sum of the waits
+        self.assertEqual(result['virtual_ms'], 3000.0)
+        calls = [(e['args'][0], e['t_ms']) for e in result['timeline'] if e['call'] in ('open_path', 'switch_to_app')]
+        # Spawns stay in plan order; the last launched app is brought back to the front before typing
+        self.assertEqual(calls, [('alpha', 0.0), ('beta', 0.0), ('gamma', 0.0), ('gamma', 3000.0)])
+        self.assertEqual(result['log']['actions'][-2]['reason'], 'refocus_after_launches')
+        with mock.patch('op.LAUNCH_CONCURRENCY', False):
+            self.assertEqual(op.dry_run_plan(plan, 'open three apps and type hi')['virtual_ms'], 6000.0)
+
+    @mock.patch('op.speak')
+    @mock.patch('op.set_clipboard_and_paste')
+    def test_stop_interrupts_running_wait_and_logs_partial_status(self, mock_paste, mock_speak):
+        import tempfile
+        plan = op.PlanLineStream.from_text('ACTION: TYPE hi\nACTION: SLEEP 10\nACTION: TYPE never')
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = op.os.path.join(tmp, 'log.jsonl')
+            stopper = op.threading.Timer(0.1, op.cancel_running_plans, args=('stopped',))
+            with mock.patch('op.ACTION_LOG_FILE', log_path):
+                started = time.perf_counter()
+                stopper.start()
+                self.assertTrue(op.execute_via_ai_plan(None, 'type then wait', plan=plan))
+                elapsed = time.perf_counter() - started
+            with open(log_path, encoding='utf-8') as f:
+                entry = json.loads(f.readline())
+        self.assertLess(elapsed, 0.5)
+        mock_paste.assert_called_once_with('hi')
+        mock_speak.assert_not_called()
+        self.assertEqual(entry['status'], 'cancelled')
+        self.assertEqual(entry['cancel'], {'reason': 'stopped', 'executed': 2, 'steps': 2,
+                                           'interrupted': 'ACTION: SLEEP 10'})
+        self.assertTrue(entry['actions'][-1]['cancelled'])
+
+    @mock.patch('op.speak')
+    @mock.patch('op.set_clipboard_and_paste')
+    def test_stop_while_planner_is_still_streaming(self, mock_paste, mock_speak):
+        import tempfile
+        release = op.threading.Event()
+
+        def streaming_planner(client, messages, language='en', on_token=None, **kwargs):
+            on_token('ACTION: TYPE hi\n')
+            # The planner keeps streaming (and ignores the cancel) until the test lets it finish
+            release.wait(5)
+            on_token('ACTION: TYPE late\n')
+            return 'ACTION: TYPE hi\nACTION: TYPE late'
+
+        mock_paste.side_effect = lambda text: op.cancel_running_plans('stopped')
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = op.os.path.join(tmp, 'log.jsonl')
+            try:
+                with mock.patch('op.get_ai_response', side_effect=streaming_planner), \
+                        mock.patch('op.ACTION_LOG_FILE', log_path):
+                    started = time.perf_counter()
+                    self.assertTrue(op.execute_via_ai_plan(None, 'type hi and more'))
+                    elapsed = time.perf_counter() - started
+            finally:
+                release.set()
+            with open(log_path, encoding='utf-8') as f:
+                entry = json.loads(f.readline())
+        self.assertLess(elapsed, 2)
+        mock_paste.assert_called_once_with('hi')
+        self.assertEqual(entry['status'], 'cancelled')
+        self.assertIsNotNone(entry['timing']['plan_ms'])
+        self.assertEqual(op._ACTIVE_TOKENS, set())
+
+    @mock.patch('op.speak')
+    @mock.patch('op.switch_to_app')
+    def test_superseded_batch_skips_remaining_segments(self, mock_switch, mock_speak):
+        # The first segment's action is where the newer command arrives
+        def supersede(text):
+            op.cancel_running_plans('superseded')
+        with mock.patch('op.set_clipboard_and_paste', side_effect=supersede), \
+                mock.patch('op.get_ai_response',
+                           return_value='SEGMENT 1\nACTION: TYPE hello\nSEGMENT 2\nACTION: TYPE bye'), \
+                mock.patch('op.time.sleep'):
+            results = op.execute_batch(None, 'type hello; type bye; switch to chrome')
+        self.assertEqual([r['segment'] for r in results], ['type hello'])
+        mock_switch.assert_not_called()
+        mock_speak.assert_not_called()
+        self.assertEqual(op._ACTIVE_TOKENS, set())
+
+    def test_command_queue_runs_one_at_a_time_with_priority_and_coalescing(self):
+        gate, ran, statuses = op.threading.Event(), [], []
+
+        def runner(cmd):
+            if cmd.prompt == 'first':
+                gate.wait(2)
+            ran.append(cmd.prompt)
+            return True
+
+        queue = op.CommandQueue(runner, maxsize=3, coalesce_window=5, on_change=statuses.append)
+        first = queue.submit('first')
+        while queue.current is None:
+            time.sleep(0.01)
+        normal = queue.submit('open notepad')
+        self.assertIs(queue.submit('Open  Notepad!'), normal)
+        urgent = queue.submit('press enter', priority=op.PRIORITY_HIGH)
+        queue.submit('type hi')
+        self.assertIsNone(queue.submit('one too many'))
+        self.assertEqual(statuses[-1], 'Running... | 3 queued')
+        gate.set()
+        for cmd in (first, normal, urgent):
+            self.assertTrue(cmd.wait(2))
+        op.time.sleep(0.05)
+        self.assertEqual(ran, ['first', 'press enter', 'open notepad', 'type hi'])
+        self.assertEqual(normal.coalesced, 1)
+        self.assertEqual(queue.stats['rejected'], 1)
+        self.assertEqual(queue.status_text(), 'Idle')
+
+    @mock.patch('op.speak')
+    def test_voice_command_runs_on_worker_and_stop_cancels_it(self, mock_speak):
+        queue = op.CommandQueue(lambda cmd: self.fail('the command brings its own runner'))
+        plan = op.PlanLineStream.from_text('ACTION: SLEEP 10')
+        started = time.perf_counter()
+        cmd = queue.submit('wait a bit', run=lambda c: op.execute_via_ai_plan(None, c.prompt, plan=plan))
+        # The caller (the voice loop) is free again at once and can hear "stop"
+        self.assertLess(time.perf_counter() - started, 0.5)
+        while not op._ACTIVE_TOKENS:
+            time.sleep(0.01)
+        self.assertEqual(op.cancel_running_plans('stopped'), 1)
+        self.assertTrue(cmd.finished.wait(2))
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertTrue(cmd.result)
+
+    def test_superseding_command_drops_queued_and_cancels_running(self):
+        gate = op.threading.Event()
+        queue = op.CommandQueue(lambda cmd: gate.wait(2) if cmd.prompt == 'slow' else True)
+        queue.submit('slow')
+        while queue.current is None:
+            time.sleep(0.01)
+        stale = queue.submit('stale')
+        with mock.patch('op.cancel_running_plans', side_effect=lambda reason: gate.set() or 1) as cancel:
+            fresh = queue.submit('fresh', supersede=True)
+        cancel.assert_called_once_with('superseded')
+        self.assertEqual(stale.state, 'superseded')
+        self.assertTrue(fresh.wait(2))
+
+    def test_macro_saved_from_log_replays_without_llm(self):
+        import tempfile
+        logged = [
+            {'user_command': 'open my music', 'plan': 'ACTION: OPEN music\nACTION: PRESS space',
+             'actions': [{'action': 'OPEN', 'target': 'C:\\Apps\\Music.exe', 'result': 'opened_fallback'},
+                         {'action': 'PRESS', 'keys': 'space', 'result': 'pressed'}],
+             'timing': {'total_ms': 2400.0, 'plan_ms': 900.0}},
+            {'user_command': 'stopped halfway', 'plan': 'ACTION: SLEEP 5', 'actions': [], 'status': 'cancelled'},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = op.os.path.join(tmp, 'log.jsonl')
+            with open(log_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(json.dumps(e) for e in logged) + '\n')
+            store = op.MacroStore(op.os.path.join(tmp, 'macros.json'))
+            with mock.patch('op.MACROS', store):
+                macro = op.save_macro_from_log('Morning', last=2, log_path=log_path)
+                self.assertEqual([s['command'] for s in macro['steps']], ['open my music'])
+                self.assertEqual(macro['steps'][0]['targets'], {'music': 'C:\\Apps\\Music.exe'})
+                self.assertIsNotNone(op.MacroStore(store.path).get('morning'))
+                with mock.patch('op.get_ai_response') as planner, mock.patch('op.resolve_open_target') as resolver:
+                    with op.DryRun() as dry:
+                        self.assertTrue(op.execute_via_ai_plan(None, 'run macro morning'))
+                    with op.DryRun():
+                        report = op.run_macro('morning')
+        planner.assert_not_called()
+        resolver.assert_not_called()
+        # The OPEN target is the one resolved when the turn was logged
+        self.assertEqual([e['args'] for e in dry.timeline if e['kind'] == 'launcher'], [['C:\\Apps\\Music.exe']])
+        # The replayed step is logged as part of the macro, then the 'run macro' turn itself
+        self.assertEqual(dry.log_entries[-2]['batch']['macro'], 'morning')
+        self.assertEqual(dry.log_entries[-1]['intent']['handler'], 'macro')
+        self.assertEqual(report['llm_calls'], 0)
+        self.assertEqual(report['original_ms'], 2400.0)
+        self.assertTrue(report['ok'])
+
+    def test_action_records_are_timed_and_aggregated_per_action_target_and_hour(self):
+        import perf_report
+        plan = 'ACTION: OPEN notepad\nACTION: SLEEP 2\nACTION: OPEN calc\nACTION: SLEEP 3\nACTION: TYPE hi'
+        entry = op.dry_run_plan(plan, 'two apps', ready_after=0.5)['log']
+        sleeps = [a for a in entry['actions'] if a['action'] == 'SLEEP']
+        # Both startup waits ran concurrently, each until its app was ready
+        # (first poll after 0.5 s, plus the settle time)
+        self.assertEqual([(a['target'], a['duration_ms']) for a in sleeps], [('notepad.exe', 700.0), ('calc', 700.0)])
+        self.assertEqual(sleeps[0]['started_at'], sleeps[1]['started_at'])
+        typed = entry['actions'][-1]
+        self.assertEqual((typed['action'], typed['duration_ms']), ('TYPE', 0.0))
+        self.assertEqual(entry['timing']['execute_ms'], 700.0)
+        self.assertIn('resolve_ms', entry['timing'])
+
+        report = perf_report.build_report([entry, dict(entry, timestamp=entry['timestamp'] + 3600)])
+        self.assertEqual(report['actions'][0], {'key': 'SLEEP', 'count': 4, 'p50': 700.0, 'p95': 700.0, 'p99': 700.0})
+        self.assertEqual(sorted(r['key'] for r in report['targets']), ['calc', 'notepad.exe'])
+        self.assertEqual(len(report['hours']), 2)
+        self.assertEqual(report['hours'][0]['execute_ms']['p50'], 700.0)
+
+    def test_split_compound_command(self):
+        self.assertEqual(op.split_compound_command('open chrome then press enter and switch to notepad'),
+                         ['open chrome', 'press enter', 'switch to notepad'])
+        self.assertEqual(op.split_compound_command('press enter, open chrome; switch to notepad'),
+                         ['press enter', 'open chrome', 'switch to notepad'])
+        # 'and' inside a query is not a command boundary
+        self.assertEqual(op.split_compound_command('search cats and dogs'), ['search cats and dogs'])
+
+    def test_split_compound_command_keeps_dictated_text_whole(self):
+        self.assertEqual(op.split_compound_command('write a story about a boy who went to school then came home'),
+                         ['write a story about a boy who went to school then came home'])
+        self.assertEqual(op.split_compound_command('open notepad then type hello and switch to chrome'),
+                         ['open notepad', 'type hello and switch to chrome'])
+        # Only an explicit ';' ends the payload
+        self.assertEqual(op.split_compound_command('type hello, press enter; open chrome'),
+                         ['type hello, press enter', 'open chrome'])
+        # The text goes into the app opened first, through the planner, not the write intent
+        self.assertEqual(op.split_compound_command('open notepad and write hi'), ['open notepad and write hi'])
+        self.assertEqual(op.split_compound_command('open chrome and open notepad and write hi'),
+                         ['open chrome', 'open notepad and write hi'])
+        self.assertIsNone(op.match_local_intent('open notepad and write hi')[0])
+
+    @mock.patch('op.speak')
+    @mock.patch('op.switch_to_app')
+    @mock.patch('op.set_clipboard_and_paste')
+    def test_execute_batch_plans_all_segments_in_one_call(self, mock_paste, mock_switch, mock_speak):
+        batch_plan = ('SEGMENT 1\nACTION: SEARCH cats\nSEGMENT 2\nACTION: PRESS enter\n'
+                      'SEGMENT 3\nACTION: TYPE hello')
+        lookups = op.get_intent_stats()['lookups']
+        with mock.patch('op.get_ai_response', return_value=batch_plan) as mock_ai, \
+                mock.patch('op.webbrowser.open'), mock.patch('op.detect_and_set_browser_context'), \
+                mock.patch('op.pyautogui', create=True), mock.patch('op.HAS_PYAUTOGUI', True):
+            results = op.execute_batch(None, 'search cats then press enter and switch to chrome then type hello')
+        self.assertEqual(mock_ai.call_count, 1)
+        self.assertEqual(mock_ai.call_args.kwargs['call_site'], 'batch_planner')
+        self.assertIn('batch_planner', op.LLM_CACHE_SKIP_SITES)
+        self.assertEqual([r['segment'] for r in results],
+                         ['search cats', 'press enter', 'switch to chrome', 'type hello'])
+        self.assertEqual([r['source'] for r in results], ['batch', 'batch', 'intent', 'batch'])
+        # Each segment is matched against the grammar once
+        self.assertEqual(op.get_intent_stats()['lookups'] - lookups, 4)
+        self.assertTrue(all(r['ok'] for r in results))
+        mock_paste.assert_called_once_with('hello')
+        mock_switch.assert_called_once()
+        mock_speak.assert_called_once_with('Done', 'en')
+
+    def test_stop_cancels_in_flight_async_stream(self):
+        import asyncio
+        import threading
+        from groq import Groq
+        closed = threading.Event()
+        first_chunk = threading.Event()
+
+        class Chunk:
+            def __init__(self, content):
+                self.choices = [mock.Mock(delta=mock.Mock(content=content))]
+                self.usage = None
+                self.x_groq = None
+
+        class HangingStream:
+            def __init__(self):
+                self.sent = False
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                if not self.sent:
+                    self.sent = True
+                    return Chunk('partial')
+                await asyncio.sleep(30)
+                raise StopAsyncIteration
+
+            async def close(self):
+                closed.set()
+
+        async def create(**kwargs):
+            return HangingStream()
+
+        fake_async = mock.Mock()
+        fake_async.chat.completions.create = create
+
+        def on_token(content):
+            first_chunk.set()
+            threading.Timer(0.05, op.cancel_llm_requests).start()
+
+        with mock.patch('op.get_async_client', return_value=fake_async):
+            started = time.time()
+            with self.assertRaises(op.LLMCancelled):
+                op.get_ai_response(Groq(api_key='test'), [{'role': 'user', 'content': 'hi'}],
+                                   on_token=on_token, echo=False)
+        self.assertTrue(first_chunk.is_set())
+        self.assertLess(time.time() - started, 5)
+        self.assertTrue(closed.wait(2))
+
+    def test_stop_cancels_sync_long_text_generation(self):
+        class Chunk:
+            def __init__(self, content):
+                self.choices = [mock.Mock(delta=mock.Mock(content=content))]
+
+        class FakeClient:
+            class chat:
+                class completions:
+                    @staticmethod
+                    def create(**kwargs):
+                        def gen():
+                            yield Chunk('First paragraph. ')
+                            op.cancel_llm_requests()
+                            yield Chunk('Never delivered.')
+                        return gen()
+
+        self.assertEqual(op.generate_long_text(FakeClient(), 'essay', progress=False), '')
+
+    def test_long_text_stream_aborts_when_on_text_fails(self):
+        class Chunk:
+            def __init__(self, content):
+                self.choices = [mock.Mock(delta=mock.Mock(content=content))]
+
+        delivered = []
+
+        class FakeClient:
+            class chat:
+                class completions:
+                    @staticmethod
+                    def create(**kwargs):
+                        if not kwargs.get('stream', True):
+                            raise AssertionError('must not fall back to a second, non-streamed request')
+
+                        def gen():
+                            for text in ['One. ', 'Two. ', 'Three.']:
+                                delivered.append(text)
+                                yield Chunk(text)
+                        return gen()
+
+        def failing_sink(text):
+            raise RuntimeError('paste failed')
+
+        with self.assertRaises(op.TextSinkError):
+            op.generate_long_text(FakeClient(), 'essay', progress=False, on_text=failing_sink)
+        self.assertEqual(delivered, ['One. '])
+
+    def test_llm_calls_traced_per_call_site(self):
+        import os
+        import tempfile
+
+        class Chunk:
+            def __init__(self, content):
+                self.choices = [mock.Mock(delta=mock.Mock(content=content))]
+                self.usage = None
+                self.x_groq = None
+
+        class FakeClient:
+            class chat:
+                class completions:
+                    @staticmethod
+                    def create(**kwargs):
+                        return iter([Chunk('ACTION: '), Chunk('SLEEP 0')])
+
+        class BrokenClient:
+            class chat:
+                class completions:
+                    @staticmethod
+                    def create(**kwargs):
+                        raise RuntimeError('rate limited')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            trace = os.path.join(tmp, 'trace.jsonl')
+            with mock.patch('op.LLM_TRACE_FILE', trace), mock.patch.dict('op.LLM_CALLS', clear=True):
+                op.get_ai_response(FakeClient(), [{'role': 'user', 'content': 'nap'}], echo=False,
+                                   call_site='planner')
+                with self.assertRaises(RuntimeError):
+                    op.get_ai_response(BrokenClient(), [{'role': 'user', 'content': 'hi'}], echo=False)
+                summary = op.get_llm_call_summary()
+            with open(trace, 'r', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual([r['call_site'] for r in records], ['planner', 'conversation'])
+        self.assertIsNotNone(records[0]['ttft_ms'])
+        self.assertGreater(records[0]['completion_tokens'], 0)
+        self.assertIn('rate limited', records[1]['error'])
+        self.assertEqual(summary['planner']['calls'], 1)
+        self.assertEqual(summary['conversation']['errors'], 1)
+
+    def test_conversation_memory_stays_within_budget(self):
+        memory = op.ConversationMemory(client=None, max_messages=10, token_budget=100, summary_tokens=40)
+        for i in range(30):
+            memory.add('user', f'question {i} ' + 'x' * 60)
+            memory.add('assistant', f'answer {i} ' + 'y' * 60)
+            sent = memory.messages()
+            self.assertLessEqual(sum(op.estimate_tokens(m['content']) for m in sent), 100 + 20)
+            self.assertEqual(sent[-1]['content'], f'answer {i} ' + 'y' * 60)
+        self.assertTrue(memory.needs_compaction())
+        self.assertTrue(memory.compact())
+        self.assertFalse(memory.needs_compaction())
+        self.assertLessEqual(len(memory.summary), 40 * 4)
+        self.assertEqual(memory.messages()[0]['role'], 'system')
+        self.assertIn('Summary of the earlier conversation', memory.messages()[0]['content'])
+
+    def test_conversation_memory_compacts_in_background_and_persists(self):
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'memory.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump([{'role': 'user', 'content': 'my name is Sam ' * 20},
+                           {'role': 'assistant', 'content': 'Nice to meet you ' * 20}], f)
+            memory = op.ConversationMemory(client=object(), path=path, token_budget=60)
+            self.assertTrue(memory.load())
+            memory.add('user', 'what is my name?')
+            with mock.patch('op.get_ai_response', return_value='User is Sam.') as mock_ai:
+                memory.compact_async().join(timeout=5)
+            self.assertEqual(mock_ai.call_args.kwargs['call_site'], 'memory_summary')
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        self.assertEqual(saved['summary'], 'User is Sam.')
+        self.assertEqual([m['content'] for m in saved['messages']], ['what is my name?'])
+
+    def test_generate_long_text_sections_mode_writes_sections_concurrently(self):
+        import threading
+        barrier = threading.Barrier(2, timeout=2)
+
+        class Chunk:
+            def __init__(self, content):
+                self.choices = [mock.Mock(delta=mock.Mock(content=content))]
+
+        class FakeClient:
+            class chat:
+                class completions:
+                    @staticmethod
+                    def create(**kwargs):
+                        prompt = kwargs['messages'][-1]['content']
+                        if prompt.startswith('Plan the structure'):
+                            return iter([Chunk('1. Intro\n2. Middle\n'), Chunk('3. End')])
+                        heading = re.search(r"Write ONLY the section '(.*?)'", prompt).group(1)
+                        if heading in ('Intro', 'Middle'):
+                            # Both sections must be generating at the same time to pass the barrier
+                            barrier.wait()
+                        return iter([Chunk(heading + '\n'), Chunk(f'Body of {heading}.')])
+
+        text = op.generate_long_text(FakeClient(), 'essay on tests', progress=False, mode='sections')
+        self.assertEqual(text, 'Intro\nBody of Intro.\n\nMiddle\nBody of Middle.\n\nEnd\nBody of End.')
+
+    @mock.patch('op.set_clipboard_and_paste')
+    @mock.patch('op.open_path')
+    def test_essay_path_uses_sectioned_generation(self, mock_open_path, mock_set_clip):
+        with mock.patch('op.generate_long_text', return_value='ESSAY') as gen, mock.patch('op.time.sleep'):
+            self.assertTrue(op.execute_via_ai_plan(object(), 'write essay on caching'))
+        self.assertEqual(gen.call_args.kwargs['mode'], op.ESSAY_GENERATION_MODE)
+
+    @mock.patch('op.set_clipboard_and_paste')
+    @mock.patch('op.open_path')
+    def test_handler_intent_is_logged_and_cancellable(self, mock_open_path, mock_set_clip):
+        running = []
+
+        def generate(client, prompt, **kwargs):
+            # The handler runs under the turn's registered token, so "stop" reaches it
+            running.append(sorted(t.command for t in op._ACTIVE_TOKENS))
+            if 'stop me' in prompt:
+                op.cancel_running_plans('stopped')
+            return 'ESSAY'
+
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = op.os.path.join(tmp, 'log.jsonl')
+            with mock.patch('op.generate_long_text', side_effect=generate), mock.patch('op.time.sleep'), \
+                    mock.patch('op.ACTION_LOG_FILE', log_path):
+                self.assertTrue(op.execute_via_ai_plan(object(), 'write essay on caching'))
+                op.execute_via_ai_plan(object(), 'write essay on stop me')
+            entries = op.load_action_log(log_path)
+            self.assertIsNone(op.save_macro_from_log('essays', last=2, log_path=log_path))
+        self.assertEqual(running, [['write essay on caching'], ['write essay on stop me']])
+        self.assertEqual([e['status'] for e in entries], ['completed', 'cancelled'])
+        self.assertEqual(entries[0]['intent']['handler'], 'essay')
+        self.assertIsNotNone(entries[0]['timing']['total_ms'])
+        self.assertEqual(entries[1]['cancel']['reason'], 'stopped')
+        self.assertFalse(op._ACTIVE_TOKENS)
+
+    @mock.patch('op.set_clipboard_and_paste')
+    def test_essay_paragraphs_pasted_while_still_generating(self, mock_set_clip):
+        import threading
+        first_pasted = threading.Event()
+        mock_set_clip.side_effect = lambda text: first_pasted.set()
+        seen_mid_stream = []
+
+        def fake_generate(client, prompt, language='en', on_text=None, **kwargs):
+            on_text('First paragraph.\n\nSecond ')
+            # The first paragraph must reach the window before generation finishes
+            seen_mid_stream.append(first_pasted.wait(timeout=2))
+            on_text('paragraph.')
+            return 'First paragraph.\n\nSecond paragraph.'
+
+        with mock.patch('op.generate_long_text', side_effect=fake_generate), \
+                mock.patch('op._active_window_title', return_value=None):
+            self.assertTrue(op.execute_via_ai_plan(object(), 'type essay on streaming'))
+        self.assertEqual(seen_mid_stream, [True])
+        pasted = [c[0][0] for c in mock_set_clip.call_args_list]
+        self.assertEqual(pasted, ['First paragraph.\n\n', 'Second paragraph.'])
+
+    @mock.patch('op.set_clipboard_and_paste')
+    def test_progressive_paste_stops_when_focus_is_lost(self, mock_set_clip):
+        titles = iter(['Notepad', 'Notepad', 'Browser'])
+        with mock.patch('op._active_window_title', side_effect=lambda: next(titles, 'Browser')), \
+                mock.patch('op.PASTE_FOCUS_WAIT', 0.2):
+            paster = op.ProgressivePaster()
+            paster.start()
+            paster.feed('One.\n\n')
+            paster.feed('Two.\n\nThree.')
+            self.assertFalse(paster.finish('One.\n\nTwo.\n\nThree.'))
+        self.assertEqual([c[0][0] for c in mock_set_clip.call_args_list], ['One.\n\n'])
+        self.assertTrue(paster.summary()['focus_lost'])
+
+    def test_response_cache_replays_identical_requests(self):
+        import tempfile
+        from groq import Groq
+        from stub_llm_server import StubLLMServer
+        server = StubLLMServer(('127.0.0.1', 0), responder=lambda messages: 'URL:https://example.com/')
+        server.start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                cache = op.ResponseCache(tmp, max_entries=8)
+                client = Groq(api_key='test', base_url=server.base_url)
+                messages = [{'role': 'user', 'content': 'normalize example'}]
+                with mock.patch('op.RESPONSE_CACHE', cache):
+                    first = op.get_ai_response(client, messages, echo=False, call_site='resolve_target')
+                    tokens = []
+                    second = op.get_ai_response(client, messages, on_token=tokens.append, echo=False,
+                                                call_site='resolve_target')
+                    # Conversation is opted out: every turn reaches the model
+                    op.get_ai_response(client, messages, echo=False, call_site='conversation')
+                    op.get_ai_response(client, messages, echo=False, call_site='conversation')
+                    self.assertTrue(op.LLM_CALLS['resolve_target'][-1]['cached'])
+                    # A fresh process reads the disk tier
+                    with mock.patch('op.RESPONSE_CACHE', op.ResponseCache(tmp)):
+                        third = op.get_ai_response(client, messages, echo=False, call_site='resolve_target')
+                        self.assertEqual(op.RESPONSE_CACHE.stats()['disk_hits'], 1)
+                stats = cache.stats()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(first, 'URL:https://example.com/')
+        self.assertEqual(second, first)
+        self.assertEqual(third, first)
+        # Replayed as a stream through the normal token path
+        self.assertEqual(''.join(tokens), first)
+        self.assertEqual(server.requests_served, 3)
+        self.assertEqual(stats['memory_hits'], 1)
+        self.assertEqual(stats['by_site']['resolve_target']['hit_ratio'], 0.5)
+
+    def test_response_cache_skips_creative_call_sites(self):
+        client = mock.Mock(base_url='http://127.0.0.1:1/')
+        request = {'model': 'm', 'messages': [{'role': 'user', 'content': 'write an essay on rain'}]}
+        with mock.patch('op.LLM_CACHE_ENABLED', True):
+            for site in ['essay', 'essay_outline', 'essay_section', 'write', 'code', 'long_text_section']:
+                self.assertIsNone(op._response_cache_key(client, {'call_site': site}, request), site)
+            self.assertIsNotNone(op._response_cache_key(client, {'call_site': 'resolve_target'}, request))
+
+    def test_response_cache_ttl_and_disk_cap(self):
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = op.ResponseCache(tmp, max_entries=2, max_disk_bytes=300, ttl=60)
+            for i in range(5):
+                cache.put(f'key{i}', 'x' * 100)
+            self.assertLessEqual(sum(os.path.getsize(os.path.join(tmp, n)) for n in os.listdir(tmp)), 300)
+            self.assertEqual(cache.get('key4'), 'x' * 100)
+            self.assertIsNone(cache.get('key0'))
+            with mock.patch('op.time.time', return_value=op.time.time() + 120):
+                self.assertIsNone(cache.get('key4'))
+
+    def test_slow_primary_is_hedged_to_fallback_model(self):
+        from groq import Groq
+        from stub_llm_server import StubLLMServer
+        server = StubLLMServer(('127.0.0.1', 0), responder=lambda messages: 'fast answer',
+                               model_delays={'primary-model': 3.0})
+        server.start()
+        try:
+            client = Groq(api_key='test', base_url=server.base_url)
+            with mock.patch.dict('os.environ', {'GROQ_MODEL': 'primary-model'}), \
+                    mock.patch('op.LLM_FALLBACK_MODEL', 'fallback-model'), mock.patch('op.LLM_HEDGE_AFTER_MS', 100), \
+                    mock.patch('op.LLM_CACHE_ENABLED', False):
+                started = time.time()
+                res = op.get_ai_response(client, [{'role': 'user', 'content': 'hi'}], echo=False,
+                                         call_site='hedge_test')
+                elapsed = time.time() - started
+                record = op.LLM_CALLS['hedge_test'][-1]
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(res, 'fast answer')
+        self.assertLess(elapsed, 2.0)
+        self.assertTrue(record['hedged'])
+        self.assertEqual(record['model'], 'fallback-model')
+        self.assertEqual(record['requested_model'], 'primary-model')
+
+    def test_non_retryable_error_fails_fast_without_hedging(self):
+        from groq import BadRequestError, Groq
+        from stub_llm_server import StubLLMServer
+        server = StubLLMServer(('127.0.0.1', 0), responder=lambda messages: 'fallback answer',
+                               model_errors={'primary-model': 400})
+        server.start()
+        try:
+            client = Groq(api_key='test', base_url=server.base_url)
+            with mock.patch.dict('os.environ', {'GROQ_MODEL': 'primary-model'}), \
+                    mock.patch('op.LLM_FALLBACK_MODEL', 'fallback-model'), mock.patch('op.LLM_HEDGE_AFTER_MS', 1000), \
+                    mock.patch('op.LLM_CACHE_ENABLED', False):
+                started = time.time()
+                with self.assertRaises(BadRequestError):
+                    op.get_ai_response(client, [{'role': 'user', 'content': 'hi'}], echo=False,
+                                       call_site='bad_request_test')
+                elapsed = time.time() - started
+                record = op.LLM_CALLS['bad_request_test'][-1]
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual(server.requested_models, ['primary-model'])
+        self.assertFalse(record['hedged'])
+        self.assertEqual(record['retries'], 0)
+
+    def test_rate_limited_request_backs_off_with_retry_after(self):
+        from groq import Groq
+        from stub_llm_server import StubLLMServer
+        server = StubLLMServer(('127.0.0.1', 0), responder=lambda messages: 'ok', rate_limit_first=1, retry_after=0.3)
+        server.start()
+        try:
+            client = Groq(api_key='test', base_url=server.base_url)
+            with mock.patch('op.LLM_FALLBACK_MODEL', ''), mock.patch('op.LLM_CACHE_ENABLED', False):
+                started = time.time()
+                res = op.get_ai_response(client, [{'role': 'user', 'content': 'hi'}], echo=False, call_site='429_test')
+                elapsed = time.time() - started
+                record = op.LLM_CALLS['429_test'][-1]
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(res, 'ok')
+        self.assertGreaterEqual(elapsed, 0.3)
+        self.assertEqual(record['retries'], 1)
+        self.assertEqual(server.rate_limited, 1)
+
+    def test_replay_harness_against_stub_server(self):
+        import replay_bench
+        from stub_llm_server import StubLLMServer
+        plans = {'launch the editor please': 'ACTION: OPEN notepad', 'take a short nap': 'ACTION: SLEEP 5'}
+        server = StubLLMServer(('127.0.0.1', 0), plans, token_delay=0.001)
+        server.start()
+        log_file = op.ACTION_LOG_FILE
+        try:
+            report = replay_bench.run_replay(list(plans), server.base_url, repeat=2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(report['commands'], 4)
+        self.assertEqual(report['failures'], 0)
+        self.assertEqual(server.requests_served, 4)
+        self.assertIsNotNone(report['ttfa_ms']['p50'])
+        self.assertGreater(report['commands_per_sec'], 0)
+        # Desktop backends and the action log are restored after the replay
+        self.assertEqual(op.open_path.__name__, 'open_path')
+        self.assertEqual(op.ACTION_LOG_FILE, log_file)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Offline token report for Nova's LLM call sites.
+
+Prints the estimated prompt size of every call site (no API calls are made), the
+prompt/completion token usage recorded in the action log, grouped by planner prompt version,
+and the per-call-site latency summary from the LLM trace (llm_trace.jsonl).
+
+Usage:
+    python token_report.py
+    python token_report.py --log path/to/action_log.jsonl --trace path/to/llm_trace.jsonl
+"""
+
+import argparse
+import json
+import os
+
+import op
+
+
+def call_site_prompts(language='en'):
+    """(call site, messages, completion cap) for each LLM call site, rendered with sample inputs."""
+    max_tokens = int(os.getenv('MAX_TOKENS', '200'))
+    long_max = int(os.getenv('LONG_MAX_TOKENS', '800'))
+    persona = op._persona_system_prompt(language)
+    control = (op.CONTROL_PREPROMPT + "\n" + persona) if op.system_control_enabled() else persona
+    return [
+        ('planner', [{'role': 'system', 'content': op.PLANNER_PROMPT},
+                     {'role': 'user', 'content': 'open notepad and type hello'}], max_tokens),
+        ('resolve_target', [{'role': 'system', 'content': persona},
+                            {'role': 'user', 'content': op.build_normalizer_prompt('insta', 'open insta chats')}],
+         max_tokens),
+        ('long_text', [{'role': 'system', 'content': op._long_text_system_prompt(language)},
+                       {'role': 'user', 'content': 'Write a detailed essay on testing.'}], long_max),
+        ('plan_and_execute', [{'role': 'system', 'content': control},
+                              {'role': 'user', 'content': op.build_step_plan_prompt('chrome', 'search', 'news')}],
+         max_tokens),
+        ('conversation', [{'role': 'system', 'content': control},
+                          {'role': 'user', 'content': 'how are you today?'}], max_tokens),
+    ]
+
+
+def print_prompt_sizes(language='en'):
+    print(f"Planner prompt {op.PLANNER_PROMPT_VERSION}: {op.estimate_tokens(op.PLANNER_PROMPT)} tokens "
+          f"(budget {op.PLANNER_PROMPT_TOKEN_BUDGET})")
+    print(f"\n{'call site':<18}{'prompt tok':>12}{'max completion':>16}")
+    for site, messages, cap in call_site_prompts(language):
+        prompt_tokens = sum(op.estimate_tokens(m['content']) for m in messages)
+        print(f"{site:<18}{prompt_tokens:>12}{cap:>16}")
+
+
+def print_logged_usage(log_path):
+    by_version = {}
+    try:
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                tokens = entry.get('tokens')
+                if not tokens:
+                    continue
+                stats = by_version.setdefault(entry.get('prompt_version', 'unversioned'),
+                                              {'turns': 0, 'prompt': 0, 'completion': 0, 'estimated': 0})
+                stats['turns'] += 1
+                stats['prompt'] += tokens.get('prompt', 0)
+                stats['completion'] += tokens.get('completion', 0)
+                stats['estimated'] += 1 if tokens.get('estimated') else 0
+    except OSError as e:
+        print(f"\n[TOKEN REPORT] Could not read {log_path}: {e}")
+        return
+    print(f"\nPlanner usage recorded in {os.path.basename(log_path)}:")
+    if not by_version:
+        print("  (no turns with token usage yet)")
+        return
+    print(f"{'prompt version':<18}{'turns':>7}{'avg prompt':>12}{'avg compl.':>12}{'estimated':>11}")
+    for version, stats in sorted(by_version.items()):
+        n = stats['turns']
+        print(f"{version:<18}{n:>7}{stats['prompt'] / n:>12.0f}{stats['completion'] / n:>12.0f}"
+              f"{stats['estimated']:>11}")
+
+
+def print_trace_summary(trace_path):
+    records = []
+    try:
+        with open(trace_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError as e:
+        print(f"\n[TOKEN REPORT] Could not read {trace_path}: {e}")
+        return
+    print(f"\nLLM calls recorded in {os.path.basename(trace_path)}:")
+    if not records:
+        print("  (no calls traced yet)")
+        return
+
+    def ms(v):
+        return f"{v:>9.0f}" if v is not None else f"{'-':>9}"
+
+    summary = op.summarize_llm_calls(records)
+    print(f"{'call site':<18}{'calls':>6}{'err':>5}{'retry':>6}{'ttft p50':>9}{'ttft p95':>9}"
+          f"{'dur p50':>9}{'dur p95':>9}{'total s':>9}{'tok/s':>7}{'prompt':>8}{'compl.':>8}")
+    # Sorted by total time spent, so the call site dominating voice-to-action latency comes first
+    for site, row in sorted(summary.items(), key=lambda kv: -kv[1]['duration_total_ms']):
+        rate = f"{row['tokens_per_sec_avg']:>7.0f}" if row['tokens_per_sec_avg'] is not None else f"{'-':>7}"
+        print(f"{site:<18}{row['calls']:>6}{row['errors']:>5}{row['retries']:>6}{ms(row['ttft_p50_ms'])}"
+              f"{ms(row['ttft_p95_ms'])}{ms(row['duration_p50_ms'])}{ms(row['duration_p95_ms'])}"
+              f"{row['duration_total_ms'] / 1000.0:>9.1f}{rate}{row['prompt_tokens']:>8}{row['completion_tokens']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report prompt/completion token counts per LLM call site.")
+    parser.add_argument('--log', default=op.ACTION_LOG_FILE, help='action log to read (default: action_log.jsonl)')
+    parser.add_argument('--trace', default=op.LLM_TRACE_FILE, help='LLM call trace to read (default: llm_trace.jsonl)')
+    parser.add_argument('--language', default='en')
+    args = parser.parse_args()
+    print_prompt_sizes(args.language)
+    print_logged_usage(args.log)
+    if args.trace:
+        print_trace_summary(args.trace)
+
+
+if __name__ == '__main__':
+    main()